@@ -0,0 +1,109 @@
+#!/usr/local/bin/python3
+
+"""
+Make a synthetic GEDCOM file of descendants for timing tests.
+Starting from one couple, each family gets a random number of children
+and most children marry. A few marry a cousin so that the same
+people can appear in more than one place (pedigree collapse).
+
+Usage: make-gedcom.py generations seed [max-children] [cousin-fraction] > out.ged
+The top person is @I1@
+"""
+
+import sys
+import random
+
+
+def make_tree( n_gen, max_children, cousin_fraction ):
+    people = dict()
+    families = dict()
+
+    def add_person( name ):
+        indi = 'I' + str( len(people) + 1 )
+        people[indi] = {'name':name, 'fams':[], 'famc':[], 'birth':random.randint( 1700, 2000 )}
+        return indi
+
+    def add_family( husb, wife ):
+        fam = 'F' + str( len(families) + 1 )
+        families[fam] = {'husb':husb, 'wife':wife, 'chil':[]}
+        people[husb]['fams'].append( fam )
+        people[wife]['fams'].append( fam )
+        return fam
+
+    top = add_person( 'Adam /Root/' )
+    spouse = add_person( 'Eve /Root/' )
+    generation = [add_family( top, spouse )]
+
+    for gen in range( n_gen ):
+        children = []
+        for fam in generation:
+            # make sure the first generation isn't empty
+            n_children = random.randint( 1 if gen == 0 else 0, max_children )
+            for _ in range( n_children ):
+                child = add_person( 'Kid' + str( len(people) + 1 ) + ' /Gen' + str( gen + 1 ) + '/' )
+                families[fam]['chil'].append( child )
+                people[child]['famc'].append( fam )
+                children.append( child )
+
+        generation = []
+        for child in children:
+            if people[child]['fams'] or random.random() > 0.7:
+               continue
+            spouse = None
+            if random.random() < cousin_fraction:
+               spouse = random.choice( children )
+               if spouse == child or people[spouse]['fams']:
+                  spouse = None
+            if spouse is None:
+               spouse = add_person( 'Spouse' + str( len(people) + 1 ) + ' /Other/' )
+            generation.append( add_family( child, spouse ) )
+            if random.random() < 0.1:
+               # a second marriage
+               generation.append( add_family( child, add_person( 'Second' + str( len(people) + 1 ) + ' /Other/' ) ) )
+
+    return people, families
+
+
+def output_gedcom( people, families ):
+    print( '0 HEAD' )
+    print( '1 GEDC' )
+    print( '2 VERS 5.5.1' )
+    print( '2 FORM LINEAGE-LINKED' )
+    print( '1 CHAR UTF-8' )
+    for indi in people:
+        print( '0 @' + indi + '@ INDI' )
+        print( '1 NAME ' + people[indi]['name'] )
+        print( '1 BIRT' )
+        print( '2 DATE ' + str( people[indi]['birth'] ) )
+        for fam in people[indi]['fams']:
+            print( '1 FAMS @' + fam + '@' )
+        for fam in people[indi]['famc']:
+            print( '1 FAMC @' + fam + '@' )
+    for fam in families:
+        print( '0 @' + fam + '@ FAM' )
+        print( '1 HUSB @' + families[fam]['husb'] + '@' )
+        print( '1 WIFE @' + families[fam]['wife'] + '@' )
+        for child in families[fam]['chil']:
+            print( '1 CHIL @' + child + '@' )
+    print( '0 TRLR' )
+
+
+if len( sys.argv ) < 3:
+   print( 'Usage:', sys.argv[0], 'generations seed [max-children] [cousin-fraction]', file=sys.stderr )
+   sys.exit(1)
+
+max_children = 4
+if len( sys.argv ) > 3:
+   max_children = int( sys.argv[3] )
+
+cousin_fraction = 0.05
+if len( sys.argv ) > 4:
+   cousin_fraction = float( sys.argv[4] )
+
+random.seed( int( sys.argv[2] ) )
+
+people, families = make_tree( int( sys.argv[1] ), max_children, cousin_fraction )
+
+output_gedcom( people, families )
+
+print( len( people ), 'people', file=sys.stderr )
@@ -0,0 +1,103 @@
+#!/usr/local/bin/python3
+
+"""
+Compare writing the chart output with a print for every line
+against collecting the lines and writing large blocks as in the
+OutputSink of fan-chart.py
+
+Give an SVG file, made by fan-chart.py, as the source of lines.
+The lines are written to a file in the system temp directory
+using each method; bytes per second is shown for each.
+
+Usage: output-speed.py chart.svg [repeats]
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+# same as in fan-chart.py
+output_block_size = 1024 * 1024
+
+
+class OutputSink:
+    # copy of the fan-chart.py version
+
+    def __init__( self, outf, block_size=output_block_size ):
+        self.outf = outf
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+
+    def write( self, text ):
+        self.parts.append( text )
+        self.size += len( text )
+        if self.size >= self.block_size:
+           self.flush()
+
+    def flush( self ):
+        if self.parts:
+           self.outf.write( ''.join( self.parts ) )
+           self.parts = []
+           self.size = 0
+
+    def close( self ):
+        self.flush()
+        self.outf.close()
+
+
+def with_print( lines, out_name ):
+    # the previous output method, stdout redirected to a file
+    with open( out_name, 'w', encoding='utf-8' ) as outf:
+       for line in lines:
+           print( line, file=outf )
+
+
+def with_sink( lines, out_name ):
+    sink = OutputSink( open( out_name, 'w', encoding='utf-8' ) )
+    for line in lines:
+        sink.write( line + '\n' )
+    sink.close()
+
+
+def with_print_unbuffered( lines, out_name ):
+    # as if std-out were a terminal or a line buffered pipe
+    with open( out_name, 'w', encoding='utf-8', buffering=1 ) as outf:
+       for line in lines:
+           print( line, file=outf )
+
+
+def time_it( method, lines, out_name, repeats ):
+    best = None
+    for _ in range( repeats ):
+        start = time.perf_counter()
+        method( lines, out_name )
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+           best = elapsed
+    return best
+
+
+if len( sys.argv ) < 2:
+   print( 'Usage:', sys.argv[0], 'chart.svg [repeats]', file=sys.stderr )
+   sys.exit(1)
+
+repeats = 5
+if len( sys.argv ) > 2:
+   repeats = int( sys.argv[2] )
+
+with open( sys.argv[1], encoding='utf-8' ) as inf:
+   lines = inf.read().splitlines()
+
+n_bytes = sum( len( line.encode() ) + 1 for line in lines )
+
+out_name = os.path.join( tempfile.gettempdir(), 'fan-chart-output-speed.svg' )
+
+print( 'lines', len( lines ), 'bytes', n_bytes, 'best of', repeats )
+
+for name, method in [('print', with_print), ('print line buffered', with_print_unbuffered), ('sink', with_sink)]:
+    elapsed = time_it( method, lines, out_name, repeats )
+    print( name, round( elapsed, 3 ), 'sec', round( n_bytes / elapsed / 1024 / 1024, 1 ), 'MB/sec' )
+
+os.remove( out_name )
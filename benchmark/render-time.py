@@ -0,0 +1,145 @@
+#!/usr/local/bin/python3
+
+"""
+Compare the render time of the regular and flat SVG output.
+
+For each input file the chart is made with the nested rotated groups
+and again with --flat, then given to whichever renderers are found:
+a headless browser screenshot (chromium or google-chrome), rsvg-convert
+to PNG, Inkscape's conversion to PDF, and MuPDF through the pymupdf
+module to PNG and PDF. The XML parse time is always shown.
+
+Usage: render-time.py [--libpath=dir] [--generations=n] [--dates] [--compact] file.ged id [file.ged id ...]
+"""
+
+import sys
+import os
+import time
+import shutil
+import subprocess
+import tempfile
+import argparse
+import xml.etree.ElementTree as ET
+
+program = os.path.join( os.path.dirname( os.path.realpath( __file__ ) ), '..', 'fan-chart.py' )
+
+variations = []
+variations.append( ['nested groups', []] )
+variations.append( ['flat', ['--flat']] )
+
+work_dir = tempfile.gettempdir()
+out_name = os.path.join( work_dir, 'fan-chart-render-time.svg' )
+render_name = os.path.join( work_dir, 'fan-chart-render-time.out' )
+
+
+def browser_command( program, file_name ):
+    command = [program, '--headless', '--disable-gpu', '--window-size=600,600']
+    return command + ['--screenshot=' + render_name + '.png', 'file://' + file_name]
+
+
+def rsvg_command( program, file_name ):
+    return [program, '--format=png', '--output=' + render_name, file_name]
+
+
+def inkscape_command( program, file_name ):
+    return [program, '--export-type=pdf', '--export-filename=' + render_name + '.pdf', file_name]
+
+
+def find_renderers():
+    results = []
+    for program in ['chromium', 'chromium-browser', 'google-chrome']:
+        path = shutil.which( program )
+        if path:
+           results.append( ['headless browser', path, browser_command] )
+           break
+    path = shutil.which( 'rsvg-convert' )
+    if path:
+       results.append( ['rsvg-convert png', path, rsvg_command] )
+    path = shutil.which( 'inkscape' )
+    if path:
+       results.append( ['inkscape pdf', path, inkscape_command] )
+    return results
+
+
+def mupdf_module():
+    # MuPDF renders svg in the same process, if the module is installed
+    try:
+       import pymupdf
+    except ImportError:
+       return None
+    return pymupdf
+
+
+def time_mupdf( mupdf, file_name ):
+    # render to a 600 point picture, then convert to pdf
+    start = time.perf_counter()
+    with mupdf.open( file_name ) as doc:
+       doc[0].get_pixmap( dpi=72 ).save( render_name + '.png' )
+    png_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    with mupdf.open( file_name ) as doc:
+       with open( render_name + '.pdf', 'wb' ) as outf:
+          outf.write( doc.convert_to_pdf() )
+    return png_seconds, time.perf_counter() - start
+
+
+def time_xml_parse( file_name ):
+    start = time.perf_counter()
+    ET.parse( file_name )
+    return time.perf_counter() - start
+
+
+def time_render( command ):
+    start = time.perf_counter()
+    subprocess.run( command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    return time.perf_counter() - start
+
+
+parser = argparse.ArgumentParser( description='Compare render times of nested and flat output.' )
+parser.add_argument( '--libpath', default='.', type=str )
+parser.add_argument( '--generations', default=12, type=int )
+parser.add_argument( '--dates', action='store_true' )
+parser.add_argument( '--compact', action='store_true' )
+parser.add_argument( 'pairs', nargs='+', help='gedcom file then id' )
+args = parser.parse_args()
+
+if len( args.pairs ) % 2 != 0:
+   print( 'Give each gedcom file followed by its top person id', file=sys.stderr )
+   sys.exit(1)
+
+renderers = find_renderers()
+mupdf = mupdf_module()
+if not renderers and not mupdf:
+   print( 'No renderer found, only the XML parse time is shown', file=sys.stderr )
+
+for i in range( 0, len( args.pairs ), 2 ):
+    infile = args.pairs[i]
+    personid = args.pairs[i+1]
+    print( infile, personid )
+
+    for name, extra in variations:
+        command = [sys.executable, program, '--libpath=' + args.libpath]
+        command += ['--generations=' + str( args.generations ), '--output=' + out_name]
+        if args.dates:
+           command.append( '--dates' )
+        if args.compact:
+           command.append( '--compact' )
+        command += extra + [infile, personid]
+        if subprocess.run( command ).returncode != 0:
+           print( '  failed:', ' '.join( command ), file=sys.stderr )
+           break
+
+        details = '  ' + name.ljust( 15 ) + str( os.path.getsize( out_name ) ).rjust( 10 ) + ' bytes'
+        details += '  xml parse ' + str( round( time_xml_parse( out_name ), 3 ) ) + ' sec'
+        for renderer, path, make_command in renderers:
+            seconds = time_render( make_command( path, out_name ) )
+            details += '  ' + renderer + ' ' + str( round( seconds, 2 ) ) + ' sec'
+        if mupdf:
+           png_seconds, pdf_seconds = time_mupdf( mupdf, out_name )
+           details += '  mupdf png ' + str( round( png_seconds, 2 ) ) + ' sec'
+           details += '  mupdf pdf ' + str( round( pdf_seconds, 2 ) ) + ' sec'
+        print( details )
+
+for name in [out_name, render_name, render_name + '.png', render_name + '.pdf']:
+    if os.path.exists( name ):
+       os.remove( name )
@@ -0,0 +1,106 @@
+#!/usr/local/bin/python3
+
+"""
+Compare the size and load time of the regular and compact SVG output.
+
+For each input file the chart is made in the regular format and then
+in the compact format at a few precisions. The load time is the time
+taken to parse the XML, and if Inkscape is found, the time for Inkscape
+to open the file and query its objects. If the pymupdf module is found,
+the time for MuPDF to open the file and build its display list.
+
+Usage: svg-size.py [--libpath=dir] [--generations=n] [--dates] file.ged id [file.ged id ...]
+"""
+
+import sys
+import os
+import time
+import shutil
+import subprocess
+import tempfile
+import argparse
+import xml.etree.ElementTree as ET
+
+program = os.path.join( os.path.dirname( os.path.realpath( __file__ ) ), '..', 'fan-chart.py' )
+
+variations = []
+variations.append( ['regular', []] )
+variations.append( ['compact', ['--compact']] )
+variations.append( ['compact precision 1', ['--compact', '--precision=1']] )
+variations.append( ['compact precision 0', ['--compact', '--precision=0']] )
+
+
+def time_xml_parse( file_name ):
+    start = time.perf_counter()
+    ET.parse( file_name )
+    return time.perf_counter() - start
+
+
+def time_inkscape( inkscape, file_name ):
+    start = time.perf_counter()
+    subprocess.run( [inkscape, '--query-all', file_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    return time.perf_counter() - start
+
+
+def mupdf_module():
+    try:
+       import pymupdf
+    except ImportError:
+       return None
+    return pymupdf
+
+
+def time_mupdf( mupdf, file_name ):
+    start = time.perf_counter()
+    with mupdf.open( file_name ) as doc:
+       doc[0].get_displaylist()
+    return time.perf_counter() - start
+
+
+parser = argparse.ArgumentParser( description='Compare regular and compact output.' )
+parser.add_argument( '--libpath', default='.', type=str )
+parser.add_argument( '--generations', default=12, type=int )
+parser.add_argument( '--dates', action='store_true' )
+parser.add_argument( 'pairs', nargs='+', help='gedcom file then id' )
+args = parser.parse_args()
+
+if len( args.pairs ) % 2 != 0:
+   print( 'Give each gedcom file followed by its top person id', file=sys.stderr )
+   sys.exit(1)
+
+inkscape = shutil.which( 'inkscape' )
+mupdf = mupdf_module()
+
+out_name = os.path.join( tempfile.gettempdir(), 'fan-chart-svg-size.svg' )
+
+for i in range( 0, len( args.pairs ), 2 ):
+    infile = args.pairs[i]
+    personid = args.pairs[i+1]
+    print( infile, personid )
+
+    regular_size = None
+    for name, extra in variations:
+        command = [sys.executable, program, '--libpath=' + args.libpath]
+        command += ['--generations=' + str( args.generations ), '--output=' + out_name]
+        if args.dates:
+           command.append( '--dates' )
+        command += extra + [infile, personid]
+        if subprocess.run( command ).returncode != 0:
+           print( '  failed:', ' '.join( command ), file=sys.stderr )
+           break
+
+        size = os.path.getsize( out_name )
+        if regular_size is None:
+           regular_size = size
+
+        details = '  ' + name.ljust( 22 ) + str( size ).rjust( 10 ) + ' bytes'
+        details += ' ' + str( round( 100.0 * size / regular_size ) ).rjust( 4 ) + '%'
+        details += '  xml parse ' + str( round( time_xml_parse( out_name ), 3 ) ) + ' sec'
+        if inkscape:
+           details += '  inkscape ' + str( round( time_inkscape( inkscape, out_name ), 2 ) ) + ' sec'
+        if mupdf:
+           details += '  mupdf load ' + str( round( time_mupdf( mupdf, out_name ), 2 ) ) + ' sec'
+        print( details )
+
+if os.path.exists( out_name ):
+   os.remove( out_name )
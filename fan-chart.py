@@ -2,7 +2,7 @@
 
 """
 Produce a genealogy fan chart (full circle).
-Input is a GEDCOM file
+Input is a GEDCOM file, possibly compressed, or from stdin
 Output an SVG file to std-out
 
 Goals:
@@ -28,16 +28,50 @@ import argparse
 import importlib.util
 import os
 import math
+import threading
+import gzip
+import bz2
+import lzma
+import zipfile
+import tempfile
+import shutil
+import io
+import hashlib
+import base64
+import unicodedata
+import html
+import re
+import time
+import struct
+import zlib
+import bisect
+import json
+import multiprocessing
+from array import array
 from collections import Counter
 
 # define an svg page size
 # arbitrary and square, but scalable
 page_size = 600
 
-# "standard" colour scheme - maybe later allow option for others
+# colour schemes, each must have the same number of colours
+# so that a chart can be switched to a different scheme
+colour_schemes = dict()
+
+# "standard" colour scheme
 # based on https://colorbrewer2.org/?type=qualitative&scheme=Pastel1&n=9
-slice_colours = ['#fbb4ae','#b3cde3','#ccebc5','#decbe4','#fed9a6']
-slice_colours.extend( ['#ffffcc','#e5d8bd','#fddaec','#f2f2f2'] )
+colour_schemes['standard'] = ['#fbb4ae','#b3cde3','#ccebc5','#decbe4','#fed9a6']
+colour_schemes['standard'].extend( ['#ffffcc','#e5d8bd','#fddaec','#f2f2f2'] )
+
+# light greys which still show the slices on a black and white printer
+colour_schemes['bw'] = ['#ffffff','#e0e0e0','#f2f2f2','#cccccc','#ebebeb']
+colour_schemes['bw'].extend( ['#d6d6d6','#f7f7f7','#c2c2c2','#e6e6e6'] )
+
+# based on https://colorbrewer2.org/?type=qualitative&scheme=Set3&n=9
+colour_schemes['set3'] = ['#8dd3c7','#ffffb3','#bebada','#fb8072','#80b1d3']
+colour_schemes['set3'].extend( ['#fdb462','#b3de69','#fccde5','#d9d9d9'] )
+
+slice_colours = colour_schemes['standard']
 
 n_colours = len( slice_colours )
 
@@ -55,13 +89,54 @@ text_margin = 11
 # all the text sizes are based on this typeface
 font_selection = 'font-family="Times New Roman,serif"'
 
+# change this when the layout of any saved index file changes
+cache_version = 4
+
+# the options which change how the chart is laid out, a saved layout
+# is used again only if these are the same
+layout_options = ['id-item', 'generations', 'dates', 'min-font', 'small-name-mark', 'max-elements', 'angle-range', 'generation-range']
+
+# the output is collected and written in blocks of about this many characters
+output_block_size = 1024 * 1024
+
+# decompressed input is handed to the gedcom reader in blocks of this size
+input_block_size = 1024 * 1024
+
+# digits after the decimal point in the output, and the shorter output format
+# both can be changed by options
+precision = 2
+compact = False
+
+# flat output has every coordinate relative to the page rather than in
+# nested rotated contexts, set by an option, the offset moves the center
+flat = False
+page_offset = [0.0, 0.0]
+
+# pdf output rather than svg, set by an option or the output file name,
+# with a font embedded from the first of these which is found
+pdf = False
+pdf_font_files = ['/usr/share/fonts/truetype/msttcorefonts/Times_New_Roman.ttf']
+pdf_font_files.append( '/usr/share/fonts/truetype/liberation/LiberationSerif-Regular.ttf' )
+pdf_font_files.append( '/usr/share/fonts/liberation-serif/LiberationSerif-Regular.ttf' )
+pdf_font_files.append( '/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf' )
+pdf_font_files.append( '/usr/share/fonts/dejavu/DejaVuSerif.ttf' )
+pdf_font_files.append( '/Library/Fonts/Times New Roman.ttf' )
+pdf_font_files.append( 'C:/Windows/Fonts/times.ttf' )
+
+# html output, set by an option or the output file name, shows the inner
+# generations and loads the outer ones as needed from fragment files
+html_output = False
+html_folder = None
+html_fragments = []
+html_sinks = []
+
 # showing algorithm details if the option is selected
 # helping with name placement heuristics
 debug = False
 
 
 def get_version():
-    return '0.9.4.10'
+    return '0.9.4.36'
 
 
 def percentage_of( x, p ):
@@ -72,8 +147,55 @@ def subtract_a_percentage( x, p ):
 
 
 def roundstr( x ):
-    # output of 2 digits ought to be enough
-    return str( round( x, 2 ) )
+    # output of 2 digits ought to be enough, but it can be changed by an option
+    if compact:
+       # as short as possible: no trailing zeros and no negative zero
+       s = '%.*f' % ( precision, x )
+       if '.' in s:
+          s = s.rstrip( '0' ).rstrip( '.' )
+       if s == '-0':
+          s = '0'
+       return s
+    return str( round( x, precision ) )
+
+
+def rotate_transform( degrees ):
+    # the center of rotation is always the origin
+    if compact:
+       return 'rotate(' + roundstr(degrees) + ')'
+    return 'rotate(' + roundstr(degrees) + ',0,0)'
+
+
+def begin_rotation( degrees ):
+    # start a graphic context rotated from the current one
+    # and keep track of the total rotation from the page
+    rotation_stack.append( rotation_stack[-1] + degrees )
+    if drawing['groups'] and not flat:
+       emit( '<g transform="' + rotate_transform( degrees ) + '">' )
+
+
+def end_rotation():
+    rotation_stack.pop()
+    if drawing['groups'] and not flat:
+       emit( '</g>' )
+
+
+def absolute_xy( x, y ):
+    # coordinates of a point in the current rotated context without the rotation,
+    # relative to the center, or to the page corner in flat mode
+    angle = math.radians( rotation_stack[-1] )
+    cos_a = math.cos( angle )
+    sin_a = math.sin( angle )
+    x_abs = x * cos_a - y * sin_a + page_offset[0]
+    y_abs = x * sin_a + y * cos_a + page_offset[1]
+    return roundstr( x_abs ) + ',' + roundstr( y_abs )
+
+
+def output_xy( coords, point ):
+    # a point of a computed slice, as it is to be output
+    if flat:
+       return absolute_xy( coords[point]['x'], coords[point]['y'] )
+    return coords[point]['xy']
 
 
 def compute_arc_length( radius, arc_degrees ):
@@ -115,19 +237,588 @@ def setup_char_widths():
     return results
 
 
-def output_header():
+class OutputSink:
+    # Collects the output text and writes it in large blocks
+    # rather than making a write for every line.
+
+    def __init__( self, outf, block_size=output_block_size ):
+        self.outf = outf
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+        self.n_written = 0
+
+    def write( self, text ):
+        self.parts.append( text )
+        self.size += len( text )
+        if self.size >= self.block_size:
+           self.flush()
+
+    def flush( self ):
+        if self.parts:
+           block = ''.join( self.parts )
+           self.outf.write( block )
+           self.n_written += len( block )
+           self.parts = []
+           self.size = 0
+
+    def close( self ):
+        self.flush()
+        if self.outf is sys.stdout:
+           self.outf.flush()
+        else:
+           self.outf.close()
+
+
+class CompressedSink( OutputSink ):
+    # Blocks are gzip compressed as they are written. Compression is a small
+    # part of the time taken, so it is done in line rather than on a thread.
+
+    def __init__( self, raw_outf, block_size=output_block_size ):
+        self.raw_outf = raw_outf
+        self.counter = CountingWriter( raw_outf )
+        super().__init__( gzip.GzipFile( fileobj=self.counter, mode='wb', mtime=0 ), block_size )
+        self.n_bytes = 0
+        self.n_compressed = 0
+
+    def flush( self ):
+        if self.parts:
+           block = ''.join( self.parts )
+           self.n_written += len( block )
+           block = block.encode( 'utf-8' )
+           self.n_bytes += len( block )
+           self.outf.write( block )
+           self.parts = []
+           self.size = 0
+
+    def close( self ):
+        try:
+           self.flush()
+           self.outf.close()
+           self.n_compressed = self.counter.n_bytes
+           if self.raw_outf is sys.stdout.buffer:
+              self.raw_outf.flush()
+           else:
+              self.raw_outf.close()
+        except OSError as e:
+           print( 'Error writing compressed output:', e, file=sys.stderr )
+           sys.exit(1)
+
+
+class CountingWriter:
+    # pass writes along, counting the bytes
+
+    def __init__( self, outf ):
+        self.outf = outf
+        self.n_bytes = 0
+
+    def write( self, b ):
+        self.n_bytes += len( b )
+        return self.outf.write( b )
+
+    def flush( self ):
+        self.outf.flush()
+
+
+def wants_compression( name ):
+    return options['compress'] or ( name is not None and name.lower().endswith( '.svgz' ) )
+
+
+def open_output_sink( name ):
+    # std-out if no name is given
+    if pdf:
+       if name is None or name == '-':
+          return PdfWriter( sys.stdout.buffer )
+       return PdfWriter( open( name, 'wb', buffering=output_block_size ) )
+
+    if wants_compression( name ):
+       if name is None or name == '-':
+          return CompressedSink( sys.stdout.buffer )
+       return CompressedSink( open( name, 'wb' ) )
+
+    if name is None or name == '-':
+       return OutputSink( sys.stdout )
+    return OutputSink( open( name, 'w', encoding='utf-8' ) )
+
+
+class TrueTypeFont:
+    # The parts of a TrueType font file needed to place text and to embed
+    # a subset of the font in a PDF. Only plain .ttf files, not collections.
+
+    def __init__( self, file_name ):
+        with open( file_name, 'rb' ) as inf:
+           self.content = inf.read()
+        self.tables = dict()
+        n_tables = struct.unpack_from( '>H', self.content, 4 )[0]
+        for i in range( n_tables ):
+            tag, _, offset, length = struct.unpack_from( '>4sIII', self.content, 12 + 16 * i )
+            self.tables[tag.decode( 'latin-1' )] = self.content[offset:offset+length]
+
+        head = self.tables['head']
+        self.units_per_em = struct.unpack_from( '>H', head, 18 )[0]
+        self.bbox = struct.unpack_from( '>hhhh', head, 36 )
+        long_loca = struct.unpack_from( '>h', head, 50 )[0] == 1
+
+        hhea = self.tables['hhea']
+        self.ascent, self.descent = struct.unpack_from( '>hh', hhea, 4 )
+        n_metrics = struct.unpack_from( '>H', hhea, 34 )[0]
+
+        self.n_glyphs = struct.unpack_from( '>H', self.tables['maxp'], 4 )[0]
+
+        hmtx = self.tables['hmtx']
+        self.advances = [struct.unpack_from( '>H', hmtx, 4 * i )[0] for i in range( n_metrics )]
+        self.advances += [self.advances[-1]] * ( self.n_glyphs - n_metrics )
+
+        if long_loca:
+           self.loca = struct.unpack_from( '>' + str( self.n_glyphs + 1 ) + 'I', self.tables['loca'] )
+        else:
+           self.loca = [2 * x for x in struct.unpack_from( '>' + str( self.n_glyphs + 1 ) + 'H', self.tables['loca'] )]
+
+        self.char_map = self.read_cmap()
+        self.name = self.read_postscript_name( file_name )
+
+    def read_cmap( self ):
+        # unicode to glyph id, from a windows unicode subtable
+        cmap = self.tables['cmap']
+        subtables = dict()
+        n_tables = struct.unpack_from( '>H', cmap, 2 )[0]
+        for i in range( n_tables ):
+            platform, encoding, offset = struct.unpack_from( '>HHI', cmap, 4 + 8 * i )
+            subtables[(platform, encoding)] = offset
+
+        results = dict()
+        for key in [(3,10), (0,4), (3,1), (0,3)]:
+            if key not in subtables:
+               continue
+            offset = subtables[key]
+            table_format = struct.unpack_from( '>H', cmap, offset )[0]
+            if table_format == 12:
+               n_groups = struct.unpack_from( '>I', cmap, offset + 12 )[0]
+               for i in range( n_groups ):
+                   start, end, glyph = struct.unpack_from( '>III', cmap, offset + 16 + 12 * i )
+                   for c in range( start, end + 1 ):
+                       results[c] = glyph + c - start
+               return results
+            if table_format == 4:
+               n_segments = struct.unpack_from( '>H', cmap, offset + 6 )[0] // 2
+               ends = offset + 14
+               starts = ends + 2 * n_segments + 2
+               deltas = starts + 2 * n_segments
+               range_offsets = deltas + 2 * n_segments
+               for i in range( n_segments ):
+                   end = struct.unpack_from( '>H', cmap, ends + 2 * i )[0]
+                   start = struct.unpack_from( '>H', cmap, starts + 2 * i )[0]
+                   delta = struct.unpack_from( '>h', cmap, deltas + 2 * i )[0]
+                   range_offset = struct.unpack_from( '>H', cmap, range_offsets + 2 * i )[0]
+                   for c in range( start, min( end, 0xFFFE ) + 1 ):
+                       if range_offset == 0:
+                          glyph = ( c + delta ) & 0xFFFF
+                       else:
+                          where = range_offsets + 2 * i + range_offset + 2 * ( c - start )
+                          glyph = struct.unpack_from( '>H', cmap, where )[0]
+                          if glyph:
+                             glyph = ( glyph + delta ) & 0xFFFF
+                       if glyph:
+                          results[c] = glyph
+               return results
+        return results
+
+    def read_postscript_name( self, file_name ):
+        # name id 6, otherwise made from the file name
+        name_table = self.tables.get( 'name' )
+        if name_table:
+           n_names, strings = struct.unpack_from( '>HH', name_table, 2 )
+           for i in range( n_names ):
+               platform, _, _, name_id, length, offset = struct.unpack_from( '>HHHHHH', name_table, 6 + 12 * i )
+               if name_id == 6:
+                  value = name_table[strings+offset:strings+offset+length]
+                  if platform in [0, 3]:
+                     return value.decode( 'utf-16-be' )
+                  return value.decode( 'latin-1' )
+        return re.sub( '[^A-Za-z0-9-]', '', os.path.splitext( os.path.basename( file_name ) )[0] )
+
+    def glyph( self, c ):
+        return self.char_map.get( ord( c ), 0 )
+
+    def glyph_data( self, glyph ):
+        return self.tables['glyf'][self.loca[glyph]:self.loca[glyph+1]]
+
+    def components( self, glyph ):
+        # glyphs used by a composite glyph
+        results = []
+        data = self.glyph_data( glyph )
+        if len( data ) < 10 or struct.unpack_from( '>h', data, 0 )[0] >= 0:
+           return results
+        offset = 10
+        while True:
+           flags, component = struct.unpack_from( '>HH', data, offset )
+           results.append( component )
+           offset += 4
+           offset += 4 if flags & 0x0001 else 2
+           if flags & 0x0008:
+              offset += 2
+           elif flags & 0x0040:
+              offset += 4
+           elif flags & 0x0080:
+              offset += 8
+           if not flags & 0x0020:
+              break
+        return results
+
+    def subset( self, used ):
+        # A font file keeping the glyph ids, but with the outlines of
+        # all the glyphs which are not used taken out.
+
+        keep = set( used ) | {0}
+        todo = list( keep )
+        while todo:
+           for component in self.components( todo.pop() ):
+               if component not in keep:
+                  keep.add( component )
+                  todo.append( component )
+
+        glyf = []
+        loca = [0]
+        size = 0
+        for glyph in range( self.n_glyphs ):
+            if glyph in keep:
+               data = self.glyph_data( glyph )
+               data += b'\0' * ( -len( data ) % 4 )
+               glyf.append( data )
+               size += len( data )
+            loca.append( size )
+
+        tables = dict()
+        for tag in ['cvt ', 'fpgm', 'prep', 'hhea', 'hmtx', 'maxp']:
+            if tag in self.tables:
+               tables[tag] = self.tables[tag]
+        head = bytearray( self.tables['head'] )
+        struct.pack_into( '>I', head, 8, 0 )
+        struct.pack_into( '>h', head, 50, 1 )
+        tables['head'] = bytes( head )
+        tables['loca'] = struct.pack( '>' + str( len( loca ) ) + 'I', *loca )
+        tables['glyf'] = b''.join( glyf )
+
+        def checksum( data ):
+            data += b'\0' * ( -len( data ) % 4 )
+            return sum( struct.unpack( '>' + str( len( data ) // 4 ) + 'I', data ) ) & 0xFFFFFFFF
+
+        n_tables = len( tables )
+        entry_selector = int( math.log2( n_tables ) )
+        search_range = 16 * 2 ** entry_selector
+        directory = struct.pack( '>IHHHH', 0x00010000, n_tables, search_range, entry_selector, 16 * n_tables - search_range )
+        offset = 12 + 16 * n_tables
+        body = b''
+        for tag in sorted( tables ):
+            data = tables[tag]
+            directory += struct.pack( '>4sIII', tag.encode( 'latin-1' ), checksum( data ), offset, len( data ) )
+            data += b'\0' * ( -len( data ) % 4 )
+            body += data
+            offset += len( data )
+
+        result = bytearray( directory + body )
+        head_offset = struct.unpack_from( '>I', result, 12 + 16 * sorted( tables ).index( 'head' ) + 8 )[0]
+        struct.pack_into( '>I', result, head_offset + 8, ( 0xB1B0AFBA - checksum( bytes( result ) ) ) & 0xFFFFFFFF )
+        return bytes( result )
+
+
+def find_font_file():
+    # the font to embed in pdf output, or None to use the standard Times font
+    if options['font-file']:
+       return options['font-file']
+    for name in pdf_font_files:
+        if os.path.isfile( name ):
+           return name
+    return None
+
+
+def warn_if_no_font():
+    # the standard font isn't in the file, so the text depends on the viewer
+    if find_font_file() is None:
+       print( 'No TrueType font found to embed, the PDF uses the standard Times font without embedding it.', file=sys.stderr )
+       print( 'Give a font with --font-file to embed one.', file=sys.stderr )
+
+
+class PdfWriter:
+    # A single page pdf written as the chart is drawn. The page content
+    # is Flate compressed in blocks as it is made and the rest of the
+    # objects, including the font subset, are written at the end when
+    # the used characters are known.
+
+    def __init__( self, outf, block_size=output_block_size ):
+        self.outf = outf
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+        self.n_written = 0
+        self.offsets = []
+        self.font = None
+        font_file = find_font_file()
+        if font_file:
+           self.font = TrueTypeFont( font_file )
+        self.used = dict()
+        self.fill = None
+        self.content_object = None
+
+    def write( self, text ):
+        # page content
+        self.parts.append( text )
+        self.size += len( text )
+        if self.size >= self.block_size:
+           self.flush()
+
+    def flush( self ):
+        if self.parts:
+           block = ''.join( self.parts ).encode( 'latin-1' )
+           self.content_size += len( block )
+           self.put( self.compressor.compress( block ) )
+           self.parts = []
+           self.size = 0
+
+    def put( self, b ):
+        self.outf.write( b )
+        self.n_written += len( b )
+
+    def begin_object( self ):
+        self.offsets.append( self.n_written )
+        self.put( ( str( len( self.offsets ) ) + ' 0 obj\n' ).encode( 'latin-1' ) )
+        return len( self.offsets )
+
+    def add_object( self, text ):
+        number = self.begin_object()
+        self.put( text.encode( 'latin-1' ) + b'\nendobj\n' )
+        return number
+
+    def add_stream( self, dictionary, data ):
+        number = self.begin_object()
+        data = zlib.compress( data )
+        header = '<< ' + dictionary + ' /Length ' + str( len( data ) ) + ' /Filter /FlateDecode >>\nstream\n'
+        self.put( header.encode( 'latin-1' ) + data + b'\nendstream\nendobj\n' )
+        return number
+
+    def begin_page( self ):
+        self.put( b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n' )
+        # the length isn't known until the end, so it is its own object
+        self.content_object = self.begin_object()
+        self.put( b'<< /Length 2 0 R /Filter /FlateDecode >>\nstream\n' )
+        self.content_start = self.n_written
+        self.content_size = 0
+        self.compressor = zlib.compressobj()
+        # flip to the svg coordinates, y down from the top of the page
+        self.write( '1 0 0 -1 0 ' + str( page_size ) + ' cm 0.502 G 2 w\n' )
+
+    def end_page( self ):
+        self.flush()
+        self.put( self.compressor.flush() )
+        length = self.n_written - self.content_start
+        self.put( b'\nendstream\nendobj\n' )
+        self.add_object( str( length ) )
+
+        font = self.add_font()
+        pages = len( self.offsets ) + 2
+        size = str( page_size )
+        page = '<< /Type /Page /Parent ' + str( pages ) + ' 0 R /MediaBox [0 0 ' + size + ' ' + size + ']'
+        page += ' /Resources << /Font << /F1 ' + str( font ) + ' 0 R >> >>'
+        page += ' /Contents ' + str( self.content_object ) + ' 0 R >>'
+        page = self.add_object( page )
+        self.add_object( '<< /Type /Pages /Kids [' + str( page ) + ' 0 R] /Count 1 >>' )
+        catalog = self.add_object( '<< /Type /Catalog /Pages ' + str( pages ) + ' 0 R >>' )
+
+        xref = self.n_written
+        lines = ['xref', '0 ' + str( len( self.offsets ) + 1 ), '0000000000 65535 f ']
+        for offset in self.offsets:
+            lines.append( '%010d 00000 n ' % offset )
+        lines.append( 'trailer' )
+        lines.append( '<< /Size ' + str( len( self.offsets ) + 1 ) + ' /Root ' + str( catalog ) + ' 0 R >>' )
+        lines.append( 'startxref' )
+        lines.append( str( xref ) )
+        lines.append( '%%EOF' )
+        self.put( ( '\n'.join( lines ) + '\n' ).encode( 'latin-1' ) )
+
+    def add_font( self ):
+        if self.font is None:
+           return self.add_object( '<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman /Encoding /WinAnsiEncoding >>' )
+
+        font = self.font
+        scale = 1000.0 / font.units_per_em
+        used = sorted( self.used )
+
+        # the subset name prefix is six letters made from the used glyphs
+        digest = hashlib.sha1( str( used ).encode( 'latin-1' ) ).digest()
+        name = ''.join( [chr( ord('A') + b % 26 ) for b in digest[:6]] ) + '+' + font.name
+
+        font_file = self.add_stream( '', font.subset( used ) )
+        bbox = ' '.join( [str( round( x * scale ) ) for x in font.bbox] )
+        descriptor = '<< /Type /FontDescriptor /FontName /' + name + ' /Flags 34'
+        descriptor += ' /FontBBox [' + bbox + '] /ItalicAngle 0'
+        descriptor += ' /Ascent ' + str( round( font.ascent * scale ) )
+        descriptor += ' /Descent ' + str( round( font.descent * scale ) )
+        descriptor += ' /CapHeight ' + str( round( font.ascent * scale ) )
+        descriptor += ' /StemV 80 /FontFile2 ' + str( font_file ) + ' 0 R >>'
+        descriptor = self.add_object( descriptor )
+
+        widths = ' '.join( [str( g ) + ' [' + str( round( font.advances[g] * scale ) ) + ']' for g in used] )
+        cid_font = '<< /Type /Font /Subtype /CIDFontType2 /BaseFont /' + name
+        cid_font += ' /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >>'
+        cid_font += ' /FontDescriptor ' + str( descriptor ) + ' 0 R /CIDToGIDMap /Identity'
+        cid_font += ' /W [' + widths + '] >>'
+        cid_font = self.add_object( cid_font )
+
+        # so the text can be searched and copied
+        cmap = ['/CIDInit /ProcSet findresource begin 12 dict begin begincmap']
+        cmap.append( '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def' )
+        cmap.append( '/CMapName /Adobe-Identity-UCS def /CMapType 2 def' )
+        cmap.append( '1 begincodespacerange <0000> <FFFF> endcodespacerange' )
+        for i in range( 0, len( used ), 100 ):
+            chunk = used[i:i+100]
+            cmap.append( str( len( chunk ) ) + ' beginbfchar' )
+            for g in chunk:
+                utf16 = self.used[g].encode( 'utf-16-be' ).hex().upper()
+                cmap.append( '<%04X> <%s>' % ( g, utf16 ) )
+            cmap.append( 'endbfchar' )
+        cmap.append( 'endcmap CMapName currentdict /CMap defineresource pop end end' )
+        to_unicode = self.add_stream( '', '\n'.join( cmap ).encode( 'latin-1' ) )
+
+        font_dict = '<< /Type /Font /Subtype /Type0 /BaseFont /' + name + ' /Encoding /Identity-H'
+        font_dict += ' /DescendantFonts [' + str( cid_font ) + ' 0 R] /ToUnicode ' + str( to_unicode ) + ' 0 R >>'
+        return self.add_object( font_dict )
+
+    def set_fill( self, colour ):
+        if colour != self.fill:
+           self.fill = colour
+           rgb = [int( colour[i:i+2], 16 ) / 255.0 for i in [1, 3, 5]]
+           self.write( '%.3f %.3f %.3f rg\n' % tuple( rgb ) )
+
+    def glyphs( self, text, font_size ):
+        # the string code and width of each character
+        results = []
+        if self.font is None:
+           for c in text:
+               code = c.encode( 'cp1252', errors='replace' )
+               code = code.replace( b'\\', b'\\\\' ).replace( b'(', b'\\(' ).replace( b')', b'\\)' )
+               results.append( [code.decode( 'latin-1' ), estimate_string_width( font_size, c )] )
+           return results
+        scale = font_size / self.font.units_per_em
+        for c in text:
+            glyph = self.font.glyph( c )
+            self.used[glyph] = c
+            results.append( ['%04X' % glyph, self.font.advances[glyph] * scale] )
+        return results
+
+    def text_string( self, codes ):
+        # a string operand of the codes from glyphs
+        if self.font is None:
+           return '(' + codes + ')'
+        return '<' + codes + '>'
+
+    def close( self ):
+        if self.content_object is not None:
+           self.end_page()
+        if self.outf is sys.stdout.buffer:
+           self.outf.flush()
+        else:
+           self.outf.close()
+
+
+def wants_pdf( name ):
+    return options['pdf'] or ( name is not None and name.lower().endswith( '.pdf' ) )
+
+
+def wants_html( name ):
+    return options['html'] or ( name is not None and name.lower().endswith( '.html' ) )
+
+
+def report_output( elapsed ):
+    # sizes and time to stderr
+    print( 'output characters:', sink.n_written, file=sys.stderr )
+    if isinstance( sink, CompressedSink ):
+       print( 'uncompressed bytes:', sink.n_bytes, file=sys.stderr )
+       print( 'compressed bytes:', sink.n_compressed, file=sys.stderr )
+       if sink.n_compressed > 0:
+          print( 'compression ratio:', roundstr( sink.n_bytes / sink.n_compressed ), file=sys.stderr )
+    if options['max-elements']:
+       print( 'branches collapsed:', countables['collapsed'], file=sys.stderr )
+    if fragment_cache['folder']:
+       print( 'branches from the fragment cache:', fragment_cache['reused'], 'drawn:', fragment_cache['drawn'], file=sys.stderr )
+    if options['min-font'] > 0:
+       print( 'names too small to show:', countables['small names'], 'of', countables['names'], file=sys.stderr )
+    print( 'wall time:', roundstr( elapsed ), 'sec', file=sys.stderr )
+
+
+def emit( *items ):
+    # like print, but to the output sink
+    if len( items ) == 1:
+       sink.write( items[0] + '\n' )
+    else:
+       sink.write( ' '.join( [str(x) for x in items] ) + '\n' )
+
+
+def emit_comment( *items ):
+    # comments are only in svg output
+    if not pdf:
+       emit( '<!--', *items, '-->' )
+
+
+def output_header( view=None ):
+    # view is the part of the page for a tile: x, y, width, height
+    if pdf:
+       sink.begin_page()
+       return
     size = str( page_size )
-    print( '<?xml version="1.0" standalone="no"?>' )
-    print( '<!-- generated by fan-chart.py', get_version(), '-->' )
-    print( '<svg width="' + size + 'pt" height="' + size + 'pt"' )
-    print( ' viewBox="0.00 0.00 ' + size + '.00 ' + size + '.00"' )
-    print( ' version="1.1"' )
-    print( ' xmlns="http://www.w3.org/2000/svg"' )
-    print( ' xmlns:xlink="http://www.w3.org/1999/xlink">' )
+    emit( '<?xml version="1.0" standalone="no"?>' )
+    emit( '<!-- generated by fan-chart.py', get_version(), '-->' )
+    if view:
+       emit( '<svg width="' + roundstr( view[2] ) + 'pt" height="' + roundstr( view[3] ) + 'pt"' )
+       emit( ' viewBox="' + ' '.join( [roundstr( x ) for x in view] ) + '"' )
+    else:
+       emit( '<svg width="' + size + 'pt" height="' + size + 'pt"' )
+       emit( ' viewBox="0.00 0.00 ' + size + '.00 ' + size + '.00"' )
+    emit( ' version="1.1"' )
+    emit( ' xmlns="http://www.w3.org/2000/svg"' )
+    emit( ' xmlns:xlink="http://www.w3.org/1999/xlink">' )
+    if compact:
+       # style is given once here rather than on every element
+       emit( '<style>path,circle{stroke:grey;stroke-width:2}circle{fill:none}</style>' )
+    elif options['colour-classes']:
+       emit( '<style>.s{stroke:grey;stroke-width:2}</style>' )
+    if options['colour-classes']:
+       emit( colour_style_block() )
+
+
+def colour_style_block():
+    # The colours of the scheme for each colour index.
+    # Kept in its own block so it can be replaced to change the scheme.
+    block = '<style id="colours">'
+    for i, colour in enumerate( slice_colours ):
+        block += '.c' + str(i) + '{fill:' + colour + '}'
+    return block + '</style>'
+
+
+def recolour_chart( name ):
+    # change the colour style block of an existing chart, compressed or not
+
+    with open( name, 'rb' ) as inf:
+       content = inf.read()
+    if content.startswith( b'\x1f\x8b' ):
+       content = gzip.decompress( content )
+    content = content.decode( 'utf-8' )
+
+    content, n_changed = re.subn( '<style id="colours">.*?</style>', colour_style_block(), content, count=1, flags=re.DOTALL )
+    if n_changed == 0:
+       print( 'The chart does not have colour classes, make it with --colour-classes', file=sys.stderr )
+       sys.exit(1)
+
+    global sink
+    sink = open_output_sink( options['output'] )
+    sink.write( content )
+    sink.close()
 
 
 def output_trailer():
-    print( '</svg>' )
+    if pdf:
+       # the pdf is finished when the writer is closed
+       return
+    emit( '</svg>' )
 
 
 def estimate_string_width( font_size, s ):
@@ -188,7 +879,7 @@ def load_my_module( module_name, relative_path ):
 def get_program_options():
     results = {}
 
-    colour_types = ['standard','bw']
+    colour_types = list( colour_schemes.keys() )
 
     results['infile'] = None
     results['personid'] = None
@@ -198,6 +889,41 @@ def get_program_options():
     results['colour'] = 'standard'
     results['libpath'] = '.'
     results['debug'] = False
+    results['output-dir'] = None
+    results['find'] = None
+    results['cache-dir'] = None
+    results['roots'] = False
+    results['chart-size'] = False
+    results['output'] = None
+    results['compress'] = False
+    results['stats'] = False
+    results['compact'] = False
+    results['precision'] = precision
+    results['merge-paths'] = False
+    results['colour-classes'] = False
+    results['flat'] = False
+    results['share-subtrees'] = False
+    results['pdf'] = False
+    results['font-file'] = None
+    results['preview'] = None
+    results['preview-size'] = page_size
+    results['canvas'] = None
+    results['hit-index'] = None
+    results['also'] = []
+    results['layout-cache'] = False
+    results['fragment-cache'] = False
+    results['fragment-generation'] = 3
+    results['fragment-cache-size'] = 100
+    results['tiles'] = None
+    results['tile-overlap'] = 10.0
+    results['angle-range'] = None
+    results['generation-range'] = None
+    results['min-font'] = 0.0
+    results['max-elements'] = None
+    results['html'] = False
+    results['inline-generations'] = 6
+    results['small-name-mark'] = False
+    results['recolour'] = False
 
     arg_help = 'Draw fan chart.'
     parser = argparse.ArgumentParser( description=arg_help )
@@ -215,23 +941,208 @@ def get_program_options():
     arg_help = 'Year will displayed.'
     parser.add_argument( '--dates', default=results['dates'], action='store_true', help=arg_help )
 
-    arg_help = 'Colour scheme. Default:' + results['colour']
+    arg_help = 'Colour scheme: ' + ', '.join( colour_types ) + '. Default:' + results['colour']
     parser.add_argument( '--colour', default=results['colour'], type=str, help=arg_help )
 
     # maybe this should be changed to have a type which better matched a directory
     arg_help = 'Location of the gedcom library. Default is current directory.'
     parser.add_argument( '--libpath', default=results['libpath'], type=str, help=arg_help )
 
+    arg_help = 'Write the chart to this file rather than std-out.'
+    parser.add_argument( '--output', type=str, help=arg_help )
+
+    arg_help = 'Compressed SVG (svgz) output. Also selected by an output file ending in ".svgz".'
+    parser.add_argument( '--compress', default=results['compress'], action='store_true', help=arg_help )
+
+    arg_help = 'PDF output rather than SVG. Also selected by an output file ending in ".pdf".'
+    parser.add_argument( '--pdf', default=results['pdf'], action='store_true', help=arg_help )
+
+    arg_help = 'TrueType font (.ttf) to embed in pdf output. Default is the first of a few common serif fonts found.'
+    parser.add_argument( '--font-file', type=str, help=arg_help )
+
+    arg_help = 'HTML page for a browser which loads the outer generations as they are zoomed into.'
+    arg_help += ' Also selected by an output file ending in ".html".'
+    parser.add_argument( '--html', default=results['html'], action='store_true', help=arg_help )
+
+    arg_help = 'Generations in the html page itself, the rest are loaded as needed. Default ' + str(results['inline-generations'])
+    parser.add_argument( '--inline-generations', default=results['inline-generations'], type=int, help=arg_help )
+
+    arg_help = 'Also make a quick PNG picture of the chart in this file, names are shown as blocks. Needs NumPy.'
+    parser.add_argument( '--preview', type=str, help=arg_help )
+
+    arg_help = 'Width and height of the preview in pixels. Default ' + str(results['preview-size'])
+    parser.add_argument( '--preview-size', default=results['preview-size'], type=int, help=arg_help )
+
+    arg_help = 'Also make an HTML page which draws the chart on a canvas, from a packed binary file'
+    arg_help += ' of the same name ending in ".bin".'
+    parser.add_argument( '--canvas', type=str, help=arg_help )
+
+    arg_help = 'Also write an index of who is where in the chart to this json file, for finding the person at a point.'
+    parser.add_argument( '--hit-index', type=str, help=arg_help )
+
+    arg_help = 'Also draw the shapes recorded while drawing the chart to this file, without laying it out again.'
+    arg_help += ' The format is from the ending: ".svg", ".svgz", ".pdf", ".png" or ".json" for the shapes themselves.'
+    arg_help += ' The copy is always flat, in page coordinates, whatever --merge-paths, --share-subtrees or --flat'
+    arg_help += ' give the chart. Can be given more than once.'
+    parser.add_argument( '--also', action='append', type=str, help=arg_help )
+
+    arg_help = 'Save the layout of each chart in the cache directory, and use it again if only the output'
+    arg_help += ' choices such as the colours, precision or format are changed. Only for flat output,'
+    arg_help += ' --flat or pdf, without --merge-paths or --share-subtrees, as a saved layout is drawn flat.'
+    parser.add_argument( '--layout-cache', default=results['layout-cache'], action='store_true', help=arg_help )
+
+    arg_help = 'Keep the drawing of each branch in the cache directory, and copy it into any later chart'
+    arg_help += ' where the branch is the same, rather than drawing it again. For svg output in rotated groups,'
+    arg_help += ' not with --flat, pdf, tiles, HTML, --merge-paths, --angle-range or --share-subtrees.'
+    parser.add_argument( '--fragment-cache', default=results['fragment-cache'], action='store_true', help=arg_help )
+
+    arg_help = 'Generation where the branches kept by --fragment-cache start, at least 3. Default ' + str(results['fragment-generation'])
+    parser.add_argument( '--fragment-generation', default=results['fragment-generation'], type=int, help=arg_help )
+
+    arg_help = 'Largest size of the kept branches in megabytes, the least recently used are removed.'
+    arg_help += ' Default ' + str(results['fragment-cache-size'])
+    parser.add_argument( '--fragment-cache-size', default=results['fragment-cache-size'], type=float, help=arg_help )
+
+    arg_help = 'Split the chart into rows x columns of overlapping tiles, such as 3x4, each in its own file'
+    arg_help += ' named from the output file with the row and column added. Tiles are always flat.'
+    parser.add_argument( '--tiles', type=str, help=arg_help )
+
+    arg_help = 'Overlap of the tiles on each side, in chart units of which the whole chart is ' + str( page_size )
+    arg_help += '. Default ' + str(results['tile-overlap'])
+    parser.add_argument( '--tile-overlap', default=results['tile-overlap'], type=float, help=arg_help )
+
+    arg_help = 'Draw only this part of the chart, as start:end in degrees clockwise from the top, such as 300:30.'
+    arg_help += ' Everything stays where it is in the whole chart.'
+    parser.add_argument( '--angle-range', type=str, help=arg_help )
+
+    arg_help = 'Draw only these generations, as first:last, such as 5:8, where the top person is generation 1.'
+    parser.add_argument( '--generation-range', type=str, help=arg_help )
+
+    arg_help = 'Smallest font size for names, smaller names are left out. Default ' + str(results['min-font']) + ' for all names.'
+    parser.add_argument( '--min-font', default=results['min-font'], type=float, help=arg_help )
+
+    arg_help = 'Put a dot where a name is left out by --min-font.'
+    parser.add_argument( '--small-name-mark', default=results['small-name-mark'], action='store_true', help=arg_help )
+
+    arg_help = 'Keep the chart to about this many slices and names. Branches which would go over their'
+    arg_help += ' share are shown as one wedge with the number of descendants.'
+    parser.add_argument( '--max-elements', type=int, help=arg_help )
+
+    arg_help = 'Show output size, compression and time on stderr.'
+    parser.add_argument( '--stats', default=results['stats'], action='store_true', help=arg_help )
+
+    arg_help = 'Smaller output: shared text paths, style given once, fewer ids and attributes.'
+    parser.add_argument( '--compact', default=results['compact'], action='store_true', help=arg_help )
+
+    arg_help = 'Draw all the slices of each colour as a single path, same for separators and rings.'
+    parser.add_argument( '--merge-paths', default=results['merge-paths'], action='store_true', help=arg_help )
+
+    arg_help = 'Output every element in page coordinates without any rotated or translated groups.'
+    parser.add_argument( '--flat', default=results['flat'], action='store_true', help=arg_help )
+
+    arg_help = 'Output repeated descendant branches once and place each copy with a rotated reference.'
+    parser.add_argument( '--share-subtrees', default=results['share-subtrees'], action='store_true', help=arg_help )
+
+    arg_help = 'Give slice colours as style classes so that the colour scheme can be changed later.'
+    parser.add_argument( '--colour-classes', default=results['colour-classes'], action='store_true', help=arg_help )
+
+    arg_help = 'Change the colour scheme of an existing chart made with --colour-classes, given as the input file.'
+    parser.add_argument( '--recolour', default=results['recolour'], action='store_true', help=arg_help )
+
+    arg_help = 'Digits after the decimal point for output coordinates. Default ' + str(results['precision'])
+    parser.add_argument( '--precision', default=results['precision'], type=int, help=arg_help )
+
+    arg_help = 'File of more ids, one per line, for making many charts in one run.'
+    parser.add_argument( '--id-list', type=str, help=arg_help )
+
+    arg_help = 'Directory for the charts when more than one id is given. Each is named by its id.'
+    parser.add_argument( '--output-dir', type=str, help=arg_help )
+
+    arg_help = 'Search the names for this text, show the matching ids, then exit.'
+    parser.add_argument( '--find', type=str, help=arg_help )
+
+    arg_help = 'Instead of a chart, list everyone without parents ranked by the size of their chart,'
+    arg_help += ' including those without children.'
+    parser.add_argument( '--roots', default=results['roots'], action='store_true', help=arg_help )
+
+    arg_help = 'Instead of a chart, show the chart size for each top-person, using a saved table of all sizes.'
+    parser.add_argument( '--chart-size', default=results['chart-size'], action='store_true', help=arg_help )
+
+    arg_help = 'Directory for saved indexes. Default is "fan-chart" in the user cache directory, such as ~/.cache.'
+    parser.add_argument( '--cache-dir', type=str, help=arg_help )
+
     arg_help = 'Show version then exit.'
     parser.add_argument( '--version', action='version', version=get_version() )
 
-    parser.add_argument('infile', type=argparse.FileType('r') )
-    parser.add_argument('personid', type=str )
+    arg_help = 'Input gedcom file, may be compressed (gz, bz2, xz, zip, gdz). Use "-" for stdin.'
+    parser.add_argument('infile', type=str, help=arg_help )
+    parser.add_argument('personid', type=str, nargs='*' )
 
     args = parser.parse_args()
 
-    results['infile'] = args.infile.name
+    results['infile'] = args.infile
     results['personid'] = args.personid
+    if args.id_list:
+       with open( args.id_list ) as inf:
+          for line in inf:
+              if line.strip():
+                 results['personid'].append( line.strip() )
+    results['output-dir'] = args.output_dir
+    results['find'] = args.find
+    results['cache-dir'] = args.cache_dir
+    results['roots'] = args.roots
+    results['chart-size'] = args.chart_size
+    results['output'] = args.output
+    results['compress'] = args.compress
+    results['stats'] = args.stats
+    results['compact'] = args.compact
+    results['precision'] = args.precision
+    results['merge-paths'] = args.merge_paths
+    results['colour-classes'] = args.colour_classes
+    results['flat'] = args.flat
+    results['share-subtrees'] = args.share_subtrees
+    results['pdf'] = args.pdf
+    results['font-file'] = args.font_file
+    results['preview'] = args.preview
+    results['preview-size'] = args.preview_size
+    results['canvas'] = args.canvas
+    results['hit-index'] = args.hit_index
+    if args.also:
+       results['also'] = args.also
+    results['layout-cache'] = args.layout_cache
+    results['fragment-cache'] = args.fragment_cache
+    results['fragment-generation'] = args.fragment_generation
+    results['fragment-cache-size'] = args.fragment_cache_size
+    results['tile-overlap'] = args.tile_overlap
+    if args.tiles:
+       # rows x columns
+       m = re.fullmatch( r'\s*(\d+)\s*[xX]\s*(\d+)\s*', args.tiles )
+       if m and int( m.group(1) ) > 0 and int( m.group(2) ) > 0:
+          results['tiles'] = [int( m.group(1) ), int( m.group(2) )]
+       else:
+          print( 'Tiles should be given as rows x columns, such as 3x4', file=sys.stderr )
+          sys.exit(1)
+    if args.angle_range:
+       m = re.fullmatch( r'\s*(-?[\d.]+)\s*:\s*(-?[\d.]+)\s*', args.angle_range )
+       try:
+          results['angle-range'] = [float( m.group(1) ), float( m.group(2) )]
+       except ( AttributeError, ValueError ):
+          print( 'Angle range should be given as start:end in degrees, such as 300:30', file=sys.stderr )
+          sys.exit(1)
+    if args.generation_range:
+       m = re.fullmatch( r'\s*(\d+)\s*(:\s*(\d+)\s*)?', args.generation_range )
+       if m and int( m.group(1) ) > 0 and ( m.group(3) is None or int( m.group(3) ) >= int( m.group(1) ) ):
+          last = m.group(3) if m.group(3) else m.group(1)
+          results['generation-range'] = [int( m.group(1) ), int( last )]
+       else:
+          print( 'Generation range should be given as first:last, such as 5:8', file=sys.stderr )
+          sys.exit(1)
+    results['min-font'] = args.min_font
+    results['max-elements'] = args.max_elements
+    results['html'] = args.html
+    results['inline-generations'] = args.inline_generations
+    results['small-name-mark'] = args.small_name_mark
+    results['recolour'] = args.recolour
     results['id-item'] = args.id_item
     results['generations'] = args.generations
     results['dates'] = args.dates
@@ -246,20 +1157,465 @@ def get_program_options():
     return results
 
 
+def detect_compression( name, first_bytes ):
+    # check the magic numbers first, then fall back to the file extension
+    # return one of: None, 'gz', 'bz2', 'xz', 'zip'
+
+    if first_bytes.startswith( b'\x1f\x8b' ):
+       return 'gz'
+    if first_bytes.startswith( b'BZh' ):
+       return 'bz2'
+    if first_bytes.startswith( b'\xfd7zXZ\x00' ):
+       return 'xz'
+    if first_bytes.startswith( b'PK\x03\x04' ):
+       return 'zip'
+
+    extension = os.path.splitext( name )[1].lower()
+    if extension in ['.gz', '.bz2', '.xz']:
+       return extension[1:]
+    if extension in ['.zip', '.gdz']:
+       return 'zip'
+
+    return None
+
+
+def open_zip_member( source ):
+    # a GEDZIP bundle has its main file named "gedcom.ged",
+    # otherwise take the first gedcom file in the archive
+    archive = zipfile.ZipFile( source )
+    names = archive.namelist()
+    member = None
+    if 'gedcom.ged' in names:
+       member = 'gedcom.ged'
+    else:
+       for name in names:
+           if name.lower().endswith( '.ged' ):
+              member = name
+              break
+    if member is None:
+       print( 'No gedcom file found in the zip archive', file=sys.stderr )
+       sys.exit(1)
+    return archive.open( member )
+
+
+def open_input_stream( name ):
+    # return a binary stream of the decompressed input
+
+    if name == '-':
+       source = sys.stdin.buffer
+       first_bytes = source.peek( 6 )[:6]
+    else:
+       source = open( name, 'rb' )
+       first_bytes = source.read( 6 )
+       source.seek( 0 )
+
+    compression = detect_compression( name, first_bytes )
+
+    if compression == 'gz':
+       return gzip.open( source, 'rb' )
+    if compression == 'bz2':
+       return bz2.open( source, 'rb' )
+    if compression == 'xz':
+       return lzma.open( source, 'rb' )
+    if compression == 'zip':
+       if not source.seekable():
+          # zip needs random access, but keep it in memory rather than a temp file
+          source = io.BytesIO( source.read() )
+       return open_zip_member( source )
+
+    return source
+
+
+def is_plain_file( name ):
+    # true if the reader can be given the file name directly
+    if name == '-':
+       return False
+    with open( name, 'rb' ) as inf:
+       first_bytes = inf.read( 6 )
+    return detect_compression( name, first_bytes ) is None
+
+
+def library_reads_pipes():
+    # The pipe is given to the library by its /dev/fd name, which works only if
+    # the library opens the name once and reads it through in order, since what
+    # has been read from a pipe is gone. Check that with a small file first: one
+    # which opens it again, or reads it twice, doesn't find both people.
+
+    if not os.path.isdir( '/dev/fd' ):
+       # as on Windows, the pipe can't be named
+       return False
+
+    probe = ['0 HEAD', '1 GEDC', '2 VERS 5.5.1', '2 FORM LINEAGE-LINKED', '1 CHAR UTF-8']
+    probe += ['0 @I1@ INDI', '1 NAME Probe /One/', '1 FAMS @F1@']
+    probe += ['0 @I2@ INDI', '1 NAME Probe /Two/', '1 FAMC @F1@']
+    probe += ['0 @F1@ FAM', '1 HUSB @I1@', '1 CHIL @I2@', '0 TRLR']
+    probe_opts = {'display-gedcom-warnings':False, 'exit-on-no-families':False}
+    probe_opts['exit-on-missing-individuals'] = False
+    probe_opts['exit-on-missing-families'] = False
+
+    read_fd, write_fd = os.pipe()
+    try:
+       # small enough to fit in the pipe without a thread to fill it
+       with open( write_fd, 'wb' ) as outf:
+          outf.write( ( '\n'.join( probe ) + '\n' ).encode( 'utf-8' ) )
+       result = readgedcom.read_file( '/dev/fd/' + str( read_fd ), probe_opts )
+       return len( result[ikey] ) == 2 and len( result[fkey] ) == 1
+    except Exception:
+       return False
+    finally:
+       os.close( read_fd )
+
+
+def start_input_feeder( name ):
+    # The gedcom library reads from a file name, so give it the read end of a pipe
+    # which is filled by a thread doing the decompression.
+    # Decompression then overlaps with the parsing and no temp file is needed.
+    #
+    # return the details needed for the reader and for finishing up
+
+    feeder = {'error':None, 'temp':False}
+
+    stream = open_input_stream( name )
+
+    if not library_reads_pipes():
+       # the input is decompressed to a temp file first
+       try:
+          with tempfile.NamedTemporaryFile( suffix='.ged', delete=False ) as outf:
+             shutil.copyfileobj( stream, outf, input_block_size )
+       finally:
+          stream.close()
+       feeder['path'] = outf.name
+       feeder['temp'] = True
+       return feeder
+
+    read_fd, write_fd = os.pipe()
+
+    def feed():
+        try:
+           with open( write_fd, 'wb' ) as outf:
+              while True:
+                  block = stream.read( input_block_size )
+                  if not block:
+                     break
+                  outf.write( block )
+        except BrokenPipeError:
+           # the reader stopped early, it will report its own problem
+           pass
+        except Exception as e:
+           feeder['error'] = e
+        finally:
+           stream.close()
+
+    feeder['path'] = '/dev/fd/' + str( read_fd )
+    feeder['fd'] = read_fd
+    feeder['thread'] = threading.Thread( target=feed, daemon=True )
+    feeder['thread'].start()
+
+    return feeder
+
+
+def finish_input_feeder( feeder ):
+    if feeder['temp']:
+       os.remove( feeder['path'] )
+       return
+    feeder['thread'].join()
+    os.close( feeder['fd'] )
+    if feeder['error'] is not None:
+       print( 'Error reading input:', feeder['error'], file=sys.stderr )
+       sys.exit(1)
+
+
+def read_input( name, read_opts ):
+    # plain files go straight to the library, everything else is streamed
+
+    if is_plain_file( name ):
+       return readgedcom.read_file( name, read_opts )
+
+    feeder = start_input_feeder( name )
+    result = readgedcom.read_file( feeder['path'], read_opts )
+    finish_input_feeder( feeder )
+
+    return result
+
+
+def get_cache_dir():
+    # The given directory, otherwise in the user's own cache directory
+    # rather than beside the input file, which others might be able to write.
+    cache_dir = options['cache-dir']
+    if not cache_dir:
+       base = os.environ.get( 'XDG_CACHE_HOME' )
+       if not base and os.name == 'nt':
+          base = os.environ.get( 'LOCALAPPDATA' )
+       if not base:
+          base = os.path.join( os.path.expanduser( '~' ), '.cache' )
+       cache_dir = os.path.join( base, 'fan-chart' )
+    return cache_dir
+
+
+def get_cache_file( kind ):
+    # name of the file for a saved index of the input file, or None if there
+    # isn't a way to tell whether the input has changed, i.e. from stdin
+    #
+    # The key is made from the file details rather than its contents
+    # so that checking for a saved index doesn't need to read the file.
+
+    name = options['infile']
+    if name == '-':
+       return None
+
+    cache_dir = get_cache_dir()
+
+    file_stat = os.stat( name )
+    key = os.path.realpath( name ) + '|' + str( file_stat.st_size ) + '|' + str( file_stat.st_mtime_ns )
+    key = hashlib.sha1( key.encode() ).hexdigest()
+
+    return os.path.join( cache_dir, key + '.' + kind )
+
+
+def encode_cache_value( value ):
+    # Saved files are json, which can't run any code when they are read.
+    # Number arrays are kept as their bytes, much smaller than a json list.
+    if isinstance( value, array ):
+       return {'array':value.typecode, 'bytes':base64.b64encode( value.tobytes() ).decode( 'ascii' )}
+    raise TypeError( 'can not save ' + type( value ).__name__ )
+
+
+def decode_cache_value( item ):
+    if len( item ) == 2 and 'array' in item and 'bytes' in item:
+       value = array( item['array'] )
+       value.frombytes( base64.b64decode( item['bytes'] ) )
+       return value
+    return item
+
+
+def load_cache_file( file_name ):
+    # return the saved data, or None if missing or from an older version
+    result = None
+    if file_name and os.path.isfile( file_name ):
+       try:
+          with open( file_name, encoding='utf-8' ) as inf:
+             saved = json.load( inf, object_hook=decode_cache_value )
+          if saved['version'] == cache_version and saved['byteorder'] == sys.byteorder:
+             result = saved
+       except Exception as e:
+          if debug:
+             print( 'ignoring unreadable cache file', file_name, e, file=sys.stderr )
+    return result
+
+
+def save_cache_file( file_name, saved ):
+    if file_name:
+       saved['version'] = cache_version
+       # the arrays are saved as they are in memory
+       saved['byteorder'] = sys.byteorder
+       os.makedirs( os.path.dirname( file_name ), exist_ok=True )
+       # write then rename so that a concurrent reader never sees a partial file
+       temp_name = file_name + '.' + str( os.getpid() )
+       with open( temp_name, 'w', encoding='utf-8' ) as outf:
+          json.dump( saved, outf, separators=(',', ':'), default=encode_cache_value )
+       os.replace( temp_name, file_name )
+
+
+def fold_name( s ):
+    # lowercase without accents and with single spaces, for searching
+    if s.isascii() and '&' not in s:
+       # nothing to unescape or fold, and much faster
+       return ' '.join( s.lower().split() )
+    s = unicodedata.normalize( 'NFKD', html.unescape( s ) )
+    s = ''.join( c for c in s if not unicodedata.combining( c ) )
+    return ' '.join( s.casefold().split() )
+
+
+def name_trigrams( s ):
+    return set( s[i:i+3] for i in range( len(s) - 2 ) )
+
+
+def build_name_index( id_item ):
+    # every person with a searchable name, their display details,
+    # and a list of people for each three letter sequence
+    index = {'id':[], 'name':[], 'years':[], 'folded':[], 'trigrams':{}}
+    trigrams = index['trigrams']
+
+    for indi in data[ikey]:
+        if 'name' not in data[ikey][indi]:
+           continue
+        row = len( index['id'] )
+        name = data[ikey][indi]['name'][0]['html']
+        folded = fold_name( name )
+        index['id'].append( ','.join( sorted( get_id_values( indi, id_item ) ) ) )
+        index['name'].append( html.unescape( name ) )
+        index['years'].append( get_indi_years( indi ) )
+        index['folded'].append( folded )
+        for trigram in name_trigrams( folded ):
+            posting = trigrams.get( trigram )
+            if posting is None:
+               posting = array( 'I' )
+               trigrams[trigram] = posting
+            posting.append( row )
+
+    return index
+
+
+def search_name_index( index, text ):
+    # return the rows with names containing the text
+
+    wanted = fold_name( text )
+    folded = index['folded']
+
+    if len( wanted ) < 3:
+       # too short for the index, but short searches are rare
+       return [row for row in range( len(folded) ) if wanted in folded[row]]
+
+    postings = []
+    for trigram in name_trigrams( wanted ):
+        if trigram not in index['trigrams']:
+           return []
+        postings.append( index['trigrams'][trigram] )
+
+    # start with the shortest list to keep the candidates small
+    postings.sort( key=len )
+    candidates = set( postings[0] )
+    for posting in postings[1:]:
+        candidates.intersection_update( posting )
+        if not candidates:
+           return []
+
+    # the trigrams might match in a different order, so check the whole text
+    return sorted( row for row in candidates if wanted in folded[row] )
+
+
+def find_names( text ):
+    # show the people matching the search text, using a saved index if possible
+
+    global data
+
+    start_time = time.time()
+
+    cache_file = get_cache_file( 'names-' + safe_file_name( options['id-item'] ) )
+    index = load_cache_file( cache_file )
+
+    if index is None:
+       data = read_input( options['infile'], data_opts )
+       index = build_name_index( options['id-item'] )
+       save_cache_file( cache_file, index )
+       if debug:
+          print( 'built name index in', roundstr( time.time() - start_time ), 'sec', file=sys.stderr )
+
+    search_time = time.time()
+    rows = search_name_index( index, text )
+
+    if debug:
+       print( 'search time', roundstr( 1000.0 * ( time.time() - search_time ) ), 'ms', file=sys.stderr )
+
+    for row in rows:
+        years = index['years'][row]
+        if years is None:
+           years = ''
+        print( index['id'][row] + '\t' + index['name'][row] + '\t' + years )
+
+    return len( rows )
+
+
+def normalize_id( value, id_item ):
+    # xref values may or may not be given with the surrounding "@",
+    # the values of other id items are kept as they are
+    if id_item == 'xref':
+       return str( value ).strip().strip( '@' )
+    return str( value )
+
+
+def get_id_values( indi, id_item ):
+    # all the values of the id item for this person
+
+    def values_from( item ):
+        # the library may store a value as a string, a list, or dicts with a value
+        results = []
+        if isinstance( item, list ):
+           for sub_item in item:
+               results.extend( values_from( sub_item ) )
+        elif isinstance( item, dict ):
+           if 'value' in item:
+              results.extend( values_from( item['value'] ) )
+        elif item is not None:
+           results.append( normalize_id( item, id_item ) )
+        return results
+
+    indi_data = data[ikey][indi]
+    results = []
+
+    if id_item == 'xref':
+       results.append( normalize_id( indi, id_item ) )
+       if 'xref' in indi_data:
+          results.extend( values_from( indi_data['xref'] ) )
+
+    elif id_item.startswith( 'type.' ):
+       # custom event with a given type
+       wanted = id_item[len('type.'):]
+       for event in indi_data.get( 'even', [] ):
+           if isinstance( event, dict ) and event.get( 'type' ) == wanted:
+              results.extend( values_from( event ) )
+
+    elif id_item in indi_data:
+       results.extend( values_from( indi_data[id_item] ) )
+
+    return set( results )
+
+
+def build_id_index( id_item ):
+    # map each id value to the people having it, built once for each id item
+    if id_item not in id_indexes:
+       index = dict()
+       for indi in data[ikey]:
+           for value in get_id_values( indi, id_item ):
+               if value not in index:
+                  index[value] = []
+               index[value].append( indi )
+       id_indexes[id_item] = index
+    return id_indexes[id_item]
+
+
+def find_people( id_item, ids ):
+    # look up many ids at once
+    # return the single matches, and the ids which are ambiguous or missing
+
+    results = {'found':{}, 'ambiguous':{}, 'missing':[]}
+
+    index = build_id_index( id_item )
+
+    # The index has every value of the id item, the same ones the library
+    # would match, so an id not in it is missing without looking again.
+    for personid in ids:
+        matches = index.get( normalize_id( personid, id_item ), [] )
+
+        if len( matches ) == 1:
+           results['found'][personid] = matches[0]
+        elif len( matches ) > 1:
+           results['ambiguous'][personid] = matches
+        else:
+           results['missing'].append( personid )
+
+    return results
+
+
+def safe_file_name( s ):
+    # ids might contain characters which don't belong in a file name
+    result = ''
+    for c in s:
+        if c.isalnum() or c in '-_.':
+           result += c
+        else:
+           result += '_'
+    return result
+
+
 def find_spouse( fam, indi ):
+    # uses the extracted label data rather than the gedcom data
     if indi:
-       known = 'husb'
-       other = 'wife'
-       if known in data[fkey][fam]:
-          if indi == data[fkey][fam][known][0]:
-             if other in data[fkey][fam]:
-                return data[fkey][fam][other][0]
-       known = 'wife'
-       other = 'husb'
-       if known in data[fkey][fam]:
-          if indi == data[fkey][fam][known][0]:
-             if other in data[fkey][fam]:
-                return data[fkey][fam][other][0]
+       partners = label_data['fams'][fam]
+       if indi == partners['husb']:
+          return partners['wife']
+       if indi == partners['wife']:
+          return partners['husb']
     return None
 
 
@@ -292,6 +1648,44 @@ def get_indi_years( indi ):
     return result
 
 
+def extract_labels( diagram_data ):
+    # One pass over the people in the chart to pick out everything the output
+    # needs from the gedcom data: display name, years, and the family members.
+    # The output functions then use only this data.
+    #
+    # People are stored as columns: name and years lists indexed by a row number.
+
+    global label_data
+
+    label_data = {'row':{}, 'name':[], 'years':[], 'fams':{}}
+
+    def add_person( indi ):
+        if indi and indi not in label_data['row']:
+           label_data['row'][indi] = len( label_data['name'] )
+           label_data['name'].append( data[ikey][indi]['name'][0]['html'] )
+           years = None
+           if options['dates']:
+              years = get_indi_years( indi )
+           label_data['years'].append( years )
+
+    def add_family( fam ):
+        if fam not in label_data['fams']:
+           fam_data = data[fkey][fam]
+           partners = {'husb':None, 'wife':None, 'chil':[]}
+           for partner in ['husb','wife']:
+               if partner in fam_data:
+                  partners[partner] = fam_data[partner][0]
+                  add_person( partners[partner] )
+           if 'chil' in fam_data:
+              partners['chil'] = fam_data['chil']
+           label_data['fams'][fam] = partners
+
+    for indi in diagram_data:
+        add_person( indi )
+        for fam_data in diagram_data[indi]['fams']:
+            add_family( fam_data['fam'] )
+
+
 def calculate_generation_rings( n_gen ):
     # generation zero circle surrounded by rings for the other generations
     # Show the complete circles because it helps to visualize families which
@@ -318,13 +1712,64 @@ def calculate_generation_rings( n_gen ):
     return results
 
 
+def outline_view_arcs( rings ):
+    # only the part of each circle inside the viewport
+    low, high = [math.radians( a ) for a in view['angles']]
+    for detail in rings:
+        r = detail['outer']
+        if pdf:
+           sink.write( pdf_point( cx + r * math.cos( low ), cy + r * math.sin( low ) ) + ' m\n' + pdf_arc( r, low, high ) + 'S\n' )
+           continue
+        start = absolute_xy( r * math.cos( low ), r * math.sin( low ) )
+        end = absolute_xy( r * math.cos( high ), r * math.sin( high ) )
+        large = '1' if high - low > math.pi else '0'
+        arc = 'M' + start + ' A' + roundstr( r ) + ',' + roundstr( r ) + ' 0 ' + large + ' 1 ' + end
+        emit( '<path fill="none" stroke-width="2" stroke="grey" d="' + arc + '"/>' )
+
+
 def outline_generations( rings ):
-    print( '<!-- generation circles -->' )
+    if recorded_shapes['recording']:
+       recorded_shapes['items'].append( {'kind':'rings', 'rings':rings} )
+    emit_comment( 'generation circles' )
+    # the outer circle of each ring in the viewport, and the one inside it
+    rings = [detail for i, detail in enumerate( rings ) if view['first'] - 1 <= i <= view['last']]
+    if view['angles'] is not None:
+       outline_view_arcs( rings )
+       return
+    if pdf:
+       for detail in rings:
+           pdf_circle( detail['outer'] )
+       return
+    if options['merge-paths']:
+       # each circle is two half circle arcs
+       path = ''
+       for detail in rings:
+           r = roundstr( detail['outer'] )
+           right = r + ',0'
+           left = '-' + r + ',0'
+           if flat:
+              right = absolute_xy( detail['outer'], 0 )
+              left = absolute_xy( - detail['outer'], 0 )
+           path += 'M' + right + 'A' + r + ',' + r + ' 0 1 0 ' + left
+           path += 'A' + r + ',' + r + ' 0 1 0 ' + right + 'z'
+       emit( '<path' + merged_style( 'none' ) + ' d="' + path + '"/>' )
+       return
+    center = ''
+    if flat:
+       center = ' cx="' + roundstr( page_offset[0] ) + '" cy="' + roundstr( page_offset[1] ) + '"'
+    if compact:
+       for detail in rings:
+           emit( '<circle' + center + ' r="' + roundstr(detail['outer']) + '"/>' )
+       return
     # increase stroke width in order to hide any small drawing errors
     circle = '<circle cx="0" cy="0"'
+    if flat:
+       circle = '<circle' + center
     circle += ' fill="none" stroke-width="2" stroke="grey" r="'
     for detail in rings:
-        print( circle + str(detail['outer']) + '"/>' )
+        begin_tile_part()
+        emit( circle + str(detail['outer']) + '"/>' )
+        end_tile_part( 0.0, 180.0, detail['outer'] - 1.0, detail['outer'] + 1.0 )
 
 
 def find_max_generations( indi, max_gen, n_gen ):
@@ -399,6 +1844,221 @@ def compute_max_gen_children( indi, max_gen, n_gen ):
     return n
 
 
+def build_family_graph():
+    # every person as a row number, with the children of all their families as rows
+    # and the family counts needed by the slice computation
+
+    graph = {'indi':[], 'row':{}, 'children':[], 'n_fam':[], 'n_fam_with_children':[]}
+
+    for indi in data[ikey]:
+        graph['row'][indi] = len( graph['indi'] )
+        graph['indi'].append( indi )
+
+    for indi in graph['indi']:
+        children = []
+        n_fam = 0
+        n_fam_with_children = 0
+        if 'fams' in data[ikey][indi]:
+           for fam in data[ikey][indi]['fams']:
+               n_fam += 1
+               if 'chil' in data[fkey][fam] and data[fkey][fam]['chil']:
+                  n_fam_with_children += 1
+                  for child in data[fkey][fam]['chil']:
+                      children.append( graph['row'][child] )
+        graph['children'].append( children )
+        graph['n_fam'].append( n_fam )
+        graph['n_fam_with_children'].append( n_fam_with_children )
+
+    return graph
+
+
+def bottom_up_order( graph ):
+    # rows ordered so that everyone comes after all of their children
+    # People in a loop of bad data can't be ordered and are left out.
+
+    n_people = len( graph['indi'] )
+    parents = [[] for _ in range( n_people )]
+    waiting = [0] * n_people
+    for row in range( n_people ):
+        waiting[row] = len( graph['children'][row] )
+        for child in graph['children'][row]:
+            parents[child].append( row )
+
+    order = [row for row in range( n_people ) if waiting[row] == 0]
+    for row in order:
+        # the list grows while being looped over
+        for parent in parents[row]:
+            waiting[parent] -= 1
+            if waiting[parent] == 0:
+               order.append( parent )
+
+    if len( order ) < n_people:
+       print( 'Warning:', n_people - len( order ), 'people are their own ancestor, they are skipped', file=sys.stderr )
+
+    return order
+
+
+def compute_chart_sizes( graph, order, max_remaining ):
+    # In one pass from the bottom of the tree up, compute for each person:
+    #
+    # height: generations from this person to the deepest descendant, inclusive
+    # descendants: count of descendants, counted once for each line of descent
+    #              as they would appear in the chart
+    # slices: the same value as compute_max_gen_children when r generations
+    #         remain, i.e. r = max_gen - n_gen + 1, for each r from zero.
+    #         The value doesn't change once r is at least the height
+    #         so the values stop there, or at max_remaining.
+    #
+    # All the slice values are kept in one flat array, each person's values
+    # are found with their start position and length.
+
+    n_people = len( graph['indi'] )
+    sizes = {'height':array( 'I', [1] * n_people ), 'descendants':[0] * n_people}
+    sizes['start'] = array( 'Q', [0] * n_people )
+    sizes['length'] = array( 'I', [0] * n_people )
+    sizes['slices'] = array( 'Q' )
+
+    height = sizes['height']
+    descendants = sizes['descendants']
+    start = sizes['start']
+    length = sizes['length']
+    slices = sizes['slices']
+
+    for row in order:
+        children = graph['children'][row]
+        n_fam = graph['n_fam'][row]
+
+        start[row] = len( slices )
+
+        # past the end, any person is one slice
+        slices.append( 1 )
+
+        if not children:
+           if n_fam == 0:
+              slices.append( 1 )
+           else:
+              slices.append( n_fam )
+
+        else:
+           height[row] = 1 + max( height[child] for child in children )
+           n = 0
+           for child in children:
+               n += 1 + descendants[child]
+           descendants[row] = n
+
+           childless = n_fam - graph['n_fam_with_children'][row]
+           for r in range( 1, min( height[row], max_remaining ) + 1 ):
+               n = childless
+               for child in children:
+                   n += slices[start[child] + min( r - 1, length[child] - 1 )]
+               slices.append( n )
+
+        length[row] = len( slices ) - start[row]
+
+    return sizes
+
+
+def get_chart_slices( sizes, row, max_gen ):
+    # the value of compute_max_gen_children( indi, max_gen, 1 ) from the precomputed sizes
+    return sizes['slices'][sizes['start'][row] + min( max_gen, sizes['length'][row] - 1 )]
+
+
+def get_chart_generations( sizes, row, max_gen ):
+    # the value of find_max_generations( indi, max_gen, 1 ) from the precomputed sizes
+    return min( sizes['height'][row], max_gen + 1 )
+
+
+def load_size_table( id_item ):
+    # chart sizes for everyone in the file at every number of generations
+    # from the saved table, or compute and save the table
+
+    global data
+
+    cache_file = get_cache_file( 'sizes-' + safe_file_name( id_item ) )
+    table = load_cache_file( cache_file )
+
+    if table is None:
+       data = read_input( options['infile'], data_opts )
+       graph = build_family_graph()
+       order = bottom_up_order( graph )
+
+       # no depth limit, each person's values stop at their own height
+       table = compute_chart_sizes( graph, order, len( graph['indi'] ) + 1 )
+       table['indi'] = graph['indi']
+
+       # so that the ids can be found without reading the gedcom file
+       table['ids'] = dict()
+       for value, people in build_id_index( id_item ).items():
+           table['ids'][value] = [graph['row'][indi] for indi in people]
+
+       save_cache_file( cache_file, table )
+
+    return table
+
+
+def show_chart_sizes( ids, max_gen ):
+    # for each id, the generations and outer ring slices its chart would have
+    # return the number of ids not found
+
+    table = load_size_table( options['id-item'] )
+
+    n_missing = 0
+
+    print( 'id\tgenerations\tslices' )
+    for personid in ids:
+        rows = table['ids'].get( normalize_id( personid, options['id-item'] ), [] )
+        if len( rows ) != 1 or table['length'][rows[0]] == 0:
+           n_missing += 1
+           if rows:
+              print( personid, 'matches more than one person, or is in a loop', file=sys.stderr )
+           else:
+              print( personid, 'not found', file=sys.stderr )
+           continue
+        row = rows[0]
+        n_gen = get_chart_generations( table, row, max_gen )
+        print( personid + '\t' + str( n_gen ) + '\t' + str( get_chart_slices( table, row, n_gen ) ) )
+
+    return n_missing
+
+
+def list_roots( max_gen ):
+    # show the people who don't have parents, along with the size of
+    # the chart they would produce, largest first, down to those without
+    # children whose chart would be empty
+
+    graph = build_family_graph()
+    order = bottom_up_order( graph )
+
+    # find_max_generations can go one past the requested number
+    sizes = compute_chart_sizes( graph, order, max_gen + 1 )
+
+    roots = []
+    for row in order:
+        if 'famc' not in data[ikey][graph['indi'][row]]:
+           roots.append( row )
+
+    roots.sort( key=lambda row: ( -sizes['descendants'][row], -sizes['height'][row] ) )
+
+    print( 'id\tname\tyears\tdescendants\tdepth\tgenerations\tslices' )
+    for row in roots:
+        indi = graph['indi'][row]
+        n_gen = get_chart_generations( sizes, row, max_gen )
+        name = ''
+        if 'name' in data[ikey][indi]:
+           name = html.unescape( data[ikey][indi]['name'][0]['html'] )
+        years = get_indi_years( indi )
+        if years is None:
+           years = ''
+        details = [','.join( sorted( get_id_values( indi, options['id-item'] ) ) ), name, years]
+        details.append( sizes['descendants'][row] )
+        details.append( sizes['height'][row] )
+        details.append( n_gen )
+        details.append( get_chart_slices( sizes, row, n_gen ) )
+        print( '\t'.join( [str(x) for x in details] ) )
+
+    return len( roots )
+
+
 def count_slices( indi, max_gen, n_gen ):
     # determine the number of slices for each person/family
     # which depends on the number of slices of descendants
@@ -409,6 +2069,13 @@ def count_slices( indi, max_gen, n_gen ):
 
     n = 0
 
+    # for --max-elements: the slice and names drawn for this person and
+    # all their descendants, the number of descendants, and how many
+    # generations of them there are
+    elements = 2
+    descendants = 0
+    generations = 0
+
     if n_gen > max_gen:
        # the person (or person with spouse) at the end
        # counts as one slice
@@ -435,6 +2102,9 @@ def count_slices( indi, max_gen, n_gen ):
                      # descend at this point because the count
                      # belongs to this family
                      n_children_slices += count_slices( child, max_gen, n_gen+1 )
+                     elements += diagram_data[child]['elements']
+                     descendants += 1 + diagram_data[child]['descendants']
+                     generations = max( generations, 1 + diagram_data[child]['generations'] )
               if fam_has_children:
                  n_fam_with_children += 1
                  fam_data['slices'] = n_children_slices
@@ -445,6 +2115,8 @@ def count_slices( indi, max_gen, n_gen ):
 
               # save this family
               diagram_data[indi]['fams'].append( fam_data )
+              # and the partner's name
+              elements += 1
 
        if n_fam == 0:
           # no families, so can't go any further
@@ -459,10 +2131,72 @@ def count_slices( indi, max_gen, n_gen ):
 
     # save this person
     diagram_data[indi]['slices'] = n
+    diagram_data[indi]['elements'] = elements
+    diagram_data[indi]['descendants'] = descendants
+    diagram_data[indi]['generations'] = generations
+    diagram_data[indi]['collapse'] = False
 
     return n
 
 
+def least_elements( indi ):
+    # the person's slice and names, with any descendants collapsed
+    # into a wedge of a slice for each of their generations and a label
+    details = diagram_data[indi]
+    result = 2 + len( details['fams'] )
+    if details['generations'] > 0:
+       result += 1 + details['generations']
+    return result
+
+
+def allocate_element_budget( children, budget ):
+    # Each child gets what they need with their descendants collapsed,
+    # and a part of the rest of the budget by their number of slices.
+    # Those whose descendants fit in their part are drawn in full and
+    # what they don't use goes to the others. For each of the rest, if
+    # at least the next generation fits, with its own descendants
+    # collapsed, what is left after the child's slice and names goes to
+    # the next generation the same way. Otherwise the child's descendants
+    # are collapsed. No part is less than what the child needs collapsed,
+    # so once the budget is enough for that the chart stays within it.
+    # Returns how much of the budget is used.
+
+    given = budget
+    remaining = list( children )
+    while remaining:
+        total = sum( [diagram_data[child]['slices'] for child in remaining] )
+        spare = max( 0.0, budget - sum( [least_elements( child ) for child in remaining] ) )
+        fits = [child for child in remaining if diagram_data[child]['elements'] <= least_elements( child ) + spare * diagram_data[child]['slices'] / total]
+        if not fits:
+           break
+        for child in fits:
+            budget -= diagram_data[child]['elements']
+            remaining.remove( child )
+
+    # what one of the rest doesn't use goes to those after it
+    total = sum( [diagram_data[child]['slices'] for child in remaining] )
+    needed = sum( [least_elements( child ) for child in remaining] )
+    for child in remaining:
+        details = diagram_data[child]
+        least = least_elements( child )
+        spare = max( 0.0, budget - needed )
+        left = least + spare * details['slices'] / total - ( 2 + len( details['fams'] ) )
+        total -= details['slices']
+        needed -= least
+
+        next_generation = []
+        for fam_data in details['fams']:
+            next_generation.extend( label_data['fams'][fam_data['fam']]['chil'] )
+
+        if left < sum( [least_elements( grandchild ) for grandchild in next_generation] ):
+           details['collapse'] = True
+           budget -= least
+        else:
+           budget -= 2 + len( details['fams'] ) + allocate_element_budget( next_generation, left )
+
+    return given - budget
+
+
 def path_for_arc( radius, start_xy, end_xy ):
     path = 'M' + start_xy
     path += ' A' + roundstr(radius) +','+ roundstr(radius)
@@ -477,18 +2211,42 @@ def path_for_line( start_xy, end_xy ):
 
 
 def text_on_path( path_id_suffix, path, font_size, offset, text ):
+    if compact:
+       compact_text_on_path( path, font_size, offset, text )
+       return
+
     path_id = 'txt' + '_' + path_id_suffix
 
     font_options = ' font-size="' + roundstr(font_size) + '"'
     font_options += ' ' + font_selection
 
-    print( '<path id="' + path_id + '" d="' + path + '" style="fill:none;" />' )
-    print( '<text' + font_options + '>' )
-    print( ' <textPath xlink:href="#' + path_id + '" startOffset="' + offset + '">' + text + '</textPath>' )
-    print( '</text>' )
+    emit( '<path id="' + path_id + '" d="' + path + '" style="fill:none;" />' )
+    emit( '<text' + font_options + '>' )
+    emit( ' <textPath xlink:href="#' + path_id + '" startOffset="' + offset + '">' + text + '</textPath>' )
+    emit( '</text>' )
 
     ## draw the path
-    #print( '<path d="' + path + '" style="stroke:red; fill:none;" />' )
+    #emit( '<path d="' + path + '" style="stroke:red; fill:none;" />' )
+
+
+def compact_text_on_path( path, font_size, offset, text ):
+    # Slices of the same size in the same ring have the same text path
+    # because each is drawn in its own rotated context, so each different
+    # path is defined only once. The path is used in the coordinates of
+    # the text element, so the rotation of the context doesn't matter.
+
+    path_id = arc_ids.get( path )
+    if path_id is None:
+       path_id = 'a' + text_ids['prefix'] + str( len( arc_ids ) )
+       arc_ids[path] = path_id
+       emit( '<defs><path id="' + path_id + '" d="' + path + '"/></defs>' )
+
+    start = ''
+    if offset.rstrip( '%' ) != '0':
+       start = ' startOffset="' + offset + '"'
+
+    text_path = '<textPath xlink:href="#' + path_id + '"' + start + '>' + text + '</textPath>'
+    emit( '<text font-size="' + roundstr(font_size) + '">' + text_path + '</text>' )
 
 
 def font_to_fit_area( available_width, available_height, text ):
@@ -502,7 +2260,59 @@ def font_to_fit_area( available_width, available_height, text ):
     return scaled_font
 
 
-def output_name( coords, draw_separator, prefix, indi ):
+def output_text_on_arc( preview_kind, font_size, path_id, coords, offset, text ):
+    # a name along the outer edge of the slice
+    record_shape( 'arc text', coords, {'preview kind':preview_kind, 'font size':font_size, 'path id':path_id, 'offset':offset, 'text':text} )
+    # the offset is a percentage, kept as a number until it is output
+    offset = roundstr( offset ) + '%'
+    if options['preview']:
+       preview_text_on_arc( preview_kind, font_size, coords, offset, text )
+    if options['canvas']:
+       canvas_label( font_size, coords, offset, text, False )
+    if pdf:
+       pdf_text_on_arc( font_size, coords, offset, text )
+       return
+    path = path_for_arc( coords['input']['outer'], output_xy( coords, 'p3' ), output_xy( coords, 'p4' ) )
+    text_on_path( path_id, path, font_size, offset, text )
+
+
+def output_text_on_line( preview_kind, font_size, path_id, coords, offset, text ):
+    # a name outward from the inner edge
+    record_shape( 'line text', coords, {'preview kind':preview_kind, 'font size':font_size, 'path id':path_id, 'offset':offset, 'text':text} )
+    offset = roundstr( offset ) + '%'
+    if options['preview']:
+       preview_text_on_line( preview_kind, font_size, coords, offset, text )
+    if options['canvas']:
+       canvas_label( font_size, coords, offset, text, True )
+    if pdf:
+       pdf_text_on_line( font_size, coords, offset, text )
+       return
+    path = path_for_line( output_xy( coords, 'p2' ), output_xy( coords, 'p3' ) )
+    text_on_path( path_id, path, font_size, offset, text )
+
+
+def output_small_name_mark( coords, preview_kind ):
+    # a dot in the middle of a slice too small for the name
+    record_shape( 'mark', coords, {'preview kind':preview_kind} )
+    inner = coords['input']['inner']
+    outer = coords['input']['outer']
+    middle = ( inner + outer ) / 2.0
+    radius = min( ( outer - inner ) / 4.0, middle * coords['input']['half_d'] / 2.0, 1.5 )
+    if options['preview']:
+       preview_sector( preview_kind, rotation_stack[-1], math.degrees( radius / middle ), middle - radius, middle + radius, None )
+    if pdf:
+       # a line of no length with round ends
+       point = absolute_xy( middle, 0.0 ).replace( ',', ' ' )
+       sink.write( 'q 1 J ' + roundstr( 2 * radius ) + ' w ' + point + ' m ' + point + ' l S Q\n' )
+       return
+    if flat:
+       center = absolute_xy( middle, 0.0 ).split( ',' )
+    else:
+       center = [roundstr( middle ), '0']
+    emit( '<circle cx="' + center[0] + '" cy="' + center[1] + '" r="' + roundstr( radius ) + '" style="fill:grey;stroke:none"/>' )
+
+
+def output_name( coords, draw_separator, prefix, indi, label=None ):
     # the person counter is used for the id of text path,
     # in situation the indi value does not exist because there is no
     # known partner but still want tp show a questiion mark
@@ -543,98 +2353,144 @@ def output_name( coords, draw_separator, prefix, indi ):
         height = abs( coords['p2']['x'] - coords['p3']['x'] )
         return [ width, height ]
 
-    def horizontal_name( font_size, path_id_suffix, coords, offset, text ):
-        path = path_for_arc( coords['input']['outer'], coords['p3']['xy'], coords['p4']['xy'] )
-        text_on_path( path_id_suffix, path, font_size, offset, text )
-
-    def vertical_name( font_size, path_id_suffix, coords, offset, text ):
-        path = path_for_line( coords['p2']['xy'], coords['p3']['xy'] )
-        text_on_path( path_id_suffix, path, font_size, offset, text )
+    # partners overlap the name of the person, so they are kept apart in the preview
+    preview_kind = 'partners' if draw_separator else 'names'
 
     def offset_to_center( font_size, available_width, text ):
         empty_space = available_width - estimate_string_width( font_size, text )
         # change to a percent (is that what the startOffset parameter needs?)
         offset = ( 100.0 * empty_space / available_width ) / 2.0
-        return roundstr(max( 0.0, offset )) + '%'
+        return max( 0.0, offset )
 
     fullname = '?'
     dates = ''
-    path_id = str(n_person_name)
+    path_id = text_ids['prefix'] + str( n_person_name - text_ids['base'] )
 
     if indi:
        # possibly the family has an unknown spouse
-       fullname = data[ikey][indi]['name'][0]['html']
+       row = label_data['row'][indi]
+       fullname = label_data['name'][row]
        if options['dates']:
           # in this test, the dates are simply appended to the name
-          dates = get_indi_years( indi )
+          dates = label_data['years'][row]
     fullname = prefix + fullname
+    if label:
+       # not a person, the text is given
+       fullname = html.escape( label )
     if debug:
        print( fullname, file=sys.stderr )
        print( indent, 'dates', dates, file=sys.stderr )
        print( indent, 'indi', indi, file=sys.stderr )
        print( indent, 'n person', n_person_name, file=sys.stderr )
-       print( '<!-- person id', n_person_name, '-->' )
-       print( '<!-- indi', indi, '-->' )
-
-    margin_coords = calc_coords_with_margin()
+       emit_comment( 'person id', n_person_name )
+       emit_comment( 'indi', indi )
 
     text = fullname
     if dates:
        text += ' ' + dates
 
-    slice_size = calc_slice_size( margin_coords )
-    slice_width = slice_size[0]
-    slice_height = slice_size[1]
-    if debug:
-       print( indent, 'in slice of w:', roundstr(slice_width), 'h:', roundstr(slice_height), file=sys.stderr )
-
-    if slice_height > ratio_for_vertical * slice_width:
-       size_1 = min( max_font_size, font_to_fit_area( slice_height, slice_width, text ) )
-       centering = offset_to_center( size_1, slice_height, text )
+    # The font can't be higher than the slice, or its width for vertical text,
+    # allows, so a slice too small for the minimum font is found before the
+    # margins and the fit are worked out, and gets no text. Without a minimum
+    # every name is drawn as it always was, even in a slice
+    # too narrow for a positive font size.
+    show_text = True
+    if options['min-font'] > 0:
+       width = compute_arc_length( coords['input']['outer'], coords['input']['d'] )
+       height = coords['input']['outer'] - coords['input']['inner']
+       show_text = reverse_font_height( min( height, ratio_for_vertical * width ) ) >= options['min-font']
+
+    if show_text:
+       margin_coords = calc_coords_with_margin()
+
+       slice_size = calc_slice_size( margin_coords )
+       slice_width = slice_size[0]
+       slice_height = slice_size[1]
        if debug:
-          print( indent, 'vertical font:', roundstr(size_1), file=sys.stderr )
-          print( indent, indent, 'text width:',  roundstr( estimate_string_width( size_1, text ) ), file=sys.stderr )
-          print( indent, 'centering with:', centering, file=sys.stderr )
-       vertical_name( size_1, path_id, margin_coords, centering, text )
+          print( indent, 'in slice of w:', roundstr(slice_width), 'h:', roundstr(slice_height), file=sys.stderr )
 
-       ## try again, separating the date
+       if slice_height > ratio_for_vertical * slice_width:
+          size_1 = min( max_font_size, font_to_fit_area( slice_height, slice_width, text ) )
+          centering = offset_to_center( size_1, slice_height, text )
+          if debug:
+             print( indent, 'vertical font:', roundstr(size_1), file=sys.stderr )
+             print( indent, indent, 'text width:',  roundstr( estimate_string_width( size_1, text ) ), file=sys.stderr )
+             print( indent, 'centering with:', roundstr(centering) + '%', file=sys.stderr )
+          show_text = options['min-font'] <= 0 or size_1 >= options['min-font']
+          if show_text:
+             output_text_on_line( preview_kind, size_1, path_id, margin_coords, centering, text )
 
-    else:
-       size_1 = min( max_font_size, font_to_fit_area( slice_width, slice_height, text ) )
-       centering = offset_to_center( size_1, slice_width, text )
-       if debug:
-          print( indent, 'horizontal font:', roundstr(size_1), file=sys.stderr )
-          print( indent, indent, 'text width:',  roundstr( estimate_string_width( size_1, text ) ), file=sys.stderr )
-          print( indent, 'centering with:', centering, file=sys.stderr )
-       horizontal_name( size_1, path_id, margin_coords, centering, text )
-
-       ## try again, separating the date
-       #if dates:
-       #   if debug:
-       #      print( indent, 'trying with dates separated', file=sys.stderr )
-       #      print( indent, indent, '? in progress', file=sys.stderr )
-       #   # the size of the dates shouldn't be any bigger than the name
-       #   # so find the name size in the upper portion of the slice
-       #   slice_size = calc_slice_size_half( margin_coords, line_sep )
-       #   slice_width = slice_size[0]
-       #   slice_height = slice_size[1]
+          ## try again, separating the date
 
+       else:
+          size_1 = min( max_font_size, font_to_fit_area( slice_width, slice_height, text ) )
+          centering = offset_to_center( size_1, slice_width, text )
+          if debug:
+             print( indent, 'horizontal font:', roundstr(size_1), file=sys.stderr )
+             print( indent, indent, 'text width:',  roundstr( estimate_string_width( size_1, text ) ), file=sys.stderr )
+             print( indent, 'centering with:', roundstr(centering) + '%', file=sys.stderr )
+          show_text = options['min-font'] <= 0 or size_1 >= options['min-font']
+          if show_text:
+             output_text_on_arc( preview_kind, size_1, path_id, margin_coords, centering, text )
+
+          ## try again, separating the date
+          #if dates:
+          #   if debug:
+          #      print( indent, 'trying with dates separated', file=sys.stderr )
+          #      print( indent, indent, '? in progress', file=sys.stderr )
+          #   # the size of the dates shouldn't be any bigger than the name
+          #   # so find the name size in the upper portion of the slice
+          #   slice_size = calc_slice_size_half( margin_coords, line_sep )
+          #   slice_width = slice_size[0]
+          #   slice_height = slice_size[1]
+
+    if not show_text:
+       countables['small names'] += 1
+       if options['small-name-mark']:
+          output_small_name_mark( coords, preview_kind )
 
     if draw_separator:
        # put a line in front of the name
        # used for separating multiple marriages
-       half_d = coords['input']['half_d']
-       cos_half_d = math.cos( half_d )
-       sin_half_d = math.sin( half_d )
-       outer = coords['input']['outer']
+       output_separator( coords )
+
+
+def output_separator( coords ):
+    # a line along the side of the slice with the larger angle
+    record_shape( 'separator', coords )
+    half_d = coords['input']['half_d']
+    cos_half_d = math.cos( half_d )
+    sin_half_d = math.sin( half_d )
+    outer = coords['input']['outer']
+    inner = coords['input']['inner']
+    if options['preview']:
+       preview_line( half_d, inner, outer )
+    if options['canvas']:
+       canvas_separator( half_d, inner, outer )
+    if pdf:
+       pdf_line( outer * cos_half_d, outer * sin_half_d, inner * cos_half_d, inner * sin_half_d )
+    elif options['merge-paths'] and not shared_subtrees['depth']:
+       # all the lines are drawn together later
+       line = 'M' + absolute_xy( outer * cos_half_d, outer * sin_half_d )
+       line += 'L' + absolute_xy( inner * cos_half_d, inner * sin_half_d )
+       merged_paths['separators'].append( line )
+    else:
        x = outer * cos_half_d
        y = outer * sin_half_d
-       line = 'M' + roundstr(x) +','+ roundstr(y)
-       inner = coords['input']['inner']
+       if flat:
+          line = 'M' + absolute_xy( x, y )
+       else:
+          line = 'M' + roundstr(x) +','+ roundstr(y)
        x = inner * cos_half_d
        y = inner * sin_half_d
-       line += ' L' + roundstr(x) +','+ roundstr(y)
-       print( '<path d="' + line + '" style="stroke:grey; stroke-width:2;" />' )
+       if flat:
+          line += ' L' + absolute_xy( x, y )
+       else:
+          line += ' L' + roundstr(x) +','+ roundstr(y)
+       if compact:
+          emit( '<path d="' + line + '"/>' )
+       else:
+          emit( '<path d="' + line + '" style="stroke:grey; stroke-width:2;" />' )
 
 
 def compute_slice( d, inner, outer ):
@@ -665,27 +2521,1153 @@ def compute_slice( d, inner, outer ):
     return result
 
 
-def output_a_slice( coords, colour ):
+def pdf_point( x, y ):
+    return '%.2f %.2f' % ( x, y )
+
+
+def pdf_arc( radius, start, end ):
+    # curves for an arc around the center, angles in radians,
+    # at most a quarter circle for each curve
+    n = max( 1, math.ceil( abs( end - start ) / ( math.pi / 2 ) - 1e-9 ) )
+    step = ( end - start ) / n
+    k = 4.0 / 3.0 * math.tan( step / 4.0 ) * radius
+    ops = ''
+    a = start
+    for _ in range( n ):
+        b = a + step
+        x0 = cx + radius * math.cos( a )
+        y0 = cy + radius * math.sin( a )
+        x3 = cx + radius * math.cos( b )
+        y3 = cy + radius * math.sin( b )
+        ops += pdf_point( x0 - k * math.sin( a ), y0 + k * math.cos( a ) ) + ' '
+        ops += pdf_point( x3 + k * math.sin( b ), y3 - k * math.cos( b ) ) + ' '
+        ops += pdf_point( x3, y3 ) + ' c\n'
+        a = b
+    return ops
+
+
+def pdf_sector( coords, colour_index ):
+    # the same shape as the svg slice, in page coordinates
+    rotation = math.radians( rotation_stack[-1] )
+    half_d = coords['input']['half_d']
+    inner = coords['input']['inner']
+    outer = coords['input']['outer']
+    start = rotation - half_d
+    end = rotation + half_d
+    sink.set_fill( slice_colours[colour_index] )
+    ops = pdf_point( cx + inner * math.cos( start ), cy + inner * math.sin( start ) ) + ' m\n'
+    ops += pdf_arc( inner, start, end )
+    ops += pdf_point( cx + outer * math.cos( end ), cy + outer * math.sin( end ) ) + ' l\n'
+    ops += pdf_arc( outer, end, start )
+    sink.write( ops + 'b\n' )
+
+
+def pdf_line( x1, y1, x2, y2 ):
+    # points in the current rotated context
+    sink.write( absolute_xy( x1, y1 ).replace( ',', ' ' ) + ' m ' + absolute_xy( x2, y2 ).replace( ',', ' ' ) + ' l S\n' )
+
+
+def pdf_circle( radius ):
+    ops = pdf_point( cx + radius, cy ) + ' m\n'
+    ops += pdf_arc( radius, 0, 2 * math.pi )
+    sink.write( ops + 'S\n' )
+
+
+def pdf_text( font_size, offset, text, length, position, straight ):
+    # Each character is placed along the path like svg textPath,
+    # the middle of the character is on the path and it is turned
+    # to the direction of the path at that point. The position function
+    # gives the point and direction at a distance along the path.
+    # Characters past the end of the path are left out.
+
+    # The font size was chosen from the estimated widths, a wider font
+    # is narrowed to the estimated width so that it still fits.
+    text = html.unescape( text )
+    glyphs = sink.glyphs( text, font_size )
+    squeeze = min( 1.0, estimate_string_width( font_size, text ) / max( sum( [g[1] for g in glyphs] ), 1e-9 ) )
+
+    s = length * float( offset.rstrip( '%' ) ) / 100.0
+    # horizontal scale is kept between texts, so it is always given
+    scale = 100.0
+    if straight:
+       scale *= squeeze
+    ops = ['BT /F1 %.2f Tf 0 g %.1f Tz' % ( font_size, scale )]
+
+    if straight:
+       # one string in the direction of the line
+       codes = ''
+       for code, width in glyphs:
+           width *= squeeze
+           if s + width / 2.0 > length:
+              break
+           codes += code
+           s += width
+       if codes:
+          x, y, dx, dy = position( length * float( offset.rstrip( '%' ) ) / 100.0 )
+          ops.append( '%.4f %.4f %.4f %.4f %.2f %.2f Tm %s Tj' % ( dx, dy, dy, - dx, x, y, sink.text_string( codes ) ) )
+
+    else:
+       for code, width in glyphs:
+           width *= squeeze
+           middle = s + width / 2.0
+           if middle > length:
+              break
+           x, y, dx, dy = position( middle )
+           x -= dx * width / 2.0
+           y -= dy * width / 2.0
+           # y is down the page, so the character's up is to the left of the direction
+           ops.append( '%.4f %.4f %.4f %.4f %.2f %.2f Tm %s Tj' % ( dx * squeeze, dy * squeeze, dy, - dx, x, y, sink.text_string( code ) ) )
+           s += width
+
+    sink.write( '\n'.join( ops ) + ' ET\n' )
+    sink.fill = None
+
+
+def pdf_text_on_arc( font_size, coords, offset, text ):
+    # the svg path goes along the outer edge from p3 to p4
+    radius = coords['input']['outer']
+    start = math.radians( rotation_stack[-1] ) + coords['input']['half_d']
+
+    def position( s ):
+        angle = start - s / radius
+        return [cx + radius * math.cos( angle ), cy + radius * math.sin( angle ), math.sin( angle ), - math.cos( angle )]
+
+    pdf_text( font_size, offset, text, radius * 2 * coords['input']['half_d'], position, False )
+
+
+def pdf_text_on_line( font_size, coords, offset, text ):
+    # the svg path goes from p2 to p3
+    angle = math.radians( rotation_stack[-1] )
+    cos_a = math.cos( angle )
+    sin_a = math.sin( angle )
+    x1 = cx + coords['p2']['x'] * cos_a - coords['p2']['y'] * sin_a
+    y1 = cy + coords['p2']['x'] * sin_a + coords['p2']['y'] * cos_a
+    x2 = cx + coords['p3']['x'] * cos_a - coords['p3']['y'] * sin_a
+    y2 = cy + coords['p3']['x'] * sin_a + coords['p3']['y'] * cos_a
+    length = math.hypot( x2 - x1, y2 - y1 )
+    dx = ( x2 - x1 ) / length
+    dy = ( y2 - y1 ) / length
+
+    def position( s ):
+        return [x1 + dx * s, y1 + dy * s, dx, dy]
+
+    pdf_text( font_size, offset, text, length, position, True )
+
+
+def preview_sector( kind, rotation, half_d, inner, outer, colour ):
+    # Save a part of the chart for the preview, every part is an annular sector.
+    # Angles are in degrees from the x-axis, in page coordinates.
+    preview_shapes[kind].append( [rotation - half_d, rotation + half_d, inner, outer, colour] )
+
+
+def preview_slice( coords, colour_index ):
+    half_d = math.degrees( coords['input']['half_d'] )
+    preview_sector( 'slices', rotation_stack[-1], half_d, coords['input']['inner'], coords['input']['outer'], colour_index )
+
+
+def preview_text_on_arc( kind, font_size, coords, offset, text ):
+    # the text is a block from the outer edge inward by the font height
+    radius = coords['input']['outer']
+    length = radius * 2 * coords['input']['half_d']
+    start = length * float( offset.rstrip( '%' ) ) / 100.0
+    width = min( estimate_string_width( font_size, html.unescape( text ) ), length - start )
+    # the text goes from the end of the arc with the larger angle
+    middle = math.degrees( coords['input']['half_d'] - ( start + width / 2.0 ) / radius )
+    half_width = math.degrees( width / 2.0 / radius )
+    height = estimate_font_height( font_size )
+    preview_sector( kind, rotation_stack[-1] + middle, half_width, radius - height, radius, None )
+
+
+def preview_text_on_line( kind, font_size, coords, offset, text ):
+    # the text goes outward from the inner edge, the letters on the side of the smaller angle
+    inner = coords['input']['inner']
+    length = coords['p3']['x'] - coords['p2']['x']
+    start = length * float( offset.rstrip( '%' ) ) / 100.0
+    width = min( estimate_string_width( font_size, html.unescape( text ) ), length - start )
+    radius = inner + start + width / 2.0
+    half_height = math.degrees( estimate_font_height( font_size ) / 2.0 / radius )
+    middle = math.degrees( coords['input']['half_d'] ) - half_height
+    preview_sector( kind, rotation_stack[-1] + middle, half_height, inner + start, inner + start + width, None )
+
+
+def preview_line( half_d, inner, outer ):
+    # a line is a sector as wide as a pixel
+    half_width = math.degrees( 0.5 / outer * page_size / options['preview-size'] )
+    preview_sector( 'lines', rotation_stack[-1] + math.degrees( half_d ), half_width, inner, outer, None )
+
+
+def preview_copy( shapes, rotation ):
+    # put in the saved shapes of a shared family, turned to where the copy goes
+    for kind in shapes:
+        for shape in shapes[kind]:
+            preview_shapes[kind].append( [shape[0] + rotation, shape[1] + rotation] + shape[2:] )
+
+
+def paint_sectors( image, radius, angle, edges, sectors, colours ):
+    # Fill the sectors, which must not overlap within a band between two
+    # of the edges. Each pixel finds its band from its radius, then its
+    # sector from its angle by a binary search of the sector starts
+    # sorted by band then angle, so every pixel is looked at only once.
+
+    np = numpy_module()
+    if not sectors:
+       return None
+
+    shapes = np.array( [s[:4] for s in sectors], dtype=float )
+    values = np.arange( len( sectors ) )
+    start = shapes[:,0] % 360.0
+    end = start + ( shapes[:,1] - shapes[:,0] )
+    # a sector past 360 is split in two
+    wraps = end > 360.0
+    start = np.concatenate( [start, np.zeros( wraps.sum() )] )
+    end = np.concatenate( [np.minimum( end, 360.0 ), end[wraps] - 360.0] )
+    values = np.concatenate( [values, values[wraps]] )
+    shapes = shapes[values]
+
+    middle = ( shapes[:,2] + shapes[:,3] ) / 2.0
+    band = np.searchsorted( edges, middle, side='right' ) - 1
+    keys = band * 360.0 + start
+    order = np.argsort( keys, kind='stable' )
+    keys = keys[order]
+    end = ( band * 360.0 + end )[order]
+    shapes = shapes[order]
+    values = values[order]
+
+    pixel_band = np.searchsorted( edges, radius, side='right' ) - 1
+    pixel_keys = pixel_band * 360.0 + angle
+    found = np.searchsorted( keys, pixel_keys, side='right' ) - 1
+    found = np.maximum( found, 0 )
+    inside = ( pixel_keys < end[found] ) & ( pixel_keys >= keys[found] )
+    inside &= ( radius >= shapes[found,2] ) & ( radius < shapes[found,3] )
+
+    if colours is not None:
+       image[inside] = colours[values[found[inside]]]
+    result = np.full( radius.shape, -1 )
+    result[inside] = values[found[inside]]
+    return result
+
+
+def numpy_module():
+    # NumPy is only needed for the preview
+    global numpy
+    if numpy is None:
+       try:
+          import numpy as np
+       except ImportError:
+          print( 'The preview needs the NumPy module', file=sys.stderr )
+          sys.exit(1)
+       numpy = np
+    return numpy
+
+
+def write_png( file_name, image ):
+    # rgb image rows, each with a filter byte of none
+    np = numpy_module()
+    height, width = image.shape[:2]
+    rows = np.zeros( ( height, width * 3 + 1 ), dtype=np.uint8 )
+    rows[:,1:] = image.reshape( height, width * 3 )
+
+    def chunk( kind, data ):
+        body = kind + data
+        return struct.pack( '>I', len( data ) ) + body + struct.pack( '>I', zlib.crc32( body ) & 0xFFFFFFFF )
+
+    with open( file_name, 'wb' ) as outf:
+       outf.write( b'\x89PNG\r\n\x1a\n' )
+       outf.write( chunk( b'IHDR', struct.pack( '>IIBBBBB', width, height, 8, 2, 0, 0, 0 ) ) )
+       outf.write( chunk( b'IDAT', zlib.compress( rows.tobytes(), 6 ) ) )
+       outf.write( chunk( b'IEND', b'' ) )
+
+
+def output_preview( file_name ):
+    # A quick picture of the chart from the saved shapes: slices in their
+    # colours with outlines, and each name as a darker block.
+
+    np = numpy_module()
+    size = options['preview-size']
+    scale = page_size / size
+
+    # polar coordinates of the center of each pixel
+    y, x = np.indices( ( size, size ), dtype=float )
+    x = ( x + 0.5 ) * scale - cx
+    y = ( y + 0.5 ) * scale - cy
+    radius = np.hypot( x, y )
+    angle = np.degrees( np.arctan2( y, x ) ) % 360.0
+
+    image = np.full( ( size, size, 3 ), 255, dtype=np.uint8 )
+    colours = np.array( [[int( c[i:i+2], 16 ) for i in [1, 3, 5]] for c in slice_colours], dtype=np.uint8 )
+    grey = np.array( [128, 128, 128], dtype=np.uint8 )
+
+    rings = chart_rings
+    ring_edges = np.array( [0.0] + [ring['outer'] for ring in rings] )
+
+    slice_colour_index = [s[4] for s in preview_shapes['slices']]
+    slice_colours_used = colours[slice_colour_index] if slice_colour_index else None
+    found = paint_sectors( image, radius, angle, ring_edges, preview_shapes['slices'], slice_colours_used )
+
+    # outlines where the slice changes from one pixel to the next
+    if found is not None:
+       edge = np.zeros( found.shape, dtype=bool )
+       edge[:,1:] |= found[:,1:] != found[:,:-1]
+       edge[1:,:] |= found[1:,:] != found[:-1,:]
+       edge &= radius < ring_edges[-1]
+       image[edge] = grey
+
+    # names and partner names are done separately since they overlap in each ring
+    for kind in ['names', 'partners']:
+        text = paint_sectors( image, radius, angle, ring_edges, preview_shapes[kind], None )
+        if text is not None:
+           image[text >= 0] = image[text >= 0] // 2
+
+    paint_sectors( image, radius, angle, ring_edges, preview_shapes['lines'], np.tile( grey, ( len( preview_shapes['lines'] ), 1 ) ) )
+
+    # ring outlines as in outline_generations, only in the viewport
+    outline = np.ones( radius.shape, dtype=bool )
+    if view['angles'] is not None:
+       low, high = view['angles']
+       outline = ( angle - low ) % 360.0 <= high - low
+    for i, ring in enumerate( rings ):
+        if view['first'] - 1 <= i <= view['last']:
+           image[outline & ( np.abs( radius - ring['outer'] ) < scale )] = grey
+
+    write_png( file_name, image )
+
+
+def begin_tile_part():
+    # With tiles, the output of each part of the chart is kept
+    # along with where it is, rather than going to the output.
+    global sink
+    if options['tiles']:
+       tile_sinks.append( sink )
+       sink = OutputSink( io.StringIO() )
+
+
+def end_tile_part( rotation, half_degrees, inner, outer ):
+    # the part covers this sector, angles in degrees
+    global sink
+    if options['tiles']:
+       sink.flush()
+       text = sink.outf.getvalue()
+       sink = tile_sinks.pop()
+       if text:
+          tile_parts.append( [rotation - half_degrees, rotation + half_degrees, inner, outer, text] )
+
+
+def build_tile_index( rings ):
+    # For each ring, the parts in it sorted by where they start. Parts in a
+    # ring can overlap, as when a person is drawn again under pedigree collapse,
+    # so their ends aren't in order. The furthest end reached so far is
+    # in order though, and a binary search of it finds the first part which
+    # might reach a range of angles. Parts around the whole circle, the center
+    # names and the ring outlines, are kept aside.
+
+    index = {'outers':[ring['outer'] for ring in rings], 'rings':[], 'circles':[]}
+    entries = [[] for ring in rings]
+
+    for i, part in enumerate( tile_parts ):
+        span = part[1] - part[0]
+        if span >= 360.0:
+           index['circles'].append( i )
+           continue
+        ring = min( bisect.bisect_left( index['outers'], ( part[2] + part[3] ) / 2.0 ), len( rings ) - 1 )
+        start = part[0] % 360.0
+        end = start + span
+        if end > 360.0:
+           entries[ring].append( [start, 360.0, i] )
+           entries[ring].append( [0.0, end - 360.0, i] )
+        else:
+           entries[ring].append( [start, end, i] )
+
+    for ring_entries in entries:
+        ring_entries.sort()
+        reach = []
+        furthest = 0.0
+        for e in ring_entries:
+            furthest = max( furthest, e[1] )
+            reach.append( furthest )
+        parts = [e[2] for e in ring_entries]
+        inner = min( [tile_parts[i][2] for i in parts], default=0.0 )
+        outer = max( [tile_parts[i][3] for i in parts], default=0.0 )
+        index['rings'].append( {'starts':[e[0] for e in ring_entries], 'ends':[e[1] for e in ring_entries], 'reach':reach, 'parts':parts, 'inner':inner, 'outer':outer} )
+
+    return index
+
+
+def tile_polar_range( x0, y0, x1, y1 ):
+    # smallest and largest radius of a rectangle of the page, and its angle ranges in degrees
+    x0 -= cx
+    x1 -= cx
+    y0 -= cy
+    y1 -= cy
+    corners = [[x0, y0], [x1, y0], [x0, y1], [x1, y1]]
+
+    nearest_x = min( max( 0.0, x0 ), x1 )
+    nearest_y = min( max( 0.0, y0 ), y1 )
+    r_min = math.hypot( nearest_x, nearest_y )
+    r_max = max( [math.hypot( x, y ) for x, y in corners] )
+
+    if x0 <= 0.0 <= x1 and y0 <= 0.0 <= y1:
+       return r_min, r_max, [[0.0, 360.0]]
+
+    # the center is outside so the rectangle covers less than half the circle,
+    # measure the corners from the direction of the middle of the rectangle
+    middle = math.degrees( math.atan2( ( y0 + y1 ) / 2.0, ( x0 + x1 ) / 2.0 ) )
+    offsets = [( math.degrees( math.atan2( y, x ) ) - middle + 180.0 ) % 360.0 - 180.0 for x, y in corners]
+    low = ( middle + min( offsets ) ) % 360.0
+    high = low + max( offsets ) - min( offsets )
+    if high > 360.0:
+       return r_min, r_max, [[low, 360.0], [0.0, high - 360.0]]
+    return r_min, r_max, [[low, high]]
+
+
+def find_tile_parts( index, view ):
+    # the parts which might be in the view, in the order they were drawn
+    r_min, r_max, angle_ranges = tile_polar_range( view[0], view[1], view[0] + view[2], view[1] + view[3] )
+
+    found = set()
+    for i in index['circles']:
+        if tile_parts[i][3] >= r_min and tile_parts[i][2] <= r_max:
+           found.add( i )
+
+    for ring in index['rings']:
+        if ring['outer'] >= r_min and ring['inner'] <= r_max:
+           for low, high in angle_ranges:
+               first = bisect.bisect_right( ring['reach'], low )
+               last = bisect.bisect_left( ring['starts'], high )
+               for k in range( first, last ):
+                   i = ring['parts'][k]
+                   if ring['ends'][k] > low and tile_parts[i][3] >= r_min and tile_parts[i][2] <= r_max:
+                      found.add( i )
+
+    return sorted( found )
+
+
+def tile_file_name( base_name, row, col ):
+    name, extension = os.path.splitext( base_name )
+    if not extension:
+       extension = '.svg'
+    return name + '-' + str( row + 1 ) + '-' + str( col + 1 ) + extension
+
+
+def tile_view( row, col ):
+    # the tile's part of the page, with the overlap on each side
+    rows, cols = options['tiles']
+    overlap = options['tile-overlap']
+    width = page_size / cols
+    height = page_size / rows
+    return [col * width - overlap, row * height - overlap, width + 2 * overlap, height + 2 * overlap]
+
+
+def output_registration_marks( row, col ):
+    # a cross and circle on each corner where the tiles meet
+    rows, cols = options['tiles']
+    size = max( options['tile-overlap'], 2.0 ) / 2.0
+    style = ' style="stroke:black; stroke-width:0.5; fill:none;"'
+    for y in [row * page_size / rows, ( row + 1 ) * page_size / rows]:
+        for x in [col * page_size / cols, ( col + 1 ) * page_size / cols]:
+            mark = 'M' + roundstr( x - size ) + ',' + roundstr( y ) + ' L' + roundstr( x + size ) + ',' + roundstr( y )
+            mark += ' M' + roundstr( x ) + ',' + roundstr( y - size ) + ' L' + roundstr( x ) + ',' + roundstr( y + size )
+            emit( '<path d="' + mark + '"' + style + ' />' )
+            emit( '<circle cx="' + roundstr( x ) + '" cy="' + roundstr( y ) + '" r="' + roundstr( size / 2.0 ) + '"' + style + ' />' )
+
+
+def output_tile( tile ):
+    # one tile to its own file, run in a worker process
+    global sink
+    row, col, file_name = tile
+    view = tile_view( row, col )
+    parts = find_tile_parts( tile_index, view )
+
+    sink = open_output_sink( file_name )
+    output_header( view )
+    for i in parts:
+        sink.write( tile_parts[i][4] )
+    output_registration_marks( row, col )
+    output_trailer()
+    sink.close()
+
+    return [file_name, len( parts )]
+
+
+def output_tiles( base_name, rings ):
+    # The chart is already laid out into parts, each tile gets the parts it
+    # needs from the index. Tiles are made in parallel by forked processes
+    # which share the parts and the index, otherwise one at a time.
+
+    global tile_index
+    tile_index = build_tile_index( rings )
+
+    rows, cols = options['tiles']
+    tasks = []
+    for row in range( rows ):
+        for col in range( cols ):
+            tasks.append( [row, col, tile_file_name( base_name, row, col )] )
+
+    if len( tasks ) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+       n_workers = min( len( tasks ), os.cpu_count() or 1 )
+       with multiprocessing.get_context( 'fork' ).Pool( n_workers ) as pool:
+          results = pool.map( output_tile, tasks )
+    else:
+       results = [output_tile( task ) for task in tasks]
+
+    if options['stats']:
+       print( 'parts in the chart:', len( tile_parts ), file=sys.stderr )
+       for file_name, n_parts in results:
+           print( 'tile', file_name, 'parts:', n_parts, file=sys.stderr )
+
+
+def canvas_label( font_size, coords, offset, text, straight ):
+    # A name for the canvas output, on the same path as in the svg: along
+    # the outer edge from the larger angle, or outward from the inner edge
+    # on the side of the larger angle for straight text.
+    half_d = math.degrees( coords['input']['half_d'] )
+    rotation = rotation_stack[-1]
+    label = [rotation - half_d, rotation + half_d, coords['input']['inner'], coords['input']['outer']]
+    label += [font_size, float( offset.rstrip( '%' ) ) / 100.0, straight, html.unescape( text )]
+    preview_shapes['labels'].append( label )
+
+
+def canvas_separator( half_d, inner, outer ):
+    angle = rotation_stack[-1] + math.degrees( half_d )
+    preview_shapes['separators'].append( [angle, angle, inner, outer] )
+
+
+def canvas_buffer():
+    # The chart as column arrays of 4 byte numbers, little endian, each
+    # starting on a multiple of 4 so that they can be used as typed arrays:
+    #   header: "FANC", version, number of sectors, labels, lines, rings,
+    #           bytes of text, then the center x and y
+    #   sectors: start and end angle in degrees, inner and outer radius,
+    #            then a byte of colour index for each
+    #   labels: start and end angle, inner and outer radius, font size,
+    #           offset as a fraction of the path, then for each the start
+    #           and length of its text and 1 for straight text
+    #   lines: angle, inner and outer radius
+    #   rings: outer radius
+    #   text: utf-8
+
+    sectors = preview_shapes['slices']
+    labels = preview_shapes['labels']
+    lines = preview_shapes['separators']
+    rings = [ring['outer'] for i, ring in enumerate( chart_rings ) if view['first'] - 1 <= i <= view['last']]
+
+    def floats( values ):
+        return struct.pack( '<' + str( len( values ) ) + 'f', *values )
+
+    def ints( values ):
+        return struct.pack( '<' + str( len( values ) ) + 'I', *values )
+
+    text = b''
+    text_refs = []
+    for label in labels:
+        encoded = label[7].encode( 'utf-8' )
+        text_refs.extend( [len( text ), len( encoded ), 1 if label[6] else 0] )
+        text += encoded
+
+    colours = bytes( [shape[4] for shape in sectors] )
+    colours += bytes( -len( colours ) % 4 )
+
+    parts = [b'FANC', ints( [1, len( sectors ), len( labels ), len( lines ), len( rings ), len( text )] ), floats( [cx, cy] )]
+    parts.append( floats( [a for shape in sectors for a in shape[0:2]] ) )
+    parts.append( floats( [r for shape in sectors for r in shape[2:4]] ) )
+    parts.append( colours )
+    parts.append( floats( [x for label in labels for x in label[0:6]] ) )
+    parts.append( ints( text_refs ) )
+    parts.append( floats( [x for line in lines for x in [line[0], line[2], line[3]]] ) )
+    parts.append( floats( rings ) )
+    parts.append( text )
+    return b''.join( parts )
+
+
+def output_canvas( file_name ):
+    # The packed chart beside a page which draws it on a canvas.
+    # Wheel to zoom, drag to move; names are drawn once they are big enough to read.
+
+    buffer_name = os.path.splitext( file_name )[0] + '.bin'
+    with open( buffer_name, 'wb' ) as outf:
+       outf.write( canvas_buffer() )
+
+    script = """
+var colours = COLOURS;
+var canvas = document.getElementById( 'chart' );
+var ctx = canvas.getContext( '2d' );
+var box = [0, 0, PAGE, PAGE];
+var at = { scale: 1, x: 0, y: 0 };
+var chart = null;
+var waiting = false;
+
+function load( buffer ) {
+  var head = new DataView( buffer );
+  var n = [1, 2, 3, 4, 5].map( function( i ) { return head.getUint32( 4 * i + 4, true ); } );
+  var offset = 36;
+  function floats( count ) { var a = new Float32Array( buffer, offset, count ); offset += 4 * count; return a; }
+  function ints( count ) { var a = new Uint32Array( buffer, offset, count ); offset += 4 * count; return a; }
+  function bytes( count ) { var a = new Uint8Array( buffer, offset, count ); offset += ( count + 3 ) & ~3; return a; }
+
+  chart = { cx: head.getFloat32( 28, true ), cy: head.getFloat32( 32, true ) };
+  var angles = floats( 2 * n[0] ), radii = floats( 2 * n[0] ), colour = bytes( n[0] );
+  chart.labels = floats( 6 * n[1] );
+  chart.refs = ints( 3 * n[1] );
+  var lines = floats( 3 * n[2] ), rings = floats( n[3] );
+  var text = bytes( n[4] );
+  var decoder = new TextDecoder();
+  chart.text = [];
+  for ( var i = 0; i < n[1]; i++ ) {
+    chart.text.push( decoder.decode( text.subarray( chart.refs[3*i], chart.refs[3*i] + chart.refs[3*i+1] ) ) );
+  }
+
+  var cx = chart.cx, cy = chart.cy, k = Math.PI / 180;
+  chart.fills = colours.map( function() { return new Path2D(); } );
+  for ( var i = 0; i < n[0]; i++ ) {
+    var p = chart.fills[colour[i]], a0 = angles[2*i] * k, a1 = angles[2*i+1] * k;
+    p.moveTo( cx + radii[2*i+1] * Math.cos( a0 ), cy + radii[2*i+1] * Math.sin( a0 ) );
+    p.arc( cx, cy, radii[2*i+1], a0, a1 );
+    p.arc( cx, cy, radii[2*i], a1, a0, true );
+    p.closePath();
+  }
+  chart.lines = new Path2D();
+  for ( var i = 0; i < n[2]; i++ ) {
+    var a = lines[3*i] * k;
+    chart.lines.moveTo( cx + lines[3*i+1] * Math.cos( a ), cy + lines[3*i+1] * Math.sin( a ) );
+    chart.lines.lineTo( cx + lines[3*i+2] * Math.cos( a ), cy + lines[3*i+2] * Math.sin( a ) );
+  }
+  for ( var i = 0; i < n[3]; i++ ) {
+    chart.lines.moveTo( cx + rings[i], cy );
+    chart.lines.arc( cx, cy, rings[i], 0, 2 * Math.PI );
+  }
+  draw();
+}
+
+function drawLabel( i ) {
+  var s = chart.labels.subarray( 6 * i, 6 * i + 6 ), text = chart.text[i], k = Math.PI / 180;
+  ctx.font = s[4] + 'px Times New Roman, serif';
+  if ( chart.refs[3*i+2] ) {
+    var length = s[3] - s[2];
+    ctx.save();
+    ctx.translate( chart.cx, chart.cy );
+    ctx.rotate( s[1] * k );
+    ctx.fillText( text, s[2] + length * s[5], 0, length * ( 1 - s[5] ) );
+    ctx.restore();
+    return;
+  }
+  // each character along the arc, narrowed if the font is wider than expected
+  var r = s[3], length = r * ( s[1] - s[0] ) * k, d = length * s[5];
+  var squeeze = Math.min( 1, ( length - d ) / ctx.measureText( text ).width );
+  for ( var c of text ) {
+    var w = ctx.measureText( c ).width * squeeze;
+    if ( d + w / 2 > length ) break;
+    var a = s[1] * k - ( d + w / 2 ) / r;
+    ctx.save();
+    ctx.translate( chart.cx + r * Math.cos( a ), chart.cy + r * Math.sin( a ) );
+    ctx.rotate( a - Math.PI / 2 );
+    ctx.scale( squeeze, 1 );
+    ctx.fillText( c, - w / squeeze / 2, 0 );
+    ctx.restore();
+    d += w;
+  }
+}
+
+function draw() {
+  waiting = false;
+  var ratio = window.devicePixelRatio || 1;
+  var width = canvas.clientWidth * ratio, height = canvas.clientHeight * ratio;
+  canvas.width = width;
+  canvas.height = height;
+  at.scale = Math.min( width / box[2], height / box[3] );
+  at.x = ( width - box[2] * at.scale ) / 2 - box[0] * at.scale;
+  at.y = ( height - box[3] * at.scale ) / 2 - box[1] * at.scale;
+  ctx.setTransform( at.scale, 0, 0, at.scale, at.x, at.y );
+
+  ctx.lineWidth = 2;
+  ctx.strokeStyle = 'grey';
+  chart.fills.forEach( function( p, i ) { ctx.fillStyle = colours[i]; ctx.fill( p ); ctx.stroke( p ); } );
+  ctx.stroke( chart.lines );
+
+  // only the names which can be read and are on the screen
+  var x0 = - at.x / at.scale, y0 = - at.y / at.scale, x1 = x0 + width / at.scale, y1 = y0 + height / at.scale;
+  ctx.fillStyle = 'black';
+  for ( var i = 0; i < chart.text.length; i++ ) {
+    var s = chart.labels.subarray( 6 * i, 6 * i + 6 );
+    if ( s[4] * at.scale < 3 * ratio ) continue;
+    var a = ( s[0] + s[1] ) * Math.PI / 360, r = ( s[2] + s[3] ) / 2, reach = s[3] - s[2] + r * ( s[1] - s[0] ) * Math.PI / 180;
+    var x = chart.cx + r * Math.cos( a ), y = chart.cy + r * Math.sin( a );
+    if ( x + reach < x0 || x - reach > x1 || y + reach < y0 || y - reach > y1 ) continue;
+    drawLabel( i );
+  }
+}
+
+function redraw() {
+  if ( chart && !waiting ) { waiting = true; requestAnimationFrame( draw ); }
+}
+
+function toChart( event ) {
+  var rect = canvas.getBoundingClientRect(), ratio = window.devicePixelRatio || 1;
+  return { x: ( ( event.clientX - rect.left ) * ratio - at.x ) / at.scale, y: ( ( event.clientY - rect.top ) * ratio - at.y ) / at.scale };
+}
+
+canvas.addEventListener( 'wheel', function( event ) {
+  event.preventDefault();
+  var p = toChart( event ), k = event.deltaY < 0 ? 0.8 : 1.25;
+  box = [p.x - ( p.x - box[0] ) * k, p.y - ( p.y - box[1] ) * k, box[2] * k, box[3] * k];
+  redraw();
+} );
+
+var dragging = null;
+canvas.addEventListener( 'pointerdown', function( event ) { dragging = toChart( event ); } );
+canvas.addEventListener( 'pointerup', function() { dragging = null; } );
+canvas.addEventListener( 'pointermove', function( event ) {
+  if ( !dragging ) return;
+  var p = toChart( event );
+  box[0] -= p.x - dragging.x;
+  box[1] -= p.y - dragging.y;
+  redraw();
+} );
+window.addEventListener( 'resize', redraw );
+
+fetch( 'BUFFER' ).then( function( r ) { return r.arrayBuffer(); } ).then( load );
+"""
+    script = script.replace( 'COLOURS', json.dumps( slice_colours ) )
+    script = script.replace( 'PAGE', str( page_size ) )
+    script = script.replace( 'BUFFER', os.path.basename( buffer_name ) )
+
+    with open( file_name, 'w', encoding='utf-8' ) as outf:
+       outf.write( '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Fan chart</title>\n' )
+       outf.write( '<style>html,body{margin:0;height:100%}canvas{display:block;width:100%;height:100%}</style>\n' )
+       outf.write( '</head>\n<body>\n<canvas id="chart"></canvas>\n<script>' + script + '</script>\n</body>\n</html>\n' )
+
+
+def record_shape( kind, coords, details=None ):
+    # Record a shape of the chart as it is drawn, apart from how it is drawn,
+    # so it can be drawn again in other formats. The rotation is from the page
+    # and the slice is rebuilt from its angle and radii. The chart itself is
+    # drawn as it is laid out, this is only a record of it.
+    if recorded_shapes['recording']:
+       item = {'kind':kind, 'rotation':rotation_stack[-1], 'd':coords['input']['d']}
+       item['inner'] = coords['input']['inner']
+       item['outer'] = coords['input']['outer']
+       if details:
+          item.update( details )
+       recorded_shapes['items'].append( item )
+
+
+def record_copy( items, rotation ):
+    # put in the recorded shapes of a shared family, turned to where the copy goes,
+    # with text path ids of their own
+    recorded_shapes['copies'] += 1
+    suffix = 'c' + str( recorded_shapes['copies'] )
+    for item in items:
+        item = dict( item )
+        if 'rotation' in item:
+           item['rotation'] += rotation
+        if 'path id' in item:
+           item['path id'] += suffix
+        recorded_shapes['items'].append( item )
+
+
+def replay_format( file_name ):
+    # the format is given by the file ending
+    extension = os.path.splitext( file_name.lower() )[1]
+    if extension == '.svgz':
+       extension = '.svg'
+    if extension in ['.svg', '.pdf', '.png', '.json']:
+       return extension[1:]
+    return None
+
+
+def replay_shapes( items ):
+    # draw the recorded shapes with the current output choices, one at a time
+    for item in items:
+        kind = item['kind']
+        if kind == 'rings':
+           outline_generations( item['rings'] )
+           continue
+        rotation_stack.append( item['rotation'] )
+        coords = compute_slice( item['d'], item['inner'], item['outer'] )
+        if kind == 'sector':
+           output_a_slice( coords, item['colour'] )
+        elif kind == 'arc text':
+           output_text_on_arc( item['preview kind'], item['font size'], item['path id'], coords, item['offset'], item['text'] )
+        elif kind == 'line text':
+           output_text_on_line( item['preview kind'], item['font size'], item['path id'], coords, item['offset'], item['text'] )
+        elif kind == 'separator':
+           output_separator( coords )
+        elif kind == 'mark':
+           output_small_name_mark( coords, item['preview kind'] )
+        rotation_stack.pop()
+
+
+def output_replay( file_name ):
+    # The chart is already drawn, replay its recorded shapes into another
+    # format. The replay is flat, in page coordinates, without the merged
+    # paths or shared families of the chart, and only the shapes are drawn
+    # so the extra outputs of the first drawing are left alone.
+
+    global sink, pdf, compact
+
+    chart_format = replay_format( file_name )
+    if chart_format == 'json':
+       with open( file_name, 'w', encoding='utf-8' ) as outf:
+          json.dump( {'page':page_size, 'center':[cx, cy], 'items':recorded_shapes['items']}, outf, separators=(',', ':') )
+       return
+
+    saved = [sink, pdf, compact, dict( options ), dict( arc_ids )]
+    saved_shapes = dict( preview_shapes )
+    arc_ids.clear()
+    options.update( {'colour-classes':False, 'canvas':None, 'hit-index':None, 'preview':None} )
+    pdf = chart_format == 'pdf'
+    if pdf:
+       compact = False
+
+    if chart_format == 'png':
+       # the preview shapes are made as the parts are drawn, the svg is not kept
+       options['preview'] = file_name
+       for kind in preview_kinds:
+           preview_shapes[kind] = []
+       sink = OutputSink( io.StringIO() )
+    else:
+       options['compress'] = False
+       sink = open_output_sink( file_name )
+
+    draw_replay()
+    sink.close()
+
+    if chart_format == 'png':
+       output_preview( file_name )
+
+    sink, pdf, compact = saved[:3]
+    options.clear()
+    options.update( saved[3] )
+    arc_ids.clear()
+    arc_ids.update( saved[4] )
+    preview_shapes.update( saved_shapes )
+
+
+def draw_replay():
+    # the whole chart from the recorded shapes, in page coordinates
+
+    global flat
+
+    saved = [flat, list( page_offset ), options['merge-paths'], recorded_shapes['recording']]
+    flat = True
+    page_offset[0] = cx
+    page_offset[1] = cy
+    options['merge-paths'] = False
+    recorded_shapes['recording'] = False
+
+    output_header()
+    if compact:
+       emit( '<g ' + font_selection + '>' )
+    elif not pdf:
+       emit( '<g>' )
+    replay_shapes( recorded_shapes['items'] )
+    if not pdf:
+       emit( '</g>' )
+    output_trailer()
+
+    flat = saved[0]
+    page_offset[:] = saved[1]
+    options['merge-paths'] = saved[2]
+    recorded_shapes['recording'] = saved[3]
+
+
+def layout_cache_file( personid ):
+    # The saved layout of a person's chart. The input file is known by its
+    # details as for the other saved files, and a different version of the
+    # program might lay out the chart differently.
+    key = [get_version(), personid] + [options[name] for name in layout_options]
+    key = hashlib.sha1( repr( key ).encode() ).hexdigest()
+    return get_cache_file( 'layout-' + key[:16] )
+
+
+def save_layout( personid ):
+    # what is needed to draw the chart again, with the counts for the stats
+    saved = {'items':recorded_shapes['items'], 'rings':list( chart_rings ), 'hits':preview_shapes['hits']}
+    saved['countables'] = dict( countables )
+    save_cache_file( layout_cache_file( personid ), saved )
+
+
+def draw_saved_layout( saved ):
+    # a chart from a saved layout, without going over the tree
+    countables.clear()
+    countables.update( saved['countables'] )
+    arc_ids.clear()
+    for kind in preview_kinds:
+        preview_shapes[kind] = []
+    preview_shapes['hits'] = saved['hits']
+    chart_rings[:] = saved['rings']
+    recorded_shapes['items'] = saved['items']
+    recorded_shapes['copies'] = 0
+    draw_replay()
+    if options['stats']:
+       print( 'drawn from a saved layout', file=sys.stderr )
+    return True
+
+
+def draw_chart( personid, start_person ):
+    # from the saved layout if there is one, otherwise laid out and saved
+    if personid in saved_layouts:
+       return draw_saved_layout( saved_layouts[personid] )
+    made = make_chart( start_person )
+    if made and options['layout-cache']:
+       save_layout( personid )
+    return made
+
+
+def hit_record( gen, kind, coords, indi, fam ):
+    # where a person is in the chart, a partner also has the family
+    half_d = math.degrees( coords['input']['half_d'] )
+    rotation = rotation_stack[-1]
+    hit = [rotation - half_d, rotation + half_d, coords['input']['inner'], coords['input']['outer'], gen, kind, indi, fam]
+    preview_shapes['hits'].append( hit )
+
+
+def output_hit_index( file_name ):
+    # Who is at each point of the chart, as json. For each ring there is a
+    # layer of the people and a layer of their partners, which are in the
+    # outer half of the ring beside the person. In a layer the parts don't
+    # overlap and are sorted by their start angle, so the part at an angle
+    # is found with a binary search of the starts. Angles are in degrees
+    # clockwise from the top, and a part across the top is split in two.
+    # A point is in the part if its distance from the center is between
+    # the part's inner and outer radius.
+
+    layers = dict()
+    for start, end, inner, outer, gen, kind, indi, fam in preview_shapes['hits']:
+        layer = layers.setdefault( (gen, kind), [] )
+        span = end - start
+        start = ( start + 90.0 ) % 360.0
+        end = start + span
+        for a0, a1 in [[start, min( end, 360.0 )], [0.0, end - 360.0]]:
+            a0 = round( a0, precision + 2 )
+            a1 = round( a1, precision + 2 )
+            if a1 > a0:
+               layer.append( [a0, a1, round( inner, precision ), round( outer, precision ), indi, fam] )
+
+    index = {'center':[cx, cy], 'rings':[ring['outer'] for ring in chart_rings], 'layers':[]}
+    for gen, kind in sorted( layers ):
+        parts = sorted( layers[(gen, kind)], key=lambda part: part[0] )
+        columns = dict( [(name, [part[i] for part in parts]) for i, name in enumerate( ['starts', 'ends', 'inner', 'outer', 'indi', 'fam'] )] )
+        index['layers'].append( dict( [('ring', gen), ('kind', kind)] + list( columns.items() ) ) )
+
+    with open( file_name, 'w', encoding='utf-8' ) as outf:
+       json.dump( index, outf, separators=(',', ':') )
+
+
+def html_parts_folder( base_name ):
+    # the fragments go in a folder beside the html file
+    return os.path.splitext( base_name )[0] + '-parts'
+
+
+def sector_bounds( start, end, inner, outer ):
+    # page rectangle around a ring sector, angles in degrees
+    angles = [start, end]
+    # and where the outer arc is furthest out in x or y
+    a = math.ceil( start / 90.0 ) * 90.0
+    while a < end:
+        angles.append( a )
+        a += 90.0
+    xs = []
+    ys = []
+    for angle in angles:
+        for r in [inner, outer]:
+            xs.append( cx + r * math.cos( math.radians( angle ) ) )
+            ys.append( cy + r * math.sin( math.radians( angle ) ) )
+    return [min( xs ), min( ys ), max( xs ), max( ys )]
+
+
+def begin_html_fragment( gen ):
+    # With html output, each person in the first outer generation
+    # and all their descendants go to a separate file.
+    global sink
+    if html_output and gen == options['inline-generations']:
+       html_sinks.append( sink )
+       sink = OutputSink( io.StringIO() )
+
+
+def end_html_fragment( gen, rotation, half_degrees, inner, outer ):
+    global sink
+    if html_output and gen == options['inline-generations']:
+       sink.flush()
+       text = sink.outf.getvalue()
+       sink = html_sinks.pop()
+       if not text:
+          return
+       file_name = 'f' + str( len( html_fragments ) ) + '.svg'
+       html_fragments.append( [file_name] + sector_bounds( rotation - half_degrees, rotation + half_degrees, inner, outer ) )
+
+       chart_sink = sink
+       sink = open_output_sink( os.path.join( html_folder, file_name ) )
+       output_header()
+       sink.write( text )
+       output_trailer()
+       sink.close()
+       sink = chart_sink
+
+
+def clear_html_folder( folder ):
+    # fragments left from an earlier chart of the same name
+    os.makedirs( folder, exist_ok=True )
+    for name in os.listdir( folder ):
+        if re.fullmatch( r'f\d+\.svg', name ):
+           os.remove( os.path.join( folder, name ) )
+
+
+def output_html( file_name, chart ):
+    # The page has the inner generations of the chart and loads the
+    # fragments of the outer generations which are in view once the
+    # chart is zoomed in. Wheel to zoom, drag to move.
+
+    folder = html_folder
+    chart = '\n'.join( [line for line in chart.split( '\n' ) if not line.startswith( '<?xml' )] )
+    fragments = [[name] + [float( roundstr( x ) ) for x in bounds] for name, *bounds in html_fragments]
+
+    script = """
+var fragments = FRAGMENTS;
+var folder = 'FOLDER/';
+var loadZoom = 2.0;
+var svg = document.querySelector( 'svg' );
+var ns = 'http://www.w3.org/2000/svg';
+var layer = document.createElementNS( ns, 'g' );
+var chart = svg.querySelector( 'g' );
+chart.insertBefore( layer, chart.firstChild );
+var box = [0, 0, PAGE, PAGE];
+var loaded = {};
+
+function show() {
+  svg.setAttribute( 'viewBox', box.join( ' ' ) );
+  if ( PAGE / box[2] < loadZoom ) return;
+  fragments.forEach( function( f ) {
+    if ( loaded[f[0]] || f[1] > box[0] + box[2] || f[3] < box[0] || f[2] > box[1] + box[3] || f[4] < box[1] ) return;
+    loaded[f[0]] = true;
+    fetch( folder + f[0] ).then( function( r ) { return r.text(); } ).then( function( text ) {
+      var doc = new DOMParser().parseFromString( text, 'image/svg+xml' );
+      var g = document.createElementNS( ns, 'g' );
+      Array.from( doc.documentElement.childNodes ).forEach( function( node ) {
+        g.appendChild( document.importNode( node, true ) );
+      } );
+      layer.appendChild( g );
+    } );
+  } );
+}
+
+function toChart( event ) {
+  var point = svg.createSVGPoint();
+  point.x = event.clientX;
+  point.y = event.clientY;
+  return point.matrixTransform( svg.getScreenCTM().inverse() );
+}
+
+svg.addEventListener( 'wheel', function( event ) {
+  event.preventDefault();
+  var p = toChart( event );
+  var k = event.deltaY < 0 ? 0.8 : 1.25;
+  box = [p.x - ( p.x - box[0] ) * k, p.y - ( p.y - box[1] ) * k, box[2] * k, box[3] * k];
+  show();
+} );
+
+var dragging = null;
+svg.addEventListener( 'pointerdown', function( event ) { dragging = toChart( event ); } );
+svg.addEventListener( 'pointerup', function() { dragging = null; } );
+svg.addEventListener( 'pointermove', function( event ) {
+  if ( !dragging ) return;
+  var p = toChart( event );
+  box[0] -= p.x - dragging.x;
+  box[1] -= p.y - dragging.y;
+  show();
+} );
+
+show();
+"""
+    script = script.replace( 'FRAGMENTS', json.dumps( fragments ) )
+    script = script.replace( 'FOLDER', os.path.basename( folder ) )
+    script = script.replace( 'PAGE', str( page_size ) )
+
+    with open( file_name, 'w', encoding='utf-8' ) as outf:
+       outf.write( '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Fan chart</title>\n' )
+       outf.write( '<style>html,body{margin:0;height:100%}svg{display:block;width:100%;height:100%}</style>\n' )
+       outf.write( '</head>\n<body>\n' + chart + '<script>' + script + '</script>\n</body>\n</html>\n' )
+
+    if options['stats']:
+       print( 'html fragments:', len( html_fragments ), file=sys.stderr )
+
+
+def slice_fill( colour_index ):
+    # attribute for the slice colour
+    if options['colour-classes']:
+       if compact:
+          return 'class="c' + str( colour_index ) + '"'
+       return 'class="s c' + str( colour_index ) + '"'
+    if compact:
+       return 'fill="' + slice_colours[colour_index] + '"'
+    return 'style="stroke:grey; stroke-width:2; fill:' + slice_colours[colour_index] +';"'
+
+
+def output_a_slice( coords, colour_index ):
+    record_shape( 'sector', coords, {'colour':colour_index} )
+    if options['preview'] or options['canvas']:
+       preview_slice( coords, colour_index )
+    if pdf:
+       pdf_sector( coords, colour_index )
+       return
     inner = roundstr(coords['input']['inner'])
     outer = roundstr(coords['input']['outer'])
-    print( '<path style="stroke:grey; stroke-width:2; fill:' + colour +';"' )
-    print( 'd="M' + coords['p1']['xy'] )
+    if options['merge-paths']:
+       # save for drawing all the slices of this colour at once
+       path = 'M' + absolute_xy( coords['p1']['x'], coords['p1']['y'] )
+       path += 'A' + inner + ',' + inner + ' 0 0 1 ' + absolute_xy( coords['p2']['x'], coords['p2']['y'] )
+       path += 'L' + absolute_xy( coords['p3']['x'], coords['p3']['y'] )
+       path += 'A' + outer + ',' + outer + ' 0 0 0 ' + absolute_xy( coords['p4']['x'], coords['p4']['y'] ) + 'z'
+       if colour_index not in merged_paths['slices']:
+          merged_paths['slices'][colour_index] = []
+       merged_paths['slices'][colour_index].append( path )
+       return
+    if compact:
+       path = 'M' + output_xy( coords, 'p1' )
+       path += 'A' + inner + ',' + inner + ' 0 0 1 ' + output_xy( coords, 'p2' )
+       path += 'L' + output_xy( coords, 'p3' )
+       path += 'A' + outer + ',' + outer + ' 0 0 0 ' + output_xy( coords, 'p4' ) + 'z'
+       emit( '<path ' + slice_fill( colour_index ) + ' d="' + path + '"/>' )
+       return
+    emit( '<path ' + slice_fill( colour_index ) )
+    emit( 'd="M' + output_xy( coords, 'p1' ) )
     r = inner + ',' + inner
-    print( 'A' + r + ' 0 0 1 ' + coords['p2']['xy'] )
-    print( 'L' + coords['p3']['xy'] )
+    emit( 'A' + r + ' 0 0 1 ' + output_xy( coords, 'p2' ) )
+    emit( 'L' + output_xy( coords, 'p3' ) )
     r = outer + ',' + outer
-    print( 'A' + r + ' 0 0 0 ' + coords['p4']['xy'] )
-    print( 'z" />' )
+    emit( 'A' + r + ' 0 0 0 ' + output_xy( coords, 'p4' ) )
+    emit( 'z" />' )
 
     ## for debugging text, put a line at the bottom of the slice
-    #print( '<path d="M' + p3 + ' ' + p4 + '" style="stroke:red;" />' )
+    #emit( '<path d="M' + p3 + ' ' + p4 + '" style="stroke:red;" />' )
+
+
+def merged_style( fill ):
+    # attributes for one of the merged paths
+    if compact:
+       # stroke is in the style sheet
+       return ' fill="' + fill + '"'
+    return ' fill="' + fill + '" stroke="grey" stroke-width="2"'
+
+
+def output_merged_slices():
+    # one path for all the slices of each colour
+    for colour_index in merged_paths['slices']:
+        if options['colour-classes']:
+           style = ' ' + slice_fill( colour_index )
+        else:
+           style = merged_style( slice_colours[colour_index] )
+        emit( '<path' + style + ' d="' + ''.join( merged_paths['slices'][colour_index] ) + '"/>' )
+
+
+def output_merged_separators():
+    if merged_paths['separators']:
+       emit( '<path' + merged_style( 'none' ) + ' d="' + ''.join( merged_paths['separators'] ) + '"/>' )
 
 
 def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, degrees_per_slice, slice_extra, ring_data, diagram_data ):
     # each slice rotates around the center
     if debug:
        print( 'gen', gen, file=sys.stderr )
-       print( '<!-- gen', gen, '-->' )
+       emit_comment( 'gen', gen )
 
     colour_index = start_colour
 
@@ -698,7 +3680,7 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
     rotation = start_rotation
 
     first_child = True
-    for child in data[fkey][start_fam]['chil']:
+    for child in label_data['fams'][start_fam]['chil']:
         first_child_flag = ''
         if first_child:
            first_child_flag = 'first child'
@@ -715,11 +3697,21 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
         # rotate this much more as if it lined up with the x-axis
         rotation += slice_degrees / 2.0
 
+        begin_html_fragment( gen )
+
+        # with a viewport, parts outside of it are gone over without output
+        # so that the colours stay the same, and the descendants are skipped
+        in_angles = angles_in_view( rotation, slice_degrees )
+        shown = in_angles and view['first'] <= gen <= view['last']
+        if not shown:
+           saved_drawing = dict( drawing )
+           drawing.update( {'groups':False, 'slices':False, 'names':False} )
+
         # each child gets their own graphic context
-        g_rotate = 'rotate(' + roundstr(rotation) + ',0,0)'
         if debug:
-           print( '<!-- gen', gen, first_child_flag, '-->' )
-        print( '<g transform="' + g_rotate + '">' )
+           emit_comment( 'gen', gen, first_child_flag )
+        begin_tile_part()
+        begin_rotation( rotation )
 
         ring_inner = ring_data[gen]['inner']
         ring_outer = ring_data[gen]['outer']
@@ -727,7 +3719,8 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
         slice_coords = compute_slice( slice_degrees, ring_inner, ring_outer )
 
         colour_index = colour_index % n_colours
-        output_a_slice( slice_coords, slice_colours[colour_index] )
+        if drawing['slices']:
+           output_a_slice( slice_coords, colour_index )
 
         # a person with no families takes up the whole slice
         # but with families the person gets the upper half
@@ -738,7 +3731,10 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
            # recompute slice, this time not drawing it
            slice_coords = compute_slice( slice_degrees, ring_inner, ring_outer )
 
-        output_name( slice_coords, False, '', child )
+        if drawing['names']:
+           output_name( slice_coords, False, '', child )
+           if options['hit-index'] or options['layout-cache']:
+              hit_record( gen, 'person', slice_coords, child, None )
 
         # output each spouse name, each gets their own graphic context
         if n_fams > 0:
@@ -757,23 +3753,33 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
                # again recompute
                slice_coords = compute_slice( fam_degrees, ring_inner, ring_outer )
 
-               g_rotate = 'rotate(' + roundstr(fam_rotation) + ',0,0)'
-               print( '<g transform="' + g_rotate + '">' )
-               output_name( slice_coords, True, '+ ', spouse )
-               print( '</g>' )
+               begin_rotation( fam_rotation )
+               if drawing['names']:
+                  output_name( slice_coords, True, '+ ', spouse )
+                  if options['hit-index'] or options['layout-cache']:
+                     hit_record( gen, 'partner', slice_coords, spouse, fam )
+               end_rotation()
                fam_sum += fam_degrees
 
-        print( '</g>' )
+        end_rotation()
+        end_tile_part( rotation, slice_degrees / 2.0, ring_data[gen]['inner'], ring_data[gen]['outer'] )
+
+        if not shown:
+           drawing.update( saved_drawing )
 
         # next generation
-        if n_fams > 0:
+        if n_fams > 0 and in_angles and gen < view['last'] and diagram_data[child]['collapse']:
+           output_collapsed( gen+1, rotation, slice_degrees, colour_index, child, ring_data )
+        elif n_fams > 0 and in_angles and gen < view['last']:
            child_rotation = rotation - slice_degrees / 2.0
            for next_fam_data in diagram_data[child]['fams']:
                next_fam = next_fam_data['fam']
-               output_slices( gen+1, child_rotation, colour_index, colour_skip+2, next_fam, degrees_per_slice, 0, ring_data, diagram_data )
+               output_family( gen+1, child_rotation, colour_index, colour_skip+2, next_fam, degrees_per_slice, ring_data, diagram_data )
                next_slices = next_fam_data['slices']
                child_rotation += next_slices * degrees_per_slice
 
+        end_html_fragment( gen, rotation, slice_degrees / 2.0, ring_data[gen]['inner'], ring_data[-1]['outer'] )
+
         # next child starts rotation where this child ended
         rotation += slice_degrees / 2.0
         colour_index += colour_skip
@@ -781,6 +3787,271 @@ def output_slices( gen, start_rotation, start_colour, colour_skip, start_fam, de
            colour_index = 1
 
 
+def output_collapsed( gen, rotation, slice_degrees, colour_index, indi, ring_data ):
+    # The descendants of a person, over the element budget, as a wedge of
+    # one slice in each of their rings. The innermost tells how many.
+    details = diagram_data[indi]
+    countables['collapsed'] += 1
+    last = min( gen + details['generations'] - 1, len( ring_data ) - 1 )
+
+    label = str( details['descendants'] ) + ' descendants, generation ' + str( gen + 1 )
+    if last > gen:
+       label = str( details['descendants'] ) + ' descendants, generations ' + str( gen + 1 ) + '-' + str( last + 1 )
+
+    for ring in range( gen, last + 1 ):
+        if not view['first'] <= ring <= view['last']:
+           continue
+        begin_tile_part()
+        begin_rotation( rotation )
+        coords = compute_slice( slice_degrees, ring_data[ring]['inner'], ring_data[ring]['outer'] )
+        if drawing['slices']:
+           output_a_slice( coords, colour_index )
+        if drawing['names'] and ring == gen:
+           output_name( coords, False, '', None, label )
+        end_rotation()
+        end_tile_part( rotation, slice_degrees / 2.0, ring_data[ring]['inner'], ring_data[ring]['outer'] )
+
+
+def angles_in_view( rotation, degrees ):
+    # does the slice centered on the rotation overlap the angles of the viewport
+    if view['angles'] is None:
+       return True
+    start = rotation - degrees / 2.0
+    low, high = view['angles']
+    return ( start - low ) % 360.0 < high - low or ( low - start ) % 360.0 < degrees
+
+
+def output_family( gen, start_rotation, start_colour, colour_skip, fam, degrees_per_slice, ring_data, diagram_data ):
+    # The children of a family below the top, and all their descendants.
+    # With pedigree collapse the same family is reached through both partners,
+    # and if it is in the same generation with the same colours the output is
+    # identical except for the rotation. Such a family is output once in defs,
+    # drawn from rotation zero, then each copy is a rotated reference to it.
+
+    key = (fam, gen, start_colour, colour_skip)
+
+    if shared_subtrees['counting']:
+       shared_subtrees['counts'][key] += 1
+
+    if shared_subtrees['counting'] or not drawing['groups'] or shared_subtrees['counts'][key] < 2:
+       # including the pass for merged slices, which are not in groups
+       output_branch( gen, start_rotation, start_colour, colour_skip, fam, degrees_per_slice, ring_data, diagram_data )
+       return
+
+    subtree_id = shared_subtrees['ids'].get( key )
+    if subtree_id is None:
+       subtree_id = 'f' + str( len( shared_subtrees['ids'] ) )
+       shared_subtrees['ids'][key] = subtree_id
+       emit( '<defs><g id="' + subtree_id + '">' )
+       shared_subtrees['depth'] += 1
+       rotation_stack.append( 0.0 )
+       before = dict( [(kind, len( preview_shapes[kind] )) for kind in preview_kinds] )
+       record_start = len( recorded_shapes['items'] )
+       output_slices( gen, 0.0, start_colour, colour_skip, fam, degrees_per_slice, 0, ring_data, diagram_data )
+       # the preview shapes are kept to be turned for each copy
+       shapes = dict()
+       for kind in preview_kinds:
+           shapes[kind] = preview_shapes[kind][before[kind]:]
+           del preview_shapes[kind][before[kind]:]
+       shared_subtrees['shapes'][key] = shapes
+       shared_subtrees['records'][key] = recorded_shapes['items'][record_start:]
+       del recorded_shapes['items'][record_start:]
+       rotation_stack.pop()
+       shared_subtrees['depth'] -= 1
+       emit( '</g></defs>' )
+
+    preview_copy( shared_subtrees['shapes'][key], start_rotation )
+    if recorded_shapes['recording']:
+       record_copy( shared_subtrees['records'][key], start_rotation )
+
+    transform = rotate_transform( start_rotation )
+    if flat:
+       # the shared copy is in page coordinates
+       transform = 'rotate(' + roundstr( start_rotation ) + ',' + roundstr( cx ) + ',' + roundstr( cy ) + ')'
+    emit( '<use xlink:href="#' + subtree_id + '" transform="' + transform + '"/>' )
+
+
+def output_branch( gen, start_rotation, start_colour, colour_skip, fam, degrees_per_slice, ring_data, diagram_data ):
+    # A family's branch, copied from the fragment cache if the same branch
+    # has been drawn before in any chart. Like a shared family it is drawn
+    # from rotation zero, then turned into place.
+
+    # the generation is counted from one at the center
+    if not ( fragment_cache['folder'] and gen + 1 == options['fragment-generation'] and drawing['groups'] ):
+       output_slices( gen, start_rotation, start_colour, colour_skip, fam, degrees_per_slice, 0, ring_data, diagram_data )
+       return
+
+    key = branch_key( fam, gen, start_colour, colour_skip, degrees_per_slice, ring_data )
+    fragment = load_fragment( key )
+    if fragment is None:
+       fragment = make_fragment( key, gen, start_colour, colour_skip, fam, degrees_per_slice, ring_data, diagram_data )
+    else:
+       fragment_cache['reused'] += 1
+
+    # text path ids are made from the key, so a second copy in the same chart needs its own
+    text = fragment['text']
+    fragment_cache['uses'][key] += 1
+    if fragment_cache['uses'][key] > 1:
+       text = text.replace( fragment_id_prefix( key ), fragment_id_prefix( key )[:-1] + 'u' + str( fragment_cache['uses'][key] ) + '_' )
+
+    emit( '<g transform="' + rotate_transform( start_rotation ) + '">' )
+    sink.write( text )
+    emit( '</g>' )
+    preview_copy( fragment['shapes'], start_rotation )
+    if recorded_shapes['recording']:
+       record_copy( fragment['records'], start_rotation )
+    countables.update( fragment['counts'] )
+
+
+def person_label( indi ):
+    if indi is None:
+       return None
+    row = label_data['row'][indi]
+    return [label_data['name'][row], label_data['years'][row]]
+
+
+def branch_contents( fam, gen ):
+    # A digest of the people in a family and all its descendants: who they
+    # are, their names and years, and their slices. Each family's digest
+    # includes those of the families below it, so it is worked out once.
+    key = (fam, gen)
+    if key not in fragment_cache['digests']:
+       parts = [fam, gen]
+       for child in label_data['fams'][fam]['chil']:
+           details = diagram_data[child]
+           parts.append( [child, person_label( child ), details['slices'], details['collapse']] )
+           if details['collapse']:
+              parts.append( [details['descendants'], details['generations']] )
+           for fam_data in details['fams']:
+               spouse = find_spouse( fam_data['fam'], child )
+               parts.append( [fam_data['fam'], fam_data['slices'], spouse, person_label( spouse )] )
+               parts.append( branch_contents( fam_data['fam'], gen+1 ) )
+       fragment_cache['digests'][key] = hashlib.sha1( repr( parts ).encode() ).hexdigest()
+    return fragment_cache['digests'][key]
+
+
+def branch_key( fam, gen, start_colour, colour_skip, degrees_per_slice, ring_data ):
+    # everything the drawing of a branch depends on, hashed for the file name
+    details = [get_version(), gen, start_colour, colour_skip, degrees_per_slice]
+    details.append( [ring['outer'] for ring in ring_data] )
+    details += [view['first'], view['last'], compact, precision, debug]
+    details += [options['colour'], options['colour-classes'], options['min-font'], options['small-name-mark']]
+    # and the shapes which are kept for the other outputs
+    details += [bool( options['preview'] ), options['preview-size'], bool( options['canvas'] )]
+    details += [bool( options['hit-index'] or options['layout-cache'] ), recorded_shapes['recording']]
+    details.append( branch_contents( fam, gen ) )
+    return hashlib.sha1( repr( details ).encode() ).hexdigest()[:20]
+
+
+def fragment_id_prefix( key ):
+    # part of the key is enough to keep the ids of different branches apart
+    return 'k' + key[:12] + '_'
+
+
+def fragment_file( key ):
+    return os.path.join( fragment_cache['folder'], key + '.frag' )
+
+
+def load_fragment( key ):
+    # a kept branch is touched when it is used, to find the least recently used
+    file_name = fragment_file( key )
+    fragment = load_cache_file( file_name )
+    if fragment is not None:
+       try:
+          os.utime( file_name )
+       except OSError:
+          pass
+    return fragment
+
+
+def make_fragment( key, gen, start_colour, colour_skip, fam, degrees_per_slice, ring_data, diagram_data ):
+    # Draw the branch on its own from rotation zero, with its text path ids
+    # made from the key so they don't depend on the rest of the chart. The
+    # shapes kept for the other outputs and the counts are kept with it.
+
+    global sink
+
+    saved = [sink, dict( text_ids ), dict( arc_ids )]
+    before = dict( [(kind, len( preview_shapes[kind] )) for kind in preview_kinds] )
+    record_start = len( recorded_shapes['items'] )
+    counts = dict( [(name, countables[name]) for name in ['names', 'small names', 'collapsed']] )
+
+    sink = OutputSink( io.StringIO() )
+    text_ids['prefix'] = fragment_id_prefix( key )
+    text_ids['base'] = countables['names']
+    arc_ids.clear()
+    rotation_stack.append( 0.0 )
+    output_slices( gen, 0.0, start_colour, colour_skip, fam, degrees_per_slice, 0, ring_data, diagram_data )
+    rotation_stack.pop()
+    sink.flush()
+
+    fragment = {'text':sink.outf.getvalue(), 'shapes':dict(), 'counts':dict()}
+    sink = saved[0]
+    text_ids.update( saved[1] )
+    arc_ids.clear()
+    arc_ids.update( saved[2] )
+
+    for kind in preview_kinds:
+        fragment['shapes'][kind] = preview_shapes[kind][before[kind]:]
+        del preview_shapes[kind][before[kind]:]
+    fragment['records'] = recorded_shapes['items'][record_start:]
+    del recorded_shapes['items'][record_start:]
+    # the counts are put back as the fragment is placed
+    for name in counts:
+        fragment['counts'][name] = countables[name] - counts[name]
+        countables[name] = counts[name]
+
+    save_cache_file( fragment_file( key ), fragment )
+    fragment_cache['drawn'] += 1
+    return fragment
+
+
+def trim_fragment_cache():
+    # Remove the least recently used branches while the cache is too large.
+    # Another run with the same folder might be removing them too, so a file
+    # already gone is taken as removed.
+    folder = fragment_cache['folder']
+    try:
+       names = os.listdir( folder )
+    except FileNotFoundError:
+       return
+    files = []
+    total = 0
+    for name in names:
+        if name.endswith( '.frag' ):
+           try:
+              file_stat = os.stat( os.path.join( folder, name ) )
+           except FileNotFoundError:
+              continue
+           files.append( [file_stat.st_mtime_ns, file_stat.st_size, name] )
+           total += file_stat.st_size
+    limit = options['fragment-cache-size'] * 1024 * 1024
+    for _, size, name in sorted( files ):
+        if total <= limit:
+           break
+        try:
+           os.remove( os.path.join( folder, name ) )
+        except FileNotFoundError:
+           pass
+        total -= size
+
+
+def count_shared_subtrees( start_fam, degrees_per_slice, slice_extra, ring_data, diagram_data ):
+    # go over the tree without output to find the families which are repeated
+    shared_subtrees['counts'] = Counter()
+    shared_subtrees['ids'] = dict()
+    shared_subtrees['shapes'] = dict()
+    shared_subtrees['records'] = dict()
+    if not options['share-subtrees']:
+       return
+    saved = dict( drawing )
+    drawing.update( {'groups':False, 'slices':False, 'names':False} )
+    shared_subtrees['counting'] = True
+    output_slices( 1, -90.0, 0, 1, start_fam, degrees_per_slice, slice_extra, ring_data, diagram_data )
+    shared_subtrees['counting'] = False
+    drawing.update( saved )
+
+
 def output_start_names( fam, ring_outer ):
     # in testing mode there is only one family at the top,
     # wrap around almost half circle
@@ -793,16 +4064,152 @@ def output_start_names( fam, ring_outer ):
     prefix = ''
     for partner in ['husb','wife']:
         coords = compute_slice( d, inner, outer )
-        indi = None
-        if partner in data[fkey][fam]:
-           indi = data[fkey][fam][partner][0]
-        print( '<g transform="rotate(' + str(rotate) + ',0,0)">' )
-        output_name( coords, False, prefix, indi )
-        print( '</g>' )
+        indi = label_data['fams'][fam][partner]
+        if view['first'] == 0 and angles_in_view( rotate, d ):
+           begin_rotation( rotate )
+           output_name( coords, False, prefix, indi )
+           if options['hit-index'] or options['layout-cache']:
+              hit_record( 0, 'person', coords, indi, fam )
+           end_rotation()
         prefix = '+ '
         rotate = 180
 
 
+def make_chart( start_person ):
+    # output the whole chart for this person
+    # return False if the person doesn't have enough generations for a chart
+
+    global diagram_data
+
+    # each chart has its own text path ids
+    countables['names'] = 0
+    countables['small names'] = 0
+    countables['collapsed'] = 0
+    arc_ids.clear()
+    for kind in preview_kinds:
+        preview_shapes[kind] = []
+    tile_parts.clear()
+    html_fragments.clear()
+    recorded_shapes['items'] = []
+    recorded_shapes['copies'] = 0
+    fragment_cache['uses'] = Counter()
+    fragment_cache['digests'] = dict()
+    fragment_cache['reused'] = 0
+    fragment_cache['drawn'] = 0
+    merged_paths['slices'] = dict()
+    merged_paths['separators'] = []
+
+    # find the actual maximum number of generations
+    # in case a too large number was given in the options
+
+    max_generations = find_max_generations( start_person, options['generations'], 1 )
+
+    if max_generations <= 1:
+       return False
+
+    if debug:
+       print( 'max gen', max_generations, file=sys.stderr )
+
+    # slice size is computed by
+    # 360 degrees divided by the number of people reaching the outermost layer
+    #
+    # to get that number of people we have to pretend that every family has children
+    # out to the max generation
+
+    max_slices = compute_max_gen_children( start_person, max_generations, 1 )
+
+    if debug:
+       print( 'slices', max_slices, file=sys.stderr )
+
+    # truncate to a few decimal points because the output can't be infinitely exact
+    slice_decimals = 1
+
+    degrees_per_slice = round( 360.0 / max_slices, slice_decimals )
+
+    # and the floating point division might not be exact,
+    # so the (tiny) remainder should be added to the first slice in each generation
+
+    slice_remainder = round( 360.0 - degrees_per_slice * max_slices, slice_decimals )
+
+    diagram_data = {}
+
+    count_slices( start_person, max_generations, 1 )
+
+    extract_labels( diagram_data )
+
+    output_header()
+
+    ring_sizes = calculate_generation_rings( max_generations )
+    chart_rings[:] = ring_sizes
+
+    # generation 0 is special - it is in the inner circle
+    # there must be another generation or else the program would have exited
+    # special case when start person has multiple families - handle in future
+
+    # the first child starts at the top, so rotate it -90 deg from the x-axis
+    # need to do something with colours too, first child should match parents
+
+    # translate everything to the center of the page
+    g_trans = 'translate(' + roundstr(cx) + ',' + roundstr(cy) + ')'
+    if flat:
+       # the center offset is added to every coordinate instead
+       page_offset[0] = cx
+       page_offset[1] = cy
+       if compact:
+          emit( '<g ' + font_selection + '>' )
+       elif not pdf:
+          emit( '<g>' )
+    elif compact:
+       # the font is given once for all the text
+       emit( '<g transform="' + g_trans + '" ' + font_selection + '>' )
+    else:
+       emit( '<g transform="' + g_trans + '">' )
+
+    # testing is using only one start family
+    start_fam = diagram_data[start_person]['fams'][0]['fam']
+
+    if options['max-elements']:
+       # the start family's names are taken off first
+       allocate_element_budget( label_data['fams'][start_fam]['chil'], options['max-elements'] - 2 )
+
+    if debug:
+       print( 'gen', 0, file=sys.stderr )
+       emit_comment( 'gen 0' )
+
+    count_shared_subtrees( start_fam, degrees_per_slice, slice_remainder, ring_sizes, diagram_data )
+
+    if options['merge-paths']:
+       # The slices have to be under the names, so go over the tree
+       # once for just the slices, then again for the names.
+       # Going over the tree without the names is quick.
+       drawing.update( {'groups':False, 'names':False} )
+       output_slices( 1, -90.0, 0, 1, start_fam, degrees_per_slice, slice_remainder, ring_sizes, diagram_data )
+       output_merged_slices()
+       drawing.update( {'groups':True, 'names':True, 'slices':False} )
+
+    begin_tile_part()
+    output_start_names( start_fam, ring_sizes[0]['outer'] )
+    end_tile_part( 0.0, 180.0, 0.0, ring_sizes[0]['outer'] )
+
+    output_slices( 1, -90.0, 0, 1, start_fam, degrees_per_slice, slice_remainder, ring_sizes, diagram_data )
+
+    drawing['slices'] = True
+    output_merged_separators()
+
+    # show the rings on top of the slices
+    outline_generations( ring_sizes )
+
+    if not pdf:
+       emit( '</g>' )
+
+    output_trailer()
+
+    if fragment_cache['folder']:
+       trim_fragment_cache()
+
+    return True
+
+
 # more globals
 # page is square, get the center
 cx = page_size / 2.0
@@ -811,6 +4218,53 @@ cy = cx
 # see functin "output_name" for a description
 countables = Counter( names = 0 )
 
+# total rotation of each nested graphic context
+rotation_stack = [0.0]
+
+# which parts of the chart are output during a pass over the tree
+drawing = {'groups':True, 'slices':True, 'names':True}
+
+# parts of the chart which are saved and drawn together, with --merge-paths
+merged_paths = {'slices':{}, 'separators':[]}
+
+# families output once and referenced for each copy, with --share-subtrees
+shared_subtrees = {'counts':Counter(), 'ids':dict(), 'shapes':dict(), 'records':dict(), 'counting':False, 'depth':0}
+
+# parts of the chart saved for the preview image, with --preview,
+# the slices, names and lines for --canvas, and who is where for --hit-index
+preview_kinds = ['slices', 'names', 'partners', 'lines', 'labels', 'separators', 'hits']
+preview_shapes = dict( [(kind, []) for kind in preview_kinds] )
+
+# the shapes of the chart as it is drawn, for drawing again to other formats
+recorded_shapes = {'recording':False, 'items':[], 'copies':0}
+
+# branches kept on disk for any chart, and the ones used in the current chart
+fragment_cache = {'folder':None, 'uses':Counter(), 'digests':dict(), 'reused':0, 'drawn':0}
+
+# text path ids are numbered from the base, after the prefix
+text_ids = {'prefix':'', 'base':0}
+
+# loaded only if needed
+numpy = None
+
+# the generation rings of the current chart
+chart_rings = []
+
+# part of the chart to output, as first and last ring and range of angles,
+# set by options, the layout is the same as for the whole chart
+view = {'first':0, 'last':sys.maxsize, 'angles':None}
+
+# parts of the chart and where they are, with --tiles
+tile_parts = []
+tile_sinks = []
+tile_index = None
+
+# text paths already output, in compact mode, and their ids
+arc_ids = dict()
+
+# id lookup tables, one for each id item
+id_indexes = dict()
+
 char_width_factors = setup_char_widths()
 # this is used to find font for widths
 widest_char = ' '
@@ -821,6 +4275,24 @@ for c in char_width_factors:
 options = get_program_options()
 
 debug = options['debug']
+slice_colours = colour_schemes[options['colour']]
+compact = options['compact']
+flat = options['flat']
+precision = options['precision']
+pdf = wants_pdf( options['output'] )
+html_output = wants_html( options['output'] )
+
+if pdf:
+   # pdf drawing is in page coordinates, the svg only choices don't apply
+   for name in ['compact', 'merge-paths', 'share-subtrees', 'colour-classes']:
+       if options[name]:
+          print( 'PDF output can not be used with --' + name, file=sys.stderr )
+          sys.exit(1)
+   flat = True
+   if options['font-file'] and not os.path.isfile( options['font-file'] ):
+      print( 'Font file not found:', options['font-file'], file=sys.stderr )
+      sys.exit(1)
+   warn_if_no_font()
 
 if debug:
    print( 'version', get_version(), file=sys.stderr )
@@ -829,100 +4301,298 @@ if options['generations'] < 1:
    print( 'Generations must be more than zero', file=sys.stderr )
    sys.exit(1)
 
-readgedcom = load_my_module( 'readgedcom', options['libpath'] )
+if options['recolour']:
+   recolour_chart( options['infile'] )
+   sys.exit(0)
 
-# these are keys into the parsed sections of the returned data structure
-ikey = readgedcom.PARSED_INDI
-fkey = readgedcom.PARSED_FAM
-
-data_opts = {}
-data_opts['display-gedcom-warnings'] = True
-data_opts['exit-on-no-families'] = True
-data_opts['exit-on-missing-individuals'] = True
-data_opts['exit-on-missing-families'] = True
-data_opts['only-birth'] = True
-
-data = readgedcom.read_file( options['infile'], data_opts )
+if precision < 0:
+   print( 'Precision can not be negative', file=sys.stderr )
+   sys.exit(1)
 
-id_match = readgedcom.find_individuals( data, options['id-item'], options['personid'] )
-if len(id_match) == 1:
+if not options['personid'] and not options['find'] and not options['roots']:
+   print( 'At least one person id is needed', file=sys.stderr )
+   sys.exit(1)
 
-   start_person = id_match[0]
+if len( options['personid'] ) > 1 and not options['output-dir'] and not options['chart-size']:
+   print( 'More than one id requires an output directory', file=sys.stderr )
+   sys.exit(1)
 
-   # find the actual maximum number of generations
-   # in case a too large number was given in the options
+if len( options['personid'] ) > 1 and options['output']:
+   print( 'More than one id goes to an output directory rather than an output file', file=sys.stderr )
+   sys.exit(1)
 
-   max_generations = find_max_generations( start_person, options['generations'], 1 )
+if options['tiles']:
+   if pdf:
+      print( 'Tiles are made only as SVG', file=sys.stderr )
+      sys.exit(1)
+   if len( options['personid'] ) == 1 and not options['output']:
+      print( 'Tiles need an output file name to name them from', file=sys.stderr )
+      sys.exit(1)
+   # each part of the chart has to stand alone in page coordinates
+   for name in ['compact', 'merge-paths', 'share-subtrees']:
+       if options[name]:
+          print( 'Tiles can not be made with --' + name, file=sys.stderr )
+          sys.exit(1)
+   flat = True
+
+if html_output:
+   if pdf or options['tiles']:
+      print( 'HTML output can not be with pdf or tiles', file=sys.stderr )
+      sys.exit(1)
+   if len( options['personid'] ) == 1 and not options['output']:
+      print( 'HTML output needs an output file name for its fragment folder', file=sys.stderr )
+      sys.exit(1)
+   if options['inline-generations'] < 1:
+      print( 'Inline generations must be more than zero', file=sys.stderr )
+      sys.exit(1)
+   # each fragment has to stand alone in page coordinates, and be read by the page
+   for name in ['compress', 'compact', 'merge-paths', 'share-subtrees']:
+       if options[name]:
+          print( 'HTML output can not be made with --' + name, file=sys.stderr )
+          sys.exit(1)
+   flat = True
+
+if options['angle-range'] or options['generation-range']:
+   if options['generation-range']:
+      # the rings are counted from zero at the center
+      view['first'] = options['generation-range'][0] - 1
+      view['last'] = options['generation-range'][1] - 1
+   if options['angle-range']:
+      # from the top clockwise, to the drawing angles which start on the right
+      low = options['angle-range'][0] % 360.0
+      span = ( options['angle-range'][1] - options['angle-range'][0] ) % 360.0
+      if span == 0.0:
+         span = 360.0
+      view['angles'] = [low - 90.0, low - 90.0 + span]
+   if options['share-subtrees']:
+      # shared families are placed whole, so each one would need its own viewport
+      print( 'Shared subtrees can not be used with an angle or generation range', file=sys.stderr )
+      sys.exit(1)
 
-   if max_generations > 1:
-      if debug:
-         print( 'max gen', max_generations, file=sys.stderr )
+if options['also']:
+   if options['tiles'] or html_output:
+      print( 'Other formats can not be made with tiles or HTML output', file=sys.stderr )
+      sys.exit(1)
+   formats = [replay_format( name ) for name in options['also']]
+   if None in formats:
+      print( 'Other formats should end in .svg, .svgz, .pdf, .png or .json', file=sys.stderr )
+      sys.exit(1)
+   if 'png' in formats:
+      numpy_module()
+   if 'pdf' in formats and options['font-file'] and not os.path.isfile( options['font-file'] ):
+      print( 'Font file not found:', options['font-file'], file=sys.stderr )
+      sys.exit(1)
+   if 'pdf' in formats and not pdf:
+      warn_if_no_font()
+   # the shapes are recorded as the chart is drawn
+   recorded_shapes['recording'] = True
+
+if options['layout-cache']:
+   if options['tiles'] or html_output:
+      print( 'A saved layout can not be used with tiles or HTML output', file=sys.stderr )
+      sys.exit(1)
+   if not flat or options['merge-paths'] or options['share-subtrees']:
+      # the saved shapes are drawn one by one in page coordinates,
+      # the chart has to be drawn the same way when it is first laid out
+      print( 'A saved layout needs flat output, --flat or pdf, without merged paths or shared subtrees', file=sys.stderr )
+      sys.exit(1)
+   recorded_shapes['recording'] = True
 
-      # slice size is computed by
-      # 360 degrees divided by the number of people reaching the outermost layer
-      #
-      # to get that number of people we have to pretend that every family has children
-      # out to the max generation
+if options['fragment-cache']:
+   if options['fragment-generation'] < 3:
+      # the first two generations are the start family and their children
+      print( 'Fragment generation must be at least 3', file=sys.stderr )
+      sys.exit(1)
+   if options['share-subtrees']:
+      # a kept branch is drawn in full wherever it is, it can't refer to a shared one
+      print( 'The fragment cache takes the place of shared subtrees, give only one of them', file=sys.stderr )
+      sys.exit(1)
+   if flat or pdf or options['merge-paths'] or view['angles'] is not None:
+      # the branches are kept in their own rotated groups, without references to the rest of the chart
+      print( 'The fragment cache needs svg output in rotated groups, not flat, pdf, tiles, HTML, merged paths or an angle range', file=sys.stderr )
+      sys.exit(1)
+   fragment_cache['folder'] = os.path.join( get_cache_dir(), 'fragments' )
 
-      max_slices = compute_max_gen_children( start_person, max_generations, 1 )
+if options['max-elements'] is not None and options['max-elements'] < 1:
+   print( 'Max elements must be more than zero', file=sys.stderr )
+   sys.exit(1)
 
-      if debug:
-         print( 'slices', max_slices, file=sys.stderr )
+if options['preview']:
+   if options['preview-size'] < 1:
+      print( 'Preview size must be more than zero', file=sys.stderr )
+      sys.exit(1)
+   # find out now if it can't be done
+   numpy_module()
 
-      # truncate to a few decimal points because the output can't be infinitely exact
-      slice_decimals = 1
+if options['infile'] != '-' and not os.path.isfile( options['infile'] ):
+   print( 'Input file not found:', options['infile'], file=sys.stderr )
+   sys.exit(1)
 
-      degrees_per_slice = round( 360.0 / max_slices, slice_decimals )
+readgedcom = load_my_module( 'readgedcom', options['libpath'] )
 
-      # and the floating point division might not be exact,
-      # so the (tiny) remainder should be added to the first slice in each generation
+# these are keys into the parsed sections of the returned data structure
+ikey = readgedcom.PARSED_INDI
+fkey = readgedcom.PARSED_FAM
 
-      slice_remainder = round( 360.0 - degrees_per_slice * max_slices, slice_decimals )
+data_opts = {}
+data_opts['display-gedcom-warnings'] = True
+data_opts['exit-on-no-families'] = True
+data_opts['exit-on-missing-individuals'] = True
+data_opts['exit-on-missing-families'] = True
+data_opts['only-birth'] = True
 
-      diagram_data = {}
+if options['find']:
+   if find_names( options['find'] ) == 0:
+      print( 'No names match', file=sys.stderr )
+      sys.exit(1)
+   sys.exit(0)
 
-      count_slices( start_person, max_generations, 1 )
+if options['chart-size']:
+   if show_chart_sizes( options['personid'], options['generations'] ) > 0:
+      sys.exit(1)
+   sys.exit(0)
 
-      output_header()
+saved_layouts = dict()
+if options['layout-cache']:
+   for personid in options['personid']:
+       saved = load_cache_file( layout_cache_file( personid ) )
+       if saved is not None:
+          saved_layouts[personid] = saved
 
-      ring_sizes = calculate_generation_rings( max_generations )
+if options['roots'] or len( saved_layouts ) < len( options['personid'] ):
+   data = read_input( options['infile'], data_opts )
 
-      # generation 0 is special - it is in the inner circle
-      # there must be another generation or else the program would have exited
-      # special case when start person has multiple families - handle in future
+   if options['roots']:
+      if list_roots( options['generations'] ) == 0:
+         print( 'Everyone has parents', file=sys.stderr )
+         sys.exit(1)
+      sys.exit(0)
 
-      # the first child starts at the top, so rotate it -90 deg from the x-axis
-      # need to do something with colours too, first child should match parents
+   people = find_people( options['id-item'], options['personid'] )
 
-      # translate everything to the center of the page
-      g_trans = 'translate(' + roundstr(cx) + ',' + roundstr(cy) + ')'
-      print( '<g transform="' + g_trans + '">' )
+else:
+   # every chart is laid out already, the input isn't needed
+   people = {'found':dict( [(personid, None) for personid in options['personid']] ), 'ambiguous':{}, 'missing':[]}
 
-      # testing is using only one start family
-      start_fam = diagram_data[start_person]['fams'][0]['fam']
+if len( options['personid'] ) == 1:
+   # a single chart goes to std-out, keep the original messages
 
-      if debug:
-         print( 'gen', 0, file=sys.stderr )
-         print( '<!-- gen 0 -->' )
+   personid = options['personid'][0]
+   if personid in people['ambiguous']:
+      print( 'More than one person matches the given id', file=sys.stderr )
+      sys.exit(1)
+   if personid in people['missing']:
+      print( 'No person matches the given id', file=sys.stderr )
+      sys.exit(1)
 
-      output_start_names( start_fam, ring_sizes[0]['outer'] )
+   if options['tiles'] or html_output:
+      # the parts are kept for the tiles, the html page has the chart inside
+      sink = OutputSink( io.StringIO() )
+   else:
+      sink = open_output_sink( options['output'] )
+   if html_output:
+      html_folder = html_parts_folder( options['output'] )
+      clear_html_folder( html_folder )
+   start_time = time.time()
+   made = draw_chart( personid, people['found'][personid] )
+   if html_output and made:
+      sink.flush()
+      output_html( options['output'], sink.outf.getvalue() )
+   sink.close()
+
+   if options['stats']:
+      report_output( time.time() - start_time )
+
+   if not made:
+      if options['output'] and not options['tiles'] and not html_output:
+         os.remove( options['output'] )
+      print( 'Selected person has no children.', file=sys.stderr )
+      sys.exit(1)
 
-      output_slices( 1, -90.0, 0, 1, start_fam, degrees_per_slice, slice_remainder, ring_sizes, diagram_data )
+   if options['tiles']:
+      start_time = time.time()
+      output_tiles( options['output'], chart_rings )
+      if options['stats']:
+         print( 'tiles time:', roundstr( time.time() - start_time ), 'sec', file=sys.stderr )
 
-      # show the rings on top of the slices
-      outline_generations( ring_sizes )
+   if options['preview']:
+      start_time = time.time()
+      output_preview( options['preview'] )
+      if options['stats']:
+         print( 'preview time:', roundstr( time.time() - start_time ), 'sec', file=sys.stderr )
 
-      print( '</g>' )
+   if options['canvas']:
+      output_canvas( options['canvas'] )
 
-      output_trailer()
+   if options['hit-index']:
+      output_hit_index( options['hit-index'] )
 
-   else:
-      print( 'Selected person has no children.', file=sys.stderr )
-      sys.exit(1)
+   if options['also']:
+      start_time = time.time()
+      for name in options['also']:
+          output_replay( name )
+      if options['stats']:
+         print( 'other formats time:', roundstr( time.time() - start_time ), 'sec', file=sys.stderr )
 
 else:
-   if len(id_match) > 1:
-      print( 'More than one person matches the given id', file=sys.stderr )
-   else:
-      print( 'No person matches the given id', file=sys.stderr )
-   sys.exit(1)
+   # many charts, each to its own file, and problems reported all together
+
+   exit_code = 0
+
+   if people['ambiguous']:
+      exit_code = 1
+      print( 'More than one person matches these ids:', file=sys.stderr )
+      for personid in people['ambiguous']:
+          print( ' ', personid, people['ambiguous'][personid], file=sys.stderr )
+
+   if people['missing']:
+      exit_code = 1
+      print( 'No person matches these ids:', file=sys.stderr )
+      for personid in people['missing']:
+          print( ' ', personid, file=sys.stderr )
+
+   no_children = []
+   for personid in people['found']:
+       out_name = os.path.join( options['output-dir'], safe_file_name( personid ) + '.svg' )
+       if pdf:
+          out_name = out_name[:-3] + 'pdf'
+       elif html_output:
+          out_name = out_name[:-3] + 'html'
+       elif options['compress']:
+          out_name += 'z'
+       if options['tiles'] or html_output:
+          sink = OutputSink( io.StringIO() )
+       else:
+          sink = open_output_sink( out_name )
+       if html_output:
+          html_folder = html_parts_folder( out_name )
+          clear_html_folder( html_folder )
+       made = draw_chart( personid, people['found'][personid] )
+       if html_output and made:
+          sink.flush()
+          output_html( out_name, sink.outf.getvalue() )
+       sink.close()
+       if not made:
+          if not options['tiles'] and not html_output:
+             os.remove( out_name )
+          no_children.append( personid )
+       elif options['tiles']:
+          output_tiles( out_name, chart_rings )
+       else:
+          # beside the chart, the given names aren't used
+          if options['preview']:
+             output_preview( os.path.join( options['output-dir'], safe_file_name( personid ) + '.png' ) )
+          if options['canvas']:
+             output_canvas( os.path.join( options['output-dir'], safe_file_name( personid ) + '-canvas.html' ) )
+          if options['hit-index']:
+             output_hit_index( os.path.join( options['output-dir'], safe_file_name( personid ) + '-hits.json' ) )
+          for name in options['also']:
+              output_replay( os.path.join( options['output-dir'], safe_file_name( personid ) + '-' + os.path.basename( name ) ) )
+
+   if no_children:
+      exit_code = 1
+      print( 'Selected person has no children for these ids:', file=sys.stderr )
+      for personid in no_children:
+          print( ' ', personid, file=sys.stderr )
+
+   sys.exit( exit_code )
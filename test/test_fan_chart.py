@@ -0,0 +1,1011 @@
+#!/usr/local/bin/python3
+
+"""
+Tests of fan-chart.py using the gedcom files in this directory.
+
+Run from the top of the repository with
+   python -m pytest test
+or
+   python -m unittest discover test
+
+The readgedcom library is found as the program finds it, by a path relative
+to the program given in the environment variable READGEDCOM_LIBPATH, default ".".
+The tests which need it are skipped if it isn't there.
+"""
+
+import sys
+import os
+import gzip
+import bz2
+import lzma
+import ast
+import json
+import re
+import struct
+import zlib
+import collections
+import xml.etree.ElementTree as ElementTree
+import random
+import shutil
+import tempfile
+import subprocess
+import importlib.util
+import math
+import html
+import bisect
+import unittest
+
+test_dir = os.path.dirname( os.path.realpath( __file__ ) )
+program = os.path.join( test_dir, '..', 'fan-chart.py' )
+libpath = os.environ.get( 'READGEDCOM_LIBPATH', '.' )
+library_file = os.path.join( os.path.dirname( os.path.realpath( program ) ), libpath, 'readgedcom.py' )
+has_library = os.path.isfile( library_file )
+
+test_files = [os.path.join( test_dir, 'test-' + str( i ) + '.ged' ) for i in range( 1, 8 )]
+
+# people with each kind of id
+ids_file = os.path.join( test_dir, 'test-ids.ged' )
+
+# the commit the plain charts are compared against
+baseline_commit = 'bf74cd6'
+
+# saved indexes go here rather than into the user's own cache
+cache_home = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree( cache_home, ignore_errors=True )
+
+
+def run_chart( args, stdin=None, library_path=libpath ):
+    # the program with the library path, output and errors are kept
+    command = [sys.executable, program, '--libpath', library_path] + args
+    env = dict( os.environ, XDG_CACHE_HOME=cache_home )
+    return subprocess.run( command, input=stdin, capture_output=True, env=env )
+
+
+def without_version( output ):
+    # the line naming the program version is expected to differ
+    return [line for line in output.splitlines() if not line.startswith( b'<!-- generated by fan-chart.py' )]
+
+
+def load_library():
+    spec = importlib.util.spec_from_file_location( 'readgedcom', library_file )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    return module
+
+
+def find_ttf():
+    # any plain TrueType font, to embed in a pdf
+    for top in ['/usr/share/fonts', '/Library/Fonts', 'C:/Windows/Fonts']:
+        for folder, _, names in os.walk( top ):
+            for name in sorted( names ):
+                if name.lower().endswith( '.ttf' ):
+                   return os.path.join( folder, name )
+    return None
+
+
+def svg_elements( text ):
+    # how many of each drawn element, whatever group it is in
+    results = collections.Counter()
+    for element in ElementTree.fromstring( text ).iter():
+        tag = element.tag.split( '}' )[-1]
+        if tag not in ['svg', 'g']:
+           results[(tag, tuple( sorted( element.attrib.items() ) ), ( element.text or '' ).strip())] += 1
+    return results
+
+
+def program_functions( names, values ):
+    # Some functions of the program by themselves, since the program runs
+    # when it is loaded. The values are the globals they use.
+    with open( program, encoding='utf-8' ) as inf:
+       tree = ast.parse( inf.read() )
+    wanted = [node for node in tree.body if isinstance( node, ast.FunctionDef ) and node.name in names]
+    namespace = dict( values )
+    exec( 'import sys, os, math, bisect, re', namespace )
+    exec( compile( ast.Module( body=wanted, type_ignores=[] ), program, 'exec' ), namespace )
+    return namespace
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestInput( unittest.TestCase ):
+    # compressed and stdin input give the same chart as the plain file
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+        self.plain = test_files[6]
+        with open( self.plain, 'rb' ) as inf:
+           self.content = inf.read()
+        self.expected = run_chart( [self.plain, 'I1'] ).stdout
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def check_file( self, name, content ):
+        file_name = os.path.join( self.work_dir, name )
+        with open( file_name, 'wb' ) as outf:
+           outf.write( content )
+        result = run_chart( [file_name, 'I1'] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        self.assertEqual( result.stdout, self.expected )
+
+    def test_gzip( self ):
+        self.check_file( 'test.ged.gz', gzip.compress( self.content ) )
+
+    def test_bzip2( self ):
+        self.check_file( 'test.ged.bz2', bz2.compress( self.content ) )
+
+    def test_xz( self ):
+        self.check_file( 'test.ged.xz', lzma.compress( self.content ) )
+
+    def test_compression_found_from_contents( self ):
+        self.check_file( 'test.ged', gzip.compress( self.content ) )
+
+    def test_stdin( self ):
+        result = run_chart( ['-', 'I1'], stdin=self.content )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        self.assertEqual( result.stdout, self.expected )
+
+    def test_compressed_stdin( self ):
+        result = run_chart( ['-', 'I1'], stdin=gzip.compress( self.content ) )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        self.assertEqual( result.stdout, self.expected )
+
+    def test_library_reading_twice( self ):
+        # a library which reads the file before parsing it can't be given a pipe
+        with open( os.path.join( self.work_dir, 'readgedcom.py' ), 'w' ) as outf:
+           outf.write( 'import importlib.util\n' )
+           outf.write( 'spec = importlib.util.spec_from_file_location( "real", ' + repr( library_file ) + ' )\n' )
+           outf.write( 'real = importlib.util.module_from_spec( spec )\n' )
+           outf.write( 'spec.loader.exec_module( real )\n' )
+           outf.write( 'def __getattr__( name ):\n' )
+           outf.write( '    return getattr( real, name )\n' )
+           outf.write( 'def read_file( name, settings=None ):\n' )
+           outf.write( '    with open( name, "rb" ) as inf:\n' )
+           outf.write( '       inf.read()\n' )
+           outf.write( '    return real.read_file( name, settings )\n' )
+        program_dir = os.path.dirname( os.path.realpath( program ) )
+        result = run_chart( ['-', 'I1'], stdin=gzip.compress( self.content ), library_path=os.path.relpath( self.work_dir, program_dir ) )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        self.assertEqual( result.stdout, self.expected )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestIdIndex( unittest.TestCase ):
+    # the id index finds the same people as the library's search
+
+    def test_same_as_library( self ):
+        readgedcom = load_library()
+        for file_name in test_files + [ids_file]:
+            data = readgedcom.read_file( file_name, {'display-gedcom-warnings':False} )
+            ikey = readgedcom.PARSED_INDI
+            for id_item in ['xref', 'uuid', 'refn', 'exid', 'type.extid', 'type.other']:
+                functions = program_functions( ['normalize_id', 'get_id_values', 'build_id_index'], {'data':data, 'ikey':ikey, 'id_indexes':{}} )
+                index = functions['build_id_index']( id_item )
+                values = set( index )
+                if id_item == 'xref':
+                   values.update( data[ikey] )
+                for value in values:
+                    with self.subTest( file=os.path.basename( file_name ), id_item=id_item, value=value ):
+                       found = readgedcom.find_individuals( data, id_item, value )
+                       self.assertEqual( sorted( index.get( value, [] ) ), sorted( found ) )
+
+    def test_each_kind_of_id( self ):
+        # the chart of the top person found by each kind of id, or why not
+        for id_item, personid, expected in [['xref', '@I1@', 0], ['xref', 'I1', 0], ['uuid', '0A1B2C3D-0002', 0],
+                                            ['refn', '@R2@', 0], ['refn', 'R2', 1], ['refn', 'R1', 1], ['exid', 'X-1', 0],
+                                            ['type.extid', 'E200', 0], ['type.other', 'other-1', 1], ['uuid', 'missing', 1]]:
+            with self.subTest( id_item=id_item, id=personid ):
+               result = run_chart( ['--id-item', id_item, ids_file, personid] )
+               self.assertEqual( result.returncode, expected, result.stderr )
+               if expected == 0:
+                  self.assertIn( b'Ivan Refn', result.stdout )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestChartSizes( unittest.TestCase ):
+    # the sizes from the precomputed table are those of the recursive counts
+
+    def expected_sizes( self, file_name, max_gen ):
+        readgedcom = load_library()
+        data = readgedcom.read_file( file_name, {'display-gedcom-warnings':False} )
+        values = {'data':data, 'ikey':readgedcom.PARSED_INDI, 'fkey':readgedcom.PARSED_FAM}
+        functions = program_functions( ['find_max_generations', 'compute_max_gen_children'], values )
+        sizes = dict()
+        for indi in data[readgedcom.PARSED_INDI]:
+            n_gen = functions['find_max_generations']( indi, max_gen, 1 )
+            sizes[indi] = [n_gen, functions['compute_max_gen_children']( indi, n_gen, 1 )]
+        return sizes
+
+    def without_parents( self, file_name ):
+        readgedcom = load_library()
+        data = readgedcom.read_file( file_name, {'display-gedcom-warnings':False} )
+        people = data[readgedcom.PARSED_INDI]
+        return sorted( [indi for indi in people if 'famc' not in people[indi]] )
+
+    def test_chart_size( self ):
+        for file_name in test_files:
+            for max_gen in [1, 3, 5, 12]:
+                expected = self.expected_sizes( file_name, max_gen )
+                ids = sorted( expected )
+                result = run_chart( ['--chart-size', '--generations', str( max_gen ), file_name] + ids )
+                self.assertEqual( result.returncode, 0, result.stderr )
+                lines = result.stdout.decode( 'utf-8' ).splitlines()
+                self.assertEqual( len( lines ), len( ids ) + 1 )
+                for line in lines[1:]:
+                    personid, n_gen, slices = line.split( '\t' )
+                    with self.subTest( file=os.path.basename( file_name ), generations=max_gen, id=personid ):
+                       self.assertEqual( [int( n_gen ), int( slices )], expected[personid] )
+
+    def test_roots( self ):
+        for file_name in test_files:
+            for max_gen in [1, 3, 5, 12]:
+                expected = self.expected_sizes( file_name, max_gen )
+                result = run_chart( [file_name, '--roots', '--generations', str( max_gen )] )
+                self.assertEqual( result.returncode, 0, result.stderr )
+                lines = result.stdout.decode( 'utf-8' ).splitlines()
+                # everyone without parents, with or without children
+                self.assertEqual( sorted( [line.split( '\t' )[0] for line in lines[1:]] ), self.without_parents( file_name ) )
+                for line in lines[1:]:
+                    fields = line.split( '\t' )
+                    with self.subTest( file=os.path.basename( file_name ), generations=max_gen, id=fields[0] ):
+                       self.assertEqual( [int( fields[5] ), int( fields[6] )], expected[fields[0]] )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestBaseline( unittest.TestCase ):
+    # without any of the newer options a chart is the one the first version drew
+
+    @classmethod
+    def setUpClass( cls ):
+        try:
+           result = subprocess.run( ['git', 'show', baseline_commit + ':fan-chart.py'], cwd=test_dir, capture_output=True )
+        except OSError:
+           raise unittest.SkipTest( 'git not found' )
+        if result.returncode != 0:
+           raise unittest.SkipTest( 'baseline commit not found' )
+        # beside the program so the library path means the same
+        program_dir = os.path.dirname( os.path.realpath( program ) )
+        with tempfile.NamedTemporaryFile( dir=program_dir, prefix='baseline-', suffix='.py', delete=False ) as outf:
+           outf.write( result.stdout )
+        cls.baseline = outf.name
+
+        # 140 slices of 360/140 degrees rounded up to 2.6 go 4 degrees past
+        # the circle, which the first slice gives back, so its name gets a
+        # negative font size and is still drawn
+        cls.work_dir = tempfile.mkdtemp()
+        cls.wide_file = os.path.join( cls.work_dir, 'wide.ged' )
+        lines = ['0 HEAD', '1 CHAR UTF-8', '0 @I1@ INDI', '1 NAME Adam /Root/', '1 FAMS @F1@', '0 @F1@ FAM', '1 HUSB @I1@']
+        for i in range( 2, 142 ):
+            lines.append( '1 CHIL @I' + str( i ) + '@' )
+        for i in range( 2, 142 ):
+            lines.extend( ['0 @I' + str( i ) + '@ INDI', '1 NAME Kid' + str( i ) + ' /Root/', '1 FAMC @F1@'] )
+        lines.append( '0 TRLR' )
+        with open( cls.wide_file, 'w' ) as outf:
+           outf.write( '\n'.join( lines ) + '\n' )
+
+    @classmethod
+    def tearDownClass( cls ):
+        os.remove( cls.baseline )
+        shutil.rmtree( cls.work_dir )
+
+    def test_plain_charts( self ):
+        for file_name in test_files + [self.wide_file]:
+            for args in [[], ['--dates'], ['--generations', '2'], ['--generations', '12', '--dates']]:
+                for personid in ['I1', 'I3', 'I999']:
+                    command = args + [file_name, personid]
+                    with self.subTest( command=' '.join( command ) ):
+                       expected = subprocess.run( [sys.executable, self.baseline, '--libpath', libpath] + command, capture_output=True )
+                       result = run_chart( command )
+                       self.assertEqual( result.returncode, expected.returncode, result.stderr )
+                       if expected.returncode == 0:
+                          # a failed chart is cut off wherever the output was at the time
+                          self.assertEqual( without_version( result.stdout ), without_version( expected.stdout ) )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestLayoutCache( unittest.TestCase ):
+    # a chart drawn from a saved layout is the one first drawn
+
+    def setUp( self ):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.cache_dir )
+
+    def test_same_as_first_chart( self ):
+        for file_name in [test_files[0], test_files[6]]:
+            for args in [['--flat'], ['--flat', '--compact', '--dates'], ['--flat', '--min-font', '4', '--small-name-mark'], ['--pdf']]:
+                # each in its own folder, the layout is shared by the formats
+                cache_dir = tempfile.mkdtemp( dir=self.cache_dir )
+                command = args + ['--layout-cache', '--cache-dir', cache_dir, '--stats', file_name, 'I1']
+                with self.subTest( command=' '.join( args ), file=os.path.basename( file_name ) ):
+                   expected = run_chart( args + [file_name, 'I1'] )
+                   first = run_chart( command )
+                   again = run_chart( command )
+                   self.assertEqual( again.returncode, 0, again.stderr )
+                   self.assertNotIn( b'drawn from a saved layout', first.stderr )
+                   self.assertIn( b'drawn from a saved layout', again.stderr )
+                   self.assertEqual( first.stdout, expected.stdout )
+                   self.assertEqual( again.stdout, expected.stdout )
+
+    def test_needs_flat_output( self ):
+        for args in [[], ['--flat', '--merge-paths'], ['--flat', '--share-subtrees']]:
+            with self.subTest( command=' '.join( args ) ):
+               result = run_chart( args + ['--layout-cache', '--cache-dir', self.cache_dir, test_files[6], 'I1'] )
+               self.assertEqual( result.returncode, 1 )
+               self.assertEqual( os.listdir( self.cache_dir ), [] )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestFragmentCache( unittest.TestCase ):
+    # kept branches give the same chart, and runs can share the folder
+
+    def setUp( self ):
+        self.cache_dir = tempfile.mkdtemp()
+        self.command = ['--fragment-cache', '--fragment-generation', '3', '--cache-dir', self.cache_dir]
+
+    def tearDown( self ):
+        shutil.rmtree( self.cache_dir )
+
+    def test_same_as_first_chart( self ):
+        first = run_chart( self.command + ['--stats', test_files[6], 'I1'] )
+        again = run_chart( self.command + ['--stats', test_files[6], 'I1'] )
+        self.assertEqual( again.returncode, 0, again.stderr )
+        self.assertIn( b'branches from the fragment cache: 0', first.stderr )
+        self.assertNotIn( b'branches from the fragment cache: 0', again.stderr )
+        self.assertEqual( again.stdout, first.stdout )
+
+    def test_option_conflicts( self ):
+        for args in [['--share-subtrees'], ['--flat'], ['--pdf'], ['--merge-paths']]:
+            with self.subTest( command=' '.join( args ) ):
+               result = run_chart( self.command + args + [test_files[6], 'I1'] )
+               self.assertEqual( result.returncode, 1 )
+               self.assertTrue( result.stderr.startswith( b'The fragment cache' ), result.stderr )
+
+    def test_runs_at_once( self ):
+        # with no room every run removes every branch, maybe the same ones
+        command = [sys.executable, program, '--libpath', libpath] + self.command + ['--fragment-cache-size', '0']
+        runs = []
+        for file_name in test_files:
+            runs.append( subprocess.Popen( command + [file_name, 'I1'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE ) )
+        for run in runs:
+            errors = run.communicate()[1]
+            self.assertEqual( run.returncode, 0, errors )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestMergePaths( unittest.TestCase ):
+    # the merged paths draw the same shapes as the element for each one
+
+    def shapes( self, output ):
+        # each outline by its colour, the separators, the circles and the names
+        results = collections.defaultdict( collections.Counter )
+        n_elements = 0
+        for element in ElementTree.fromstring( output ).iter():
+            tag = element.tag.split( '}' )[-1]
+            n_elements += 1
+            if tag == 'circle':
+               results['circles'][element.attrib['r']] += 1
+               continue
+            if tag != 'path' or 'id' in element.attrib:
+               continue
+            style = dict( [x.strip().split( ':' ) for x in element.attrib.get( 'style', '' ).split( ';' ) if x.strip()] )
+            fill = element.attrib.get( 'fill', style.get( 'fill', 'none' ) )
+            for part in re.findall( r'M[^M]*', re.sub( r'\s+', ' ', element.attrib['d'] ) ):
+                # the same numbers, with or without the spaces
+                part = tuple( re.findall( r'[A-Za-z]|[-0-9.]+', part ) )
+                if fill != 'none':
+                   results[fill][part] += 1
+                elif 'A' in part:
+                   # a circle as two half circle arcs
+                   results['circles'][part[4]] += 1
+                else:
+                   results['separators'][part] += 1
+        names = [x for x in svg_elements( output ).items() if x[0][0] in ['text', 'textPath'] or dict( x[0][1] ).get( 'id' )]
+        results['names'] = collections.Counter( dict( names ) )
+        return results, n_elements
+
+    def test_same_shapes( self ):
+        for file_name in [test_files[0], test_files[6]]:
+            for args in [['--flat'], ['--flat', '--dates', '--generations', '12']]:
+                with self.subTest( file=os.path.basename( file_name ), command=' '.join( args ) ):
+                   expected = run_chart( args + [file_name, 'I1'] )
+                   result = run_chart( args + ['--merge-paths', file_name, 'I1'] )
+                   self.assertEqual( result.returncode, 0, result.stderr )
+                   shapes, n_elements = self.shapes( result.stdout )
+                   expected_shapes, expected_elements = self.shapes( expected.stdout )
+                   self.assertEqual( shapes, expected_shapes )
+                   self.assertGreater( len( shapes['separators'] ), 0 )
+                   self.assertLess( n_elements, expected_elements )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestRecolour( unittest.TestCase ):
+    # only the colour style block is changed, as if made in the new colours
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def chart( self, args ):
+        result = run_chart( ['--colour-classes', '--generations', '12'] + args + [test_files[6], 'I1'] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        return result.stdout
+
+    def recolour( self, content, colour, name='chart.svg' ):
+        file_name = os.path.join( self.work_dir, name )
+        with open( file_name, 'wb' ) as outf:
+           outf.write( content )
+        result = run_chart( ['--recolour', '--colour', colour, file_name] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        return result.stdout
+
+    def without_style( self, content ):
+        return re.sub( rb'<style id="colours">.*?</style>', b'', content, flags=re.DOTALL )
+
+    def test_round_trip( self ):
+        for args in [[], ['--flat'], ['--flat', '--merge-paths']]:
+            with self.subTest( command=' '.join( args ) ):
+               standard = self.chart( args )
+               bw = self.chart( args + ['--colour', 'bw'] )
+               self.assertNotEqual( standard, bw )
+               self.assertEqual( self.without_style( standard ), self.without_style( bw ) )
+               recoloured = self.recolour( standard, 'bw' )
+               self.assertEqual( recoloured, bw )
+               self.assertEqual( self.recolour( recoloured, 'standard' ), standard )
+               self.assertEqual( self.recolour( gzip.compress( standard ), 'set3', 'chart.svgz' ), self.chart( args + ['--colour', 'set3'] ) )
+
+    def test_without_colour_classes( self ):
+        plain = run_chart( [test_files[6], 'I1'] ).stdout
+        file_name = os.path.join( self.work_dir, 'chart.svg' )
+        with open( file_name, 'wb' ) as outf:
+           outf.write( plain )
+        result = run_chart( ['--recolour', '--colour', 'bw', file_name] )
+        self.assertEqual( result.returncode, 1 )
+        self.assertEqual( result.stdout, b'' )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+@unittest.skipUnless( importlib.util.find_spec( 'numpy' ), 'NumPy not found' )
+class TestPreview( unittest.TestCase ):
+    # the preview is a whole png with the colours and circles of the chart
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def read_png( self, file_name ):
+        # the pixels of each row
+        with open( file_name, 'rb' ) as inf:
+           content = inf.read()
+        self.assertEqual( content[:8], b'\x89PNG\r\n\x1a\n' )
+        chunks = []
+        offset = 8
+        while offset < len( content ):
+            length = struct.unpack_from( '>I', content, offset )[0]
+            body = content[offset+4:offset+8+length]
+            self.assertEqual( struct.unpack_from( '>I', content, offset + 8 + length )[0], zlib.crc32( body ) )
+            chunks.append( [body[:4], body[4:]] )
+            offset += 12 + length
+        self.assertEqual( [chunks[0][0], chunks[-1]], [b'IHDR', [b'IEND', b'']] )
+        width, height, depth, colour_type = struct.unpack_from( '>IIBB', chunks[0][1] )
+        self.assertEqual( [depth, colour_type], [8, 2] )
+        data = zlib.decompress( b''.join( [body for kind, body in chunks if kind == b'IDAT'] ) )
+        self.assertEqual( len( data ), height * ( 3 * width + 1 ) )
+        rows = []
+        for y in range( height ):
+            row = data[y*(3*width+1):(y+1)*(3*width+1)]
+            self.assertEqual( row[0], 0 )
+            rows.append( [tuple( row[1+3*x:4+3*x] ) for x in range( width )] )
+        return width, height, rows
+
+    def test_colours_and_circles( self ):
+        white = ( 255, 255, 255 )
+        grey = ( 128, 128, 128 )
+        for file_name in [test_files[0], test_files[6]]:
+            for size in [100, 600]:
+                with self.subTest( file=os.path.basename( file_name ), size=size ):
+                   preview = os.path.join( self.work_dir, 'chart.png' )
+                   result = run_chart( ['--flat', '--generations', '12', '--preview', preview, '--preview-size', str( size ), file_name, 'I1'] )
+                   self.assertEqual( result.returncode, 0, result.stderr )
+                   width, height, rows = self.read_png( preview )
+                   self.assertEqual( [width, height], [size, size] )
+
+                   chart = result.stdout.decode( 'utf-8' )
+                   fills = set( [tuple( [int( c[i:i+2], 16 ) for i in [1, 3, 5]] ) for c in re.findall( r'fill:(#[0-9a-f]{6})', chart )] )
+                   circles = [float( r ) for r in re.findall( r'<circle [^>]* r="([0-9.]+)"', chart )]
+                   # names are darker blocks, partners over names darker again
+                   allowed = set()
+                   for colour in fills | {white, grey}:
+                       allowed.update( [colour, tuple( [c // 2 for c in colour] ), tuple( [c // 4 for c in colour] )] )
+                   scale = 600.0 / size
+                   seen = set()
+                   for y, row in enumerate( rows ):
+                       for x, pixel in enumerate( row ):
+                           radius = math.hypot( ( x + 0.5 ) * scale - 300.0, ( y + 0.5 ) * scale - 300.0 )
+                           if radius > max( circles ) + scale:
+                              self.assertEqual( pixel, white )
+                           elif min( [abs( radius - r ) for r in circles] ) < scale / 2.0:
+                              self.assertEqual( pixel, grey )
+                           self.assertIn( pixel, allowed )
+                           seen.add( pixel )
+                   if size == 600:
+                      self.assertEqual( fills - seen, set() )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestMaxElements( unittest.TestCase ):
+    # the slices and names drawn are no more than asked for, once there
+    # is room for each child of the top family with their branch collapsed
+
+    @classmethod
+    def setUpClass( cls ):
+        # families of up to four children with partners, eight generations
+        generator = random.Random( 1 )
+        lines = ['0 HEAD', '1 CHAR UTF-8']
+        n_people = [0]
+        n_fams = [0]
+
+        def add_person( famc ):
+            n_people[0] += 1
+            xref = '@I' + str( n_people[0] ) + '@'
+            lines.extend( ['0 ' + xref + ' INDI', '1 NAME Person' + str( n_people[0] ) + ' /Test/'] )
+            if famc:
+               lines.append( '1 FAMC ' + famc )
+            return xref
+
+        def add_family( gen, head ):
+            n_fams[0] += 1
+            fam = '@F' + str( n_fams[0] ) + '@'
+            lines.append( '1 FAMS ' + fam )
+            partner = add_person( None )
+            lines.append( '1 FAMS ' + fam )
+            children = []
+            for i in range( generator.choice( [0, 1, 2, 3, 4] ) if gen > 0 else 3 ):
+                child = add_person( fam )
+                if gen < 7 and generator.random() < 0.8:
+                   add_family( gen + 1, child )
+                children.append( child )
+            lines.extend( ['0 ' + fam + ' FAM', '1 HUSB ' + head, '1 WIFE ' + partner] )
+            lines.extend( ['1 CHIL ' + child for child in children] )
+
+        add_family( 0, add_person( None ) )
+        lines.append( '0 TRLR' )
+        cls.work_dir = tempfile.mkdtemp()
+        cls.tree_file = os.path.join( cls.work_dir, 'tree.ged' )
+        with open( cls.tree_file, 'w' ) as outf:
+           outf.write( '\n'.join( lines ) + '\n' )
+
+    @classmethod
+    def tearDownClass( cls ):
+        shutil.rmtree( cls.work_dir )
+
+    def count( self, file_name, args ):
+        # slices and names drawn, and the branches collapsed
+        result = run_chart( ['--flat', '--generations', '12', '--stats'] + args + [file_name, 'I1'] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        n_elements = 0
+        n_wedges = 0
+        for element in ElementTree.fromstring( result.stdout ).iter():
+            tag = element.tag.split( '}' )[-1]
+            if tag == 'text' or ( tag == 'path' and 'fill:#' in element.attrib.get( 'style', '' ) ):
+               n_elements += 1
+            if tag == 'textPath' and ' descendants, generation' in element.text:
+               n_wedges += 1
+        collapsed = re.search( rb'branches collapsed: (\d+)', result.stderr )
+        if collapsed:
+           self.assertEqual( int( collapsed.group( 1 ) ), n_wedges )
+        return n_elements, n_wedges
+
+    def test_within_budget( self ):
+        for file_name in [test_files[0], test_files[6], self.tree_file]:
+            full = self.count( file_name, [] )[0]
+            least = self.count( file_name, ['--max-elements', '1'] )[0]
+            self.assertLess( least, full )
+            for budget in sorted( set( [least - 1, least, least + 10, full // 4, full // 2, full - 1, full, 2 * full] ) ):
+                with self.subTest( file=os.path.basename( file_name ), budget=budget ):
+                   n_elements, n_wedges = self.count( file_name, ['--max-elements', str( budget )] )
+                   if budget < least:
+                      self.assertEqual( n_elements, least )
+                   else:
+                      self.assertLessEqual( n_elements, budget )
+                   if budget >= full:
+                      self.assertEqual( [n_elements, n_wedges], [full, 0] )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestCanvas( unittest.TestCase ):
+    # the packed chart read as the page reads it, column by column
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def read_buffer( self, content ):
+        self.assertEqual( content[:4], b'FANC' )
+        version, n_sectors, n_labels, n_lines, n_rings, n_text = struct.unpack_from( '<6I', content, 4 )
+        self.assertEqual( version, 1 )
+        offset = [36]
+
+        def column( kind, count ):
+            # a typed array has to start on a multiple of its size
+            self.assertEqual( offset[0] % 4, 0 )
+            size = struct.calcsize( '<' + kind )
+            values = struct.unpack_from( '<' + str( count ) + kind, content, offset[0] )
+            offset[0] += size * count + ( -size * count % 4 )
+            return values
+
+        chart = {'center':struct.unpack_from( '<2f', content, 28 )}
+        chart['angles'] = column( 'f', 2 * n_sectors )
+        chart['radii'] = column( 'f', 2 * n_sectors )
+        chart['colours'] = column( 'B', n_sectors )
+        chart['labels'] = column( 'f', 6 * n_labels )
+        chart['refs'] = column( 'I', 3 * n_labels )
+        chart['lines'] = column( 'f', 3 * n_lines )
+        chart['rings'] = column( 'f', n_rings )
+        text = bytes( column( 'B', n_text ) )
+        self.assertEqual( offset[0] - ( -n_text % 4 ), len( content ) )
+        chart['text'] = []
+        for i in range( n_labels ):
+            start, length, straight = chart['refs'][3*i:3*i+3]
+            self.assertLessEqual( start + length, n_text )
+            self.assertIn( straight, [0, 1] )
+            chart['text'].append( text[start:start+length].decode( 'utf-8' ) )
+        return chart
+
+    def test_same_as_chart( self ):
+        unaligned = 0
+        for file_name in test_files:
+            for args in [[], ['--dates', '--generations', '12']]:
+                with self.subTest( file=os.path.basename( file_name ), command=' '.join( args ) ):
+                   page = os.path.join( self.work_dir, 'chart.html' )
+                   result = run_chart( ['--flat', '--canvas', page] + args + [file_name, 'I1'] )
+                   self.assertEqual( result.returncode, 0, result.stderr )
+                   with open( os.path.join( self.work_dir, 'chart.bin' ), 'rb' ) as inf:
+                      chart = self.read_buffer( inf.read() )
+
+                   svg = result.stdout.decode( 'utf-8' )
+                   slices = re.findall( r'style="stroke:grey; stroke-width:2; fill:', svg )
+                   separators = re.findall( r'style="stroke:grey; stroke-width:2;" />', svg )
+                   names = [html.unescape( x ) for x in re.findall( r'<textPath [^>]*>([^<]*)</textPath>', svg )]
+                   circles = [float( r ) for r in re.findall( r'<circle [^>]* r="([0-9.]+)"', svg )]
+                   self.assertEqual( chart['center'], ( 300.0, 300.0 ) )
+                   self.assertEqual( len( chart['colours'] ), len( slices ) )
+                   self.assertEqual( len( chart['lines'] ), 3 * len( separators ) )
+                   self.assertEqual( sorted( chart['text'] ), sorted( names ) )
+                   self.assertEqual( [round( r, 2 ) for r in chart['rings']], circles )
+                   self.assertLess( max( chart['colours'] ), 9 )
+                   if len( slices ) % 4:
+                      unaligned += 1
+        # the colour bytes were padded
+        self.assertGreater( unaligned, 0 )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestHitIndex( unittest.TestCase ):
+    # a binary search of each layer finds who a look at every part finds
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def search( self, index, r, angle ):
+        # as described in the README
+        found = []
+        for layer in index['layers']:
+            i = bisect.bisect_right( layer['starts'], angle ) - 1
+            if i >= 0 and angle < layer['ends'][i] and layer['inner'][i] <= r < layer['outer'][i]:
+               found.append( [layer['ring'], layer['kind'], layer['indi'][i], layer['fam'][i]] )
+        return sorted( found, key=str )
+
+    def brute_force( self, index, r, angle ):
+        found = []
+        for layer in index['layers']:
+            for start, end, inner, outer, indi, fam in zip( *[layer[x] for x in ['starts', 'ends', 'inner', 'outer', 'indi', 'fam']] ):
+                if start <= angle < end and inner <= r < outer:
+                   found.append( [layer['ring'], layer['kind'], indi, fam] )
+        return sorted( found, key=str )
+
+    def test_same_as_brute_force( self ):
+        generator = random.Random( 1 )
+        for file_name in test_files:
+            with self.subTest( file=os.path.basename( file_name ) ):
+               index_file = os.path.join( self.work_dir, 'hits.json' )
+               result = run_chart( ['--flat', '--generations', '12', '--hit-index', index_file, file_name, 'I1'] )
+               self.assertEqual( result.returncode, 0, result.stderr )
+               with open( index_file, encoding='utf-8' ) as inf:
+                  index = json.load( inf )
+
+               # one part for each name in the chart, some split across the top
+               parts = set()
+               points = []
+               for layer in index['layers']:
+                   self.assertEqual( layer['starts'], sorted( layer['starts'] ) )
+                   for i in range( len( layer['starts'] ) ):
+                       parts.add( (layer['ring'], layer['kind'], layer['indi'][i], layer['fam'][i]) )
+                       self.assertTrue( 0.0 <= layer['starts'][i] < layer['ends'][i] <= 360.0 )
+                       if i > 0:
+                          # the parts of a layer don't overlap
+                          self.assertLessEqual( layer['ends'][i-1], layer['starts'][i] )
+                       # on the edges of each part and inside it
+                       middle = ( layer['inner'][i] + layer['outer'][i] ) / 2.0
+                       for angle in [layer['starts'][i], layer['ends'][i], ( layer['starts'][i] + layer['ends'][i] ) / 2.0]:
+                           for r in [layer['inner'][i], middle, layer['outer'][i]]:
+                               points.append( [r, angle % 360.0] )
+               self.assertEqual( len( parts ), len( re.findall( r'<textPath ', result.stdout.decode( 'utf-8' ) ) ) )
+
+               for i in range( 2000 ):
+                   points.append( [generator.uniform( 0.0, max( index['rings'] ) + 10.0 ), generator.uniform( 0.0, 360.0 )] )
+               n_found = 0
+               for r, angle in points:
+                   found = self.search( index, r, angle )
+                   self.assertEqual( found, self.brute_force( index, r, angle ) )
+                   n_found += len( found ) > 0
+               self.assertGreater( n_found, len( points ) / 2 )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestPdf( unittest.TestCase ):
+    # the pdf can be read from its cross reference table and has the font subset
+
+    def read_objects( self, content ):
+        # each object from the offsets in the xref table
+        start = int( content.rsplit( b'startxref', 1 )[1].split()[0] )
+        self.assertTrue( content[start:].startswith( b'xref\n' ) )
+        lines = content[start:].split( b'\n' )
+        first, count = [int( x ) for x in lines[1].split()]
+        self.assertEqual( [first, lines[2]], [0, b'0000000000 65535 f '] )
+        bodies = dict()
+        for number in range( 1, count ):
+            offset = int( lines[2 + number].split()[0] )
+            header = str( number ).encode( 'latin-1' ) + b' 0 obj\n'
+            self.assertEqual( content[offset:offset+len( header )], header )
+            bodies[number] = content[offset+len( header ):]
+        objects = dict()
+        for number, body in bodies.items():
+            if body.startswith( b'<<' ) and b'>>\nstream\n' in body.split( b'endobj', 1 )[0]:
+               dictionary, body = body.split( b'stream\n', 1 )
+               # the length of the page content is its own object
+               length = re.search( rb'/Length (\d+) 0 R', dictionary )
+               if length:
+                  length = int( bodies[int( length.group( 1 ) )].split()[0] )
+               else:
+                  length = int( re.search( rb'/Length (\d+)', dictionary ).group( 1 ) )
+               data = body[:length]
+               self.assertTrue( body[len( data ):].startswith( b'\nendstream\nendobj' ) )
+               objects[number] = [dictionary, zlib.decompress( data )]
+            else:
+               objects[number] = [body.split( b'\nendobj', 1 )[0], None]
+        trailer = b'<< /Size ' + str( count ).encode( 'latin-1' )
+        self.assertEqual( lines[-6:], [b'trailer', lines[-5], b'startxref', str( start ).encode( 'latin-1' ), b'%%EOF', b''] )
+        self.assertTrue( lines[-5].startswith( trailer + b' /Root ' ) )
+        return objects
+
+    def glyph_outlines( self, font ):
+        # the outline of every glyph by glyph id
+        tables = dict()
+        for i in range( struct.unpack_from( '>H', font, 4 )[0] ):
+            tag, _, offset, length = struct.unpack_from( '>4sIII', font, 12 + 16 * i )
+            tables[tag] = font[offset:offset+length]
+        n_glyphs = struct.unpack_from( '>H', tables[b'maxp'], 4 )[0]
+        if struct.unpack_from( '>h', tables[b'head'], 50 )[0] == 1:
+           loca = struct.unpack_from( '>' + str( n_glyphs + 1 ) + 'I', tables[b'loca'] )
+        else:
+           loca = [2 * x for x in struct.unpack_from( '>' + str( n_glyphs + 1 ) + 'H', tables[b'loca'] )]
+        return [tables[b'glyf'][loca[g]:loca[g+1]].rstrip( b'\0' ) for g in range( n_glyphs )]
+
+    def test_embedded_subset( self ):
+        font_file = find_ttf()
+        if font_file is None:
+           self.skipTest( 'no TrueType font found' )
+        with open( font_file, 'rb' ) as inf:
+           original = inf.read()
+        result = run_chart( ['--pdf', '--font-file', font_file, test_files[6], 'I1'] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        self.assertTrue( result.stdout.startswith( b'%PDF-1.4\n' ) )
+        objects = self.read_objects( result.stdout )
+
+        fonts = [x for x in objects.values() if b'/Subtype /Type0' in x[0]]
+        self.assertEqual( len( fonts ), 1 )
+        self.assertIn( b'/Encoding /Identity-H', fonts[0][0] )
+        cid_font = objects[int( re.search( rb'/DescendantFonts \[(\d+) 0 R\]', fonts[0][0] ).group( 1 ) )][0]
+        used = [int( x ) for x in re.findall( rb'(\d+) \[\d+\]', cid_font.split( b'/W [', 1 )[1] )]
+        descriptor = objects[int( re.search( rb'/FontDescriptor (\d+) 0 R', cid_font ).group( 1 ) )][0]
+        subset = objects[int( re.search( rb'/FontFile2 (\d+) 0 R', descriptor ).group( 1 ) )][1]
+
+        # a whole font file, checksum and all
+        padded = subset + b'\0' * ( -len( subset ) % 4 )
+        self.assertEqual( sum( struct.unpack( '>' + str( len( padded ) // 4 ) + 'I', padded ) ) & 0xFFFFFFFF, 0xB1B0AFBA )
+        self.assertLess( len( subset ), len( original ) )
+
+        # the used glyphs are as they were, the rest are gone or kept as parts
+        kept = self.glyph_outlines( subset )
+        outlines = self.glyph_outlines( original )
+        self.assertEqual( len( kept ), len( outlines ) )
+        self.assertGreater( len( used ), 10 )
+        for glyph in used:
+            self.assertEqual( kept[glyph], outlines[glyph] )
+        for glyph, outline in enumerate( kept ):
+            self.assertIn( outline, [b'', outlines[glyph]] )
+        self.assertLess( len( [x for x in kept if x] ), len( [x for x in outlines if x] ) )
+
+        # the names can be found in the text
+        to_unicode = objects[int( re.search( rb'/ToUnicode (\d+) 0 R', fonts[0][0] ).group( 1 ) )][1]
+        self.assertEqual( len( re.findall( rb'\n<[0-9A-F]{4}> <[0-9A-F]+>', to_unicode ) ), len( used ) )
+
+    def test_default_font( self ):
+        # without a font found there is a warning rather than an embedded font
+        result = run_chart( ['--pdf', test_files[6], 'I1'] )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        objects = self.read_objects( result.stdout )
+        embedded = any( [b'/FontFile2' in x[0] for x in objects.values()] )
+        self.assertEqual( b'without embedding' in result.stderr, not embedded )
+
+    def test_option_conflicts( self ):
+        for args in [['--compact'], ['--merge-paths'], ['--share-subtrees'], ['--colour-classes']]:
+            with self.subTest( command=' '.join( args ) ):
+               result = run_chart( ['--pdf'] + args + [test_files[6], 'I1'] )
+               self.assertEqual( result.returncode, 1 )
+               self.assertTrue( result.stderr.startswith( b'PDF output can not be used with' ), result.stderr )
+               self.assertEqual( result.stdout, b'' )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestHtml( unittest.TestCase ):
+    # the page and the fragments together are the flat chart
+
+    def setUp( self ):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.work_dir )
+
+    def test_same_as_flat_chart( self ):
+        for file_name in [test_files[0], test_files[6]]:
+            for args in [['--inline-generations', '1'], ['--inline-generations', '2', '--dates'], []]:
+                with self.subTest( file=os.path.basename( file_name ), command=' '.join( args ) ):
+                   expected = run_chart( ['--flat', '--generations', '12'] + args[2:] + [file_name, 'I1'] )
+                   page_file = os.path.join( self.work_dir, 'chart.html' )
+                   result = run_chart( ['--generations', '12', '--output', page_file] + args + [file_name, 'I1'] )
+                   self.assertEqual( result.returncode, 0, result.stderr )
+                   with open( page_file, encoding='utf-8' ) as inf:
+                      page = inf.read()
+                   elements = svg_elements( page[page.index( '<svg' ):page.index( '</svg>' ) + 6] )
+                   folder = os.path.join( self.work_dir, 'chart-parts' )
+                   if args:
+                      self.assertNotEqual( os.listdir( folder ), [] )
+                   for name in os.listdir( folder ):
+                       with open( os.path.join( folder, name ), encoding='utf-8' ) as inf:
+                          elements += svg_elements( inf.read() )
+                   self.assertEqual( elements, svg_elements( expected.stdout ) )
+                   shutil.rmtree( folder )
+
+    def test_option_conflicts( self ):
+        for args in [['--compress'], ['--compact'], ['--merge-paths'], ['--share-subtrees']]:
+            with self.subTest( command=' '.join( args ) ):
+               result = run_chart( ['--output', os.path.join( self.work_dir, 'chart.html' )] + args + [test_files[6], 'I1'] )
+               self.assertEqual( result.returncode, 1 )
+               self.assertTrue( result.stderr.startswith( b'HTML output can not be made with' ), result.stderr )
+               self.assertEqual( os.listdir( self.work_dir ), [] )
+
+
+@unittest.skipUnless( has_library, 'readgedcom not found' )
+class TestViewport( unittest.TestCase ):
+    # each part of a wedge is as it is in the whole chart, and wedges
+    # around the circle make up the whole chart
+
+    def elements( self, args ):
+        # Without the generation circles, which a wedge draws as arcs. The
+        # name paths are numbered as drawn, so a name is known by its path.
+        result = run_chart( ['--flat', '--generations', '12'] + args )
+        self.assertEqual( result.returncode, 0, result.stderr )
+        root = ElementTree.fromstring( result.stdout )
+        paths = dict()
+        for element in root.iter( '{http://www.w3.org/2000/svg}path' ):
+            if 'id' in element.attrib:
+               paths['#' + element.attrib['id']] = element.attrib['d']
+        results = collections.Counter()
+        for element in root.iter():
+            tag = element.tag.split( '}' )[-1]
+            attributes = dict( [[k.split( '}' )[-1], v] for k, v in element.attrib.items()] )
+            if tag in ['svg', 'g', 'textPath', 'circle'] or 'id' in attributes or attributes.get( 'fill' ) == 'none':
+               continue
+            for part in element:
+                # the text with its size and where it is
+                part_attributes = dict( [[k.split( '}' )[-1], v] for k, v in part.attrib.items()] )
+                attributes['path'] = paths[part_attributes.pop( 'href' )]
+                attributes.update( part_attributes )
+                element = part
+            results[(tag, str( sorted( attributes.items() ) ), ( element.text or '' ).strip())] += 1
+        return results
+
+    def test_same_as_whole_chart( self ):
+        for file_name in [test_files[0], test_files[6]]:
+            whole = self.elements( [file_name, 'I1'] )
+            for ranges in [[['--angle-range', '0:360']], [['--angle-range', '0:120'], ['--angle-range', '120:240'], ['--angle-range', '240:0']],
+                           [['--angle-range', '300:30'], ['--angle-range', '30:300']], [['--generation-range', '1:3'], ['--generation-range', '4:12']],
+                           [['--generation-range', '1:2', '--angle-range', '0:180'], ['--generation-range', '1:2', '--angle-range', '180:360'], ['--generation-range', '3:12']]]:
+                with self.subTest( file=os.path.basename( file_name ), ranges=ranges ):
+                   found = collections.Counter()
+                   for args in ranges:
+                       part = self.elements( args + [file_name, 'I1'] )
+                       self.assertEqual( part - whole, collections.Counter() )
+                       # a slice across the edge of a wedge is in both
+                       found |= part
+                   self.assertEqual( found, whole )
+
+    def test_no_shared_subtrees( self ):
+        for args in [['--angle-range', '0:90'], ['--generation-range', '2:4']]:
+            with self.subTest( command=' '.join( args ) ):
+               result = run_chart( ['--share-subtrees'] + args + [test_files[6], 'I1'] )
+               self.assertEqual( result.returncode, 1 )
+               self.assertTrue( result.stderr.startswith( b'Shared subtrees can not be used' ), result.stderr )
+
+
+class TestTileIndex( unittest.TestCase ):
+    # the parts found for a tile are those a look at every part would find
+
+    def brute_force( self, functions, tile_parts, view ):
+        r_min, r_max, angle_ranges = functions['tile_polar_range']( view[0], view[1], view[0] + view[2], view[1] + view[3] )
+        found = []
+        for i, part in enumerate( tile_parts ):
+            if part[3] < r_min or part[2] > r_max:
+               continue
+            if part[1] - part[0] >= 360.0:
+               found.append( i )
+               continue
+            for low, high in angle_ranges:
+                if any( [part[0] + shift < high and part[1] + shift > low for shift in [-720.0, -360.0, 0.0, 360.0, 720.0]] ):
+                   found.append( i )
+                   break
+        return found
+
+    def test_overlapping_parts( self ):
+        generator = random.Random( 1 )
+        rings = [{'outer':50.0 * ( n + 1 )} for n in range( 6 )]
+        for trial in range( 20 ):
+            tile_parts = [[0.0, 360.0, 0.0, 50.0, 'center']]
+            for i in range( 300 ):
+                # parts of any size anywhere, as with pedigree collapse
+                ring = generator.randrange( 1, 6 )
+                start = generator.uniform( -400.0, 400.0 )
+                span = generator.choice( [generator.uniform( 0.1, 5.0 ), generator.uniform( 5.0, 200.0 )] )
+                n_rings = generator.choice( [1, 1, 1, 2] )
+                tile_parts.append( [start, start + span, 50.0 * ring, 50.0 * min( ring + n_rings, 6 ), str( i )] )
+            functions = program_functions( ['build_tile_index', 'tile_polar_range', 'find_tile_parts'], {'tile_parts':tile_parts, 'cx':300.0, 'cy':300.0} )
+            index = functions['build_tile_index']( rings )
+            views = []
+            for rows, cols in [[1, 1], [2, 2], [5, 7]]:
+                for row in range( rows ):
+                    for col in range( cols ):
+                        views.append( [col * 600.0 / cols - 5.0, row * 600.0 / rows - 5.0, 600.0 / cols + 10.0, 600.0 / rows + 10.0] )
+            for view in views:
+                with self.subTest( trial=trial, view=view ):
+                   self.assertEqual( functions['find_tile_parts']( index, view ), self.brute_force( functions, tile_parts, view ) )
+
+    @unittest.skipUnless( has_library, 'readgedcom not found' )
+    def test_option_conflicts( self ):
+        work_dir = tempfile.mkdtemp()
+        try:
+           for args in [['--compact'], ['--merge-paths'], ['--share-subtrees']]:
+               with self.subTest( command=' '.join( args ) ):
+                  result = run_chart( ['--tiles', '2x2', '--output', os.path.join( work_dir, 'chart.svg' )] + args + [test_files[6], 'I1'] )
+                  self.assertEqual( result.returncode, 1 )
+                  self.assertTrue( result.stderr.startswith( b'Tiles can not be made with' ), result.stderr )
+                  self.assertEqual( os.listdir( work_dir ), [] )
+        finally:
+           shutil.rmtree( work_dir )
+
+
+if __name__ == '__main__':
+   unittest.main()